@@ -1,6 +1,7 @@
 import setup_path
 import airsim
 from appBase import *
+from asyncAppBase import *
 from msg import *
 from ctrl import *
 '''
@@ -22,3 +23,21 @@ class GcsApp(GcsAppBase):
     # def run(self, *args, **kwargs):
         # return super().run(*args, **kwargs)
         # or implement your task
+
+
+class AsyncUavApp(AsyncUavAppBase):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # any self.attribute that you need
+    # async def run(self, *args, **kwargs):
+        # return await super().run(*args, **kwargs)
+        # or implement your task
+
+
+class AsyncGcsApp(AsyncGcsAppBase):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # any self.attribute that you need
+    # async def run(self, *args, **kwargs):
+        # return await super().run(*args, **kwargs)
+        # or implement your task
@@ -6,18 +6,24 @@ import re
 import threading
 import queue
 import time
-import cv2
+import math
 
 import setup_path
 import airsim
 import numpy as np
-import matplotlib.pyplot as plt
 from appProtocolBase import MsgBase
 from ctrl import *
 from msg import *
 from router import Flow, mainRouter
+from capture import mainCapture
+from rpcpool import mainClientPool
+from pipeline import DecodePipeline
+from sink import makeSink
+from scenario import SCENARIO # may be overridden by main.py --scenario NAME=VALUE (see sweep.py)
 
 TARGET = 'stream' # 'selftest' | 'stream' | 'throughput'
+RUNTIME = 'thread' # 'thread' (one thread per app) | 'async' (see asyncAppBase.py)
+SINK = 'null' # where GCS streamingTest puts frames: 'null' | 'ring' | 'video' | 'file' | 'display' (see sink.py)
 DIST = 0
 PERIOD = 0.01
 
@@ -54,15 +60,37 @@ class AppBase(metaclass=abc.ABCMeta):
             f = Flow(self.name, toName, obj)
             f.start()
             return f       
+    def GetPose(self):
+        '''
+        return airsim.Pose of this UAV at the current step from Ctrl.GetKinematics(), no RPC
+        '''
+        state = Ctrl.GetKinematics(self.name)
+        return airsim.Pose(airsim.Vector3r(*state[FLEET_POS]), airsim.Quaternionr(*state[FLEET_ORIENT]))
     def Rx(self, block=False, timeout=None):
         '''
         @param block: bool, True than block until a msg has arrived (usually False)
+        @param timeout: in wall seconds, use RxUntil() to wait in sim time
         
         return None if msg is not fully received
         else
         return (src, msg)
         '''      
         return mainRouter.recv(self.name, block=block, timeout=timeout)
+    def RxUntil(self, deadline):
+        '''
+        Park until a msg has arrived or the clock reaches deadline (sim time)
+        return (src, msg), or None at deadline or once the simulation is over
+        '''
+        while True:
+            ret = self.Rx()
+            if ret is not None or len(self.Select([], deadline)) == 0:
+                return ret
+    def Select(self, flows, deadline=math.inf):
+        '''
+        Park until a msg has arrived, any of flows is delivered or the clock reaches deadline (sim time)
+        return [ready sources], self.name if a msg is waiting for Rx(), empty at deadline or once the simulation is over
+        '''
+        return mainRouter.select([self.name] + list(flows), deadline)
 
 class UavAppBase(AppBase, threading.Thread):
     '''
@@ -102,10 +130,9 @@ class UavAppBase(AppBase, threading.Thread):
         
         reply = None
         while Ctrl.ShouldContinue():
-            reply = self.Rx()
+            reply = self.RxUntil(Ctrl.GetEndTime())
             if reply is not None:
                 print(f'{self.name} recv: {reply[1].data} at time {Ctrl.GetSimTime()}')
-            Ctrl.Wait(0.01)
     def staticThroughputTest(self, dist, period, **kwargs):
         '''
         Run throughput test at application level
@@ -114,9 +141,8 @@ class UavAppBase(AppBase, threading.Thread):
         '''
         delay = 1.0
         Ctrl.Wait(delay)
-        client = airsim.MultirotorClient()
-        client.confirmConnection()
-        pose = client.simGetVehiclePose(vehicle_name=self.name)
+        client = mainClientPool.proxy()
+        pose = self.GetPose()
         pose.position.x_val = dist
         
         total = 0
@@ -132,19 +158,21 @@ class UavAppBase(AppBase, threading.Thread):
         '''
         Test Msg Level streaming back to GCS
         '''
-        client = airsim.MultirotorClient()
-        client.confirmConnection()
+        client = mainClientPool.proxy()
         client.enableApiControl(True, vehicle_name=self.name)
         client.armDisarm(True, vehicle_name=self.name)
         
         delay = 1.0
         Ctrl.Wait(delay)
-        while Ctrl.ShouldContinue():
-            Ctrl.Wait(0.1)
-            with Ctrl.Frozen():
-                rawImage = client.simGetImage("0", airsim.ImageType.Scene, vehicle_name=self.name)
-                msg = MsgImg(rawImage, Ctrl.GetSimTime())
+        # every UAV captures at the same tick, the clock waits for all of them at once
+        tick = Ctrl.JoinTick(0.1)
+        while tick.wait() and Ctrl.ShouldContinue():
+            # batched with other UAVs capturing at the same step
+            rawImage = mainCapture.getImage(self.name, "0", airsim.ImageType.Scene)
+            msg = MsgImg(rawImage, Ctrl.GetSimTime())
+            tick.arrive()
             self.Tx(msg)
+        tick.leave()
     def run(self, *args, **kwargs):
         if TARGET == 'selftest':
             self.selfTest(*args, **kwargs)
@@ -153,6 +181,7 @@ class UavAppBase(AppBase, threading.Thread):
         elif TARGET == 'stream':
             self.streamingTest(*args, **kwargs);
         print(f'{self.name} joined')
+        Ctrl.lockstep.leave()
 
 class GcsAppBase(AppBase, threading.Thread):
     '''
@@ -181,10 +210,9 @@ class GcsAppBase(AppBase, threading.Thread):
         self.Tx(msgs, 'B')
         
         while Ctrl.ShouldContinue():
-            reply = self.Rx()
+            reply = self.RxUntil(Ctrl.GetEndTime())
             if reply is not None:
                 print(f'{self.name} recv: {reply[1].data}  at time {Ctrl.GetSimTime()}')
-            Ctrl.Wait(0.01)
     def staticThroughputTest(self, *args, **kwargs):
         '''
         Run throughput test at application level
@@ -195,33 +223,35 @@ class GcsAppBase(AppBase, threading.Thread):
         Ctrl.Wait(delay)
         t0 = Ctrl.GetSimTime()
         while Ctrl.ShouldContinue():
-            msg = self.Rx()
+            msg = self.RxUntil(Ctrl.GetEndTime())
             if msg is not None:
                 addr, msg = msg
                 total += len(msg.data)
         print(f'GCS recv {total}, throughput = {total*8/1000/1000/(Ctrl.GetEndTime()-(t0))}')
+        for (src, dst), m in mainRouter.metrics.query(dst=self.name).items():
+            print(f'{src} -> {dst}: goodput = {m["goodput"]/1000/1000:.3f} Mbps, latency = {m["latency"]}, queueing = {m["queueing"]}')
     def streamingTest(self, **kwargs):
         '''
         Test Msg Level streaming back to GCS
+        Frames are decoded by DecodePipeline and rendered or recorded by the sink at its own rate,
+        this thread only receives
         '''
         delay = 1.0
         Ctrl.Wait(delay)
-        fig = None
+        sink = makeSink(SINK)
+        pipeline = DecodePipeline(sink=sink)
+        isStarted = False
         while Ctrl.ShouldContinue():
-            reply = self.Rx()
+            reply = self.RxUntil(Ctrl.GetEndTime())
             if reply is not None:
                 name, reply = reply
-                png = cv2.imdecode(airsim.string_to_uint8_array(reply.png), cv2.IMREAD_UNCHANGED)
-                png = cv2.cvtColor(png, cv2.COLOR_BGRA2BGR)
-                if fig is None:
-                    fig = plt.imshow(png)
+                pipeline.submit(name, reply.png, reply.timestamp)
+                if not isStarted:
+                    isStarted = True
                     Ctrl.SetEndTime(Ctrl.GetSimTime() + 2.0)
-                else:
-                    fig.set_data(png)
-            else:
-                plt.pause(0.1)
-            plt.draw()
-        plt.clf()
+        pipeline.close()
+        sink.close()
+        print(f'{self.name} decoding {pipeline.stats()}, sink {sink.stats()}')
     def run(self, *args, **kwargs):
         if TARGET == 'selftest':
             self.selfTest(*args, **kwargs)
@@ -229,4 +259,5 @@ class GcsAppBase(AppBase, threading.Thread):
             self.staticThroughputTest(*args, **kwargs)
         elif TARGET == 'stream':
             self.streamingTest(*args, **kwargs);
-        print(f'{self.name} joined')
\ No newline at end of file
+        print(f'{self.name} joined')
+        Ctrl.lockstep.leave()
\ No newline at end of file
@@ -2,13 +2,83 @@ import abc
 import sys
 from enum import Enum
 import hashlib
+import struct
+import pickle
+import numpy as np
 
 MOUDLE_DEBUG = False
 
+# Codec frame = MSG_HEADER + payload, see MsgBase.encode() and msg.decode()
+MSG_HEADER = struct.Struct('<BBxxId') # type id, flags, payload length, timestamp
+MSG_FLAG_OOB = 0x1 # payload is made by dumpsOob(), only decoded for types with allowPickle
+MSG_FLAG_ARRAY = 0x2 # payload is made by dumpsArray()
+OOB_HEADER = struct.Struct('<II') # pickle length, number of out-of-band buffers
+OOB_LENGTH = struct.Struct('<Q')
+ARRAY_HEADER = struct.Struct('<8sB') # dtype.str, ndim, followed by ndim OOB_LENGTH of shape
+
+def dumpsOob(obj):
+    '''
+    pickle protocol 5 with out-of-band buffers, so numpy arrays are not copied into the pickle
+    return a list of bytes-like parts to be concatenated
+    '''
+    buffers = []
+    data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    parts = [OOB_HEADER.pack(len(data), len(buffers)), data]
+    for buf in buffers:
+        view = buf.raw()
+        parts.append(OOB_LENGTH.pack(view.nbytes))
+        parts.append(view)
+    return parts
+def loadsOob(view):
+    '''
+    inverse of dumpsOob(), arrays refer to view instead of being copied
+    '''
+    view = memoryview(view)
+    length, numBuffers = OOB_HEADER.unpack_from(view, 0)
+    offset = OOB_HEADER.size
+    data = view[offset:offset+length]
+    offset += length
+    buffers = []
+    for i in range(numBuffers):
+        (n,) = OOB_LENGTH.unpack_from(view, offset)
+        offset += OOB_LENGTH.size
+        buffers.append(view[offset:offset+n])
+        offset += n
+    return pickle.loads(data, buffers=buffers)
+def dumpsArray(array):
+    '''
+    raw form of a numpy array of plain numbers: dtype, shape then the data, no pickle
+    return a list of bytes-like parts to be concatenated
+    '''
+    array = np.asarray(array)
+    if not array.flags.c_contiguous:
+        array = array.copy(order='C')
+    if array.dtype.hasobject or array.dtype.fields is not None:
+        raise TypeError(f'arrays of {array.dtype} have no raw form')
+    parts = [ARRAY_HEADER.pack(array.dtype.str.encode(), array.ndim)]
+    parts += [OOB_LENGTH.pack(n) for n in array.shape]
+    parts.append(array.reshape(-1).view(np.uint8))
+    return parts
+def loadsArray(view):
+    '''
+    inverse of dumpsArray(), the array refers to view instead of being copied
+    '''
+    view = memoryview(view)
+    dtype, ndim = ARRAY_HEADER.unpack_from(view, 0)
+    offset = ARRAY_HEADER.size
+    shape = []
+    for i in range(ndim):
+        shape.append(OOB_LENGTH.unpack_from(view, offset)[0])
+        offset += OOB_LENGTH.size
+    return np.frombuffer(view[offset:], dtype=np.dtype(dtype.rstrip(b'\0').decode())).reshape(shape)
+
 class MsgBase(metaclass=abc.ABCMeta):
     '''
     # // Any application Msg should inherit this
+    A subclass either overrides payload()/FromPayload() with a raw form (see dumpsArray())
+    or sets allowPickle = True, received bytes are never unpickled otherwise
     '''
+    allowPickle = False
     @abc.abstractmethod
     def GetTypeId(self):
         '''
@@ -34,5 +104,57 @@ class MsgBase(metaclass=abc.ABCMeta):
     def __str__(self):
         return NotImplemented
     
+    def payload(self):
+        '''
+        return (flags, parts), parts is a list of bytes-like objects framed by encode()
+        Default to pickle with out-of-band buffers if the class sets allowPickle
+        '''
+        if not self.allowPickle:
+            raise TypeError(f'{type(self).__name__} has no raw codec, override payload()/FromPayload() or set allowPickle = True')
+        return MSG_FLAG_OOB, dumpsOob(self)
+    @classmethod
+    def FromPayload(cls, payload, timestamp, flags):
+        '''
+        inverse of payload(), payload is a memoryview into the received frame
+        '''
+        if not cls.allowPickle:
+            raise ValueError(f'{cls.__name__} does not accept pickled payloads')
+        return loadsOob(payload)
+    def encode(self):
+        '''
+        return MSG_HEADER + payload() as bytes
+        the header carries GetTypeId(), payload length and self.timestamp (0.0 if absent)
+        '''
+        flags, parts = self.payload()
+        length = sum(memoryview(part).nbytes for part in parts)
+        header = MSG_HEADER.pack(self.GetTypeId(), flags, length, getattr(self, 'timestamp', 0.0))
+        return b''.join([header] + parts)
+    def wire_size(self):
+        '''
+        return the number of bytes this obj occupies on the wire
+        Default to the length of serialized(), override it if it can be known without serializing
+        '''
+        return len(self.serialized())
+    def serialized(self):
+        '''
+        Memoized serialize()
+        Setting any attribute invalidates it, call invalidate() after in-place changes
+        (for example modifying a numpy array attribute)
+        '''
+        wire = self.__dict__.get('_wire')
+        if wire is None:
+            wire = self.serialize()
+            self.__dict__['_wire'] = wire
+        return wire
+    def invalidate(self):
+        self.__dict__.pop('_wire', None)
+    def __setattr__(self, name, value):
+        self.__dict__.pop('_wire', None)
+        super().__setattr__(name, value)
+    def __getstate__(self):
+        # cached wire form is never pickled
+        state = self.__dict__.copy()
+        state.pop('_wire', None)
+        return state
     def __len__(self):
-        return len(self.serialize())
\ No newline at end of file
+        return self.wire_size()
\ No newline at end of file
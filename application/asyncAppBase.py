@@ -0,0 +1,267 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import setup_path
+import airsim
+from ctrl import *
+from msg import *
+from router import Flow, mainRouter, stamp
+from capture import mainCapture
+from rpcpool import mainClientPool
+from pipeline import DecodePipeline
+from sink import makeSink
+import appBase
+from appBase import AppBase
+
+'''
+asyncio counterpart of appBase.py
+Every app is a coroutine driven by a single event loop (see runAsyncApps())
+instead of one OS thread per app
+Nothing here may block the event loop, it would stall every other app:
+    AirSim calls go to an executor thread (call(), getImage()), Tx() hands flows to mainTxHandoff
+    work that needs the clock to stay put awaits between tick.waitAsync() and tick.arrive() (see barrier.py)
+Note:
+    Never await inside "with Ctrl.Frozen()", all coroutines share the same thread
+'''
+
+class TxHandoff():
+    '''
+    Starts the flows of coroutines in its own thread since Router.startFlow() may block on a full zmq socket
+    Flows start in the order of Tx() and are stamped (Flow.tTx) at Tx(), not when the request is sent,
+    NS sees them as late as it would a blocked Tx() of a thread app
+    '''
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix='TxHandoff')
+    def put(self, flows):
+        t = stamp()
+        for f in flows:
+            f.tTx = t
+        # in lockstep the clock waits until the flows reach Router, as a thread app's Tx() would
+        Ctrl.lockstep.hold()
+        self.executor.submit(self.start, flows)
+    def start(self, flows):
+        '''
+        Internal use only, run by the executor
+        '''
+        try:
+            for f in flows:
+                try:
+                    f.start()
+                except Exception as e:
+                    print(f'[TxHandoff] flow {f.src} -> {f.dst} not started: {e}')
+                    if not f.done():
+                        f.settle(Flow.CANCELLED)
+        finally:
+            Ctrl.lockstep.release()
+
+# flows of every coroutine app
+mainTxHandoff = TxHandoff()
+
+class AsyncAppBase(AppBase):
+    '''
+    Any custom level coroutine application must inherit this
+    createFlow is the same as AppBase, use "await flow" to wait for delivery
+    '''
+    def __init__(self, name):
+        super().__init__(name)
+    @staticmethod
+    def GetClient():
+        '''
+        return the AirSim client shared by the whole process (see rpcpool.py)
+        '''
+        return mainClientPool.proxy()
+    def Tx(self, obj, toName):
+        '''
+        Same as AppBase.Tx() but never blocks the event loop, the flows are started by mainTxHandoff
+        return Flow or [Flow, ...]
+        '''
+        if isinstance(obj, (list, tuple)):
+            ret = [Flow(self.name, toName, msg) for msg in obj]
+            mainTxHandoff.put(ret)
+            return ret
+        f = Flow(self.name, toName, obj)
+        mainTxHandoff.put([f])
+        return f
+    async def call(self, method, *args, **kwargs):
+        '''
+        client.method(*args, **kwargs) through mainClientPool in an executor thread
+        '''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(mainClientPool.call, method, *args, **kwargs))
+    async def getImage(self, camera='0', imageType=airsim.ImageType.Scene):
+        '''
+        mainCapture.getImage() of this vehicle in an executor thread, batched with the other apps of this step
+        '''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, mainCapture.getImage, self.name, camera, imageType)
+    async def rx(self):
+        '''
+        Suspend until a msg has arrived
+        return (src, msg), or None if the simulation is over
+        '''
+        return await mainRouter.recvAsync(self.name)
+    async def run(self, *args, **kwargs):
+        if appBase.TARGET == 'selftest':
+            await self.selfTest(*args, **kwargs)
+        elif appBase.TARGET == 'throughput':
+            await self.staticThroughputTest(dist=appBase.DIST, period=appBase.PERIOD, *args, **kwargs)
+        elif appBase.TARGET == 'stream':
+            await self.streamingTest(*args, **kwargs)
+        print(f'{self.name} joined')
+        Ctrl.lockstep.leave()
+
+class AsyncUavAppBase(AsyncAppBase):
+    '''
+    AsyncUavAppBase(name=name)
+    '''
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+    def createFlow(self, obj, toName=None):
+        toName = toName if toName is not None else 'GCS'
+        return super().createFlow(obj, toName)
+    def Tx(self, obj, toName=None):
+        toName = toName if toName is not None else 'GCS'
+        return super().Tx(obj, toName)
+    async def selfTest(self, **kwargs):
+        '''
+        Port of UavAppBase.selfTest()
+        paired with AsyncGcsApp.selfTest()
+        '''
+        print(f'{self.name} is testing')
+        await Ctrl.sleep_until(1.0)
+        print(f'{self.name} at 1.0, got {Ctrl.GetSimTime()}')
+        await Ctrl.sleep(0.95)
+        with Ctrl.Frozen():
+            print(f'{self.name} at frozen, got {Ctrl.GetSimTime()}')
+        await Ctrl.sleep(0.5234)
+        print(f'{self.name} at 2.4734, got {Ctrl.GetSimTime()}')
+        msg = MsgRaw(b'I\'m %b' % (bytes(self.name, encoding='utf-8')))
+        print(f'{self.name} trans msg at time {Ctrl.GetSimTime()}')
+        await self.Tx(msg)
+        print(f'{self.name} msg delivered at time {Ctrl.GetSimTime()}')
+
+        # compound send test
+        msgs = [MsgRaw(b'I\'m %b-%d' % (bytes(self.name, encoding='utf-8'), i)) for i in range(5)]
+        print(f'{self.name} trans multiple msg at time {Ctrl.GetSimTime()}')
+        self.Tx(msgs)
+
+        while Ctrl.ShouldContinue():
+            reply = await self.rx()
+            if reply is not None:
+                print(f'{self.name} recv: {reply[1].data} at time {Ctrl.GetSimTime()}')
+    async def staticThroughputTest(self, dist, period, **kwargs):
+        '''
+        Port of UavAppBase.staticThroughputTest()
+        paired with AsyncGcsApp.staticThroughputTest()
+        '''
+        delay = 1.0
+        await Ctrl.sleep(delay)
+        pose = self.GetPose()
+        pose.position.x_val = dist
+
+        total = 0
+        msg = MsgRaw(bytes(50*1024))
+        await self.call('simSetVehiclePose', pose, True, vehicle_name=self.name)
+        t0 = Ctrl.GetSimTime()
+        while Ctrl.ShouldContinue():
+            await Ctrl.sleep(period)
+            self.Tx(msg)
+            total += len(msg.data)
+        print(f'{dist} {self.name} trans {total}, throughput = {total*8/1000/1000/(Ctrl.GetEndTime()-t0)}')
+    async def streamingTest(self, **kwargs):
+        '''
+        Port of UavAppBase.streamingTest()
+        '''
+        await self.call('enableApiControl', True, vehicle_name=self.name)
+        await self.call('armDisarm', True, vehicle_name=self.name)
+
+        delay = 1.0
+        await Ctrl.sleep(delay)
+        # same tick as the thread runtime, the clock waits while the capture runs off the loop
+        tick = Ctrl.JoinTick(0.1, name=self.name)
+        while await tick.waitAsync() and Ctrl.ShouldContinue():
+            rawImage = await self.getImage("0", airsim.ImageType.Scene)
+            msg = MsgImg(rawImage, Ctrl.GetSimTime())
+            tick.arrive()
+            self.Tx(msg)
+        tick.leave()
+
+class AsyncGcsAppBase(AsyncAppBase):
+    '''
+    AsyncGcsAppBase(name=name)
+    '''
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+    async def selfTest(self, *args, **kwargs):
+        '''
+        Port of GcsAppBase.selfTest()
+        paired with AsyncUavApp.selfTest()
+        '''
+        await Ctrl.sleep(3.0)
+        print(f'{self.name} is testing')
+        msg = MsgRaw(b'I\'m GCS')
+        print(f'{self.name} trans msg to A at time {Ctrl.GetSimTime()}')
+        self.Tx(msg, 'A')
+        print(f'{self.name} trans msg to B at time {Ctrl.GetSimTime()}')
+        self.Tx(msg, 'B')
+
+        # compound send test
+        msgs = [MsgRaw(b'I\'m %b-%d' % (bytes(self.name, encoding='utf-8'), i)) for i in range(5)]
+        print(f'{self.name} trans multiple msg to A at time {Ctrl.GetSimTime()}')
+        self.Tx(msgs, 'A')
+        print(f'{self.name} trans multiple msg to A at time {Ctrl.GetSimTime()}')
+        self.Tx(msgs, 'B')
+
+        while Ctrl.ShouldContinue():
+            reply = await self.rx()
+            if reply is not None:
+                print(f'{self.name} recv: {reply[1].data}  at time {Ctrl.GetSimTime()}')
+    async def staticThroughputTest(self, *args, **kwargs):
+        '''
+        Port of GcsAppBase.staticThroughputTest()
+        paired with AsyncUavApp.staticThroughputTest()
+        '''
+        total = 0
+        delay = 0.1
+        await Ctrl.sleep(delay)
+        t0 = Ctrl.GetSimTime()
+        while Ctrl.ShouldContinue():
+            msg = await self.rx()
+            if msg is not None:
+                addr, msg = msg
+                total += len(msg.data)
+        print(f'GCS recv {total}, throughput = {total*8/1000/1000/(Ctrl.GetEndTime()-(t0))}')
+        for (src, dst), m in mainRouter.metrics.query(dst=self.name).items():
+            print(f'{src} -> {dst}: goodput = {m["goodput"]/1000/1000:.3f} Mbps, latency = {m["latency"]}, queueing = {m["queueing"]}')
+    async def streamingTest(self, **kwargs):
+        '''
+        Port of GcsAppBase.streamingTest()
+        '''
+        delay = 1.0
+        await Ctrl.sleep(delay)
+        sink = makeSink(appBase.SINK)
+        pipeline = DecodePipeline(sink=sink)
+        isStarted = False
+        while Ctrl.ShouldContinue():
+            reply = await self.rx()
+            if reply is not None:
+                name, reply = reply
+                pipeline.submit(name, reply.png, reply.timestamp)
+                if not isStarted:
+                    isStarted = True
+                    Ctrl.SetEndTime(Ctrl.GetSimTime() + 2.0)
+        pipeline.close()
+        sink.close()
+        print(f'{self.name} decoding {pipeline.stats()}, sink {sink.stats()}')
+
+def runAsyncApps(apps):
+    '''
+    Drive all apps by one event loop in the calling thread until they all return
+    Ctrl.notifyWait() resumes every due coroutine with one callback per step
+    '''
+    async def runAll():
+        # one blocking AirSim call per app at most, so every capture of a step can join one batch
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max(1, len(apps)), thread_name_prefix='AsyncApp'))
+        await asyncio.gather(*[app.run() for app in apps])
+    asyncio.run(runAll())
@@ -0,0 +1,271 @@
+import math
+import time
+import threading
+import asyncio
+from collections import deque
+from metrics import percentiles
+
+'''
+Per-tick barrier of Ctrl: participants are released together at their tick and the clock stays
+where it is until every one of them has arrived, so work that needs a frozen clock (e.g. camera capture)
+runs concurrently once per tick instead of each Ctrl.Frozen() stalling a step of its own
+Usage:
+tick = Ctrl.JoinTick(period=0.1) # in the participant's thread
+while tick.wait(): # parked until the next multiple of period, False once the simulation is over
+    # the clock does not move here
+    rawImage = mainCapture.getImage(name, '0')
+    tick.arrive()
+    # the clock moves again once every participant of this tick has arrived
+tick.leave()
+The clock also waits at a tick for a participant that has not called wait() yet
+A participant that has not arrived timeout wall seconds after the release is left behind (counted late),
+it keeps running while the clock moves on and misses every tick until it arrives
+In a coroutine, "while await tick.waitAsync():" parks the coroutine instead of the event loop (see asyncAppBase.py)
+'''
+
+MAX_SAMPLES = 4096
+
+class TickParticipant():
+    '''
+    Made by TickBarrier.join(), used by its thread only
+    '''
+    def __init__(self, barrier, name, period, timeout, due):
+        self.barrier = barrier
+        self.name = name
+        self.period = period
+        self.timeout = timeout # None for the barrier default
+        self.due = due # sim time of the next tick
+        self.gate = threading.Condition(barrier.lock)
+        self.isReady = False # released, wait() has not returned yet
+        self.isRunning = False # wait() has returned, not yet arrived
+        self.future = None # asyncio.Future of waitAsync() parked until the next tick
+        self.releasedAt = 0 # wall
+        self.numReleased = 0
+        self.numMissed = 0
+        self.numLate = 0
+    def wait(self):
+        '''
+        Arrive if released, then park until the next tick
+        return True when released, False once the simulation is over
+        '''
+        lockstep = self.barrier.lockstep
+        if lockstep is None:
+            return self.barrier.wait(self)
+        # released participants keep the clock in waitArrived() until they arrive, so the barrier never unparks them
+        lockstep.park(self)
+        try:
+            return self.barrier.wait(self)
+        finally:
+            lockstep.resume(self)
+    async def waitAsync(self):
+        '''
+        Coroutine version of wait()
+        '''
+        loop = asyncio.get_running_loop()
+        lockstep = self.barrier.lockstep
+        if lockstep is not None:
+            lockstep.park(self)
+        try:
+            while True:
+                ret = self.barrier.poll(self, loop)
+                if isinstance(ret, bool):
+                    return ret
+                await ret
+        finally:
+            if lockstep is not None:
+                lockstep.resume(self)
+    def arrive(self):
+        '''
+        Done with the work of this tick, the clock may move
+        '''
+        self.barrier.arrive(self)
+    def leave(self):
+        self.barrier.leave(self)
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, tb):
+        self.leave()
+
+class TickBarrier():
+    def __init__(self, granularity=0.01, timeout=0, lockstep=None):
+        '''
+        @param timeout: wall seconds to wait for a participant, 0 to wait forever
+        @param lockstep: lockstep.Lockstep counting participants parked in wait() as parked apps
+        '''
+        self.lock = threading.Lock()
+        self.lockstep = lockstep
+        self.arrived = threading.Condition(self.lock)
+        self.granularity = granularity
+        self.timeout = timeout
+        self.participants = []
+        self.pending = set() # released at the last tick, not yet arrived
+        self.releasedAt = 0 # wall
+        self.isRunning = True
+        self.numTicks = 0
+        self.numLate = 0
+        self.numMissed = 0
+        self.barrierTime = deque(maxlen=MAX_SAMPLES) # wall sec Ctrl held a tick
+        self.workTime = deque(maxlen=MAX_SAMPLES) # wall sec from release to arrival
+    def configure(self, granularity, timeout=0):
+        with self.lock:
+            self.granularity = granularity
+            self.timeout = timeout
+    def __len__(self):
+        with self.lock:
+            return len(self.participants)
+    def join(self, now, period, name=None, timeout=None):
+        '''
+        return TickParticipant released at every multiple of period after now
+        @param timeout: wall seconds, None for the barrier default, 0 to wait forever
+        '''
+        if period <= 0:
+            raise ValueError(f'tick period must be positive, got {period}')
+        with self.lock:
+            due = (math.floor(now / period + 1e-9) + 1) * period
+            p = TickParticipant(self, name if name is not None else threading.current_thread().name, period, timeout, due)
+            self.participants.append(p)
+        return p
+    def leave(self, p):
+        with self.lock:
+            if p in self.participants:
+                self.participants.remove(p)
+            p.isReady = False
+            self.finish(p)
+    def finish(self, p):
+        '''
+        Internal use only, self.lock must be held
+        '''
+        if p.isRunning:
+            p.isRunning = False
+            self.workTime.append(time.perf_counter() - p.releasedAt)
+        if p in self.pending and not p.isReady:
+            self.pending.discard(p)
+            if len(self.pending) == 0:
+                self.barrierTime.append(time.perf_counter() - self.releasedAt)
+                self.arrived.notify_all()
+    def arrive(self, p):
+        with self.lock:
+            self.finish(p)
+    def wait(self, p):
+        with self.lock:
+            self.finish(p)
+            while not p.isReady and self.isRunning:
+                p.gate.wait()
+            if not self.isRunning:
+                return False
+            # a tick that came before this call is taken at once, the clock has been waiting for it
+            p.isReady = False
+            p.isRunning = True
+            return True
+    def poll(self, p, loop):
+        '''
+        Internal use only, wait() without blocking for TickParticipant.waitAsync()
+        return True or False as wait() does, or an asyncio.Future of loop resolved by the next release
+        '''
+        with self.lock:
+            self.finish(p)
+            if not self.isRunning:
+                return False
+            if p.isReady:
+                p.isReady = False
+                p.isRunning = True
+                return True
+            p.future = loop.create_future()
+            return p.future
+    @staticmethod
+    def notify(p):
+        '''
+        Internal use only, self.lock must be held
+        wake p from wait() or waitAsync()
+        '''
+        p.gate.notify()
+        if p.future is not None:
+            fut, p.future = p.future, None
+            fut.get_loop().call_soon_threadsafe(lambda: fut.done() or fut.set_result(None))
+    def numPending(self):
+        '''
+        return number of participants released at the last tick that have not arrived yet
+        '''
+        with self.lock:
+            return len(self.pending)
+    def nextDue(self):
+        '''
+        return the earliest tick of any participant or math.inf
+        '''
+        with self.lock:
+            return min((p.due for p in self.participants), default=math.inf)
+    def release(self, now, isRunning=True):
+        '''
+        Internal use only, called by Ctrl.notifyWait() once the clock reaches now
+        return number of participants released
+        '''
+        with self.lock:
+            if not isRunning:
+                self.isRunning = False
+                for p in self.participants:
+                    self.notify(p)
+                self.pending.clear()
+                self.arrived.notify_all()
+                return 0
+            # Ctrl steps onto every tick (see Ctrl.nextSimStepSize()), only the float error of summed steps is tolerated
+            threshold = now + self.granularity * 1e-6
+            wall = time.perf_counter()
+            for p in self.participants:
+                if p.due > threshold:
+                    continue
+                if p.isRunning or p.isReady:
+                    # still busy with an earlier tick it was left behind at
+                    p.numMissed += 1
+                    self.numMissed += 1
+                else:
+                    p.isReady = True
+                    p.releasedAt = wall
+                    p.numReleased += 1
+                    self.pending.add(p)
+                    self.notify(p)
+                # next multiple of period after now
+                p.due += p.period * (math.floor((threshold - p.due) / p.period) + 1)
+            if len(self.pending) > 0:
+                self.releasedAt = wall
+                self.numTicks += 1
+            return len(self.pending)
+    def waitArrived(self):
+        '''
+        Internal use only, called by Ctrl before the clock moves
+        block until every participant released at the last tick has arrived or timed out
+        '''
+        with self.lock:
+            while len(self.pending) > 0:
+                now = time.perf_counter()
+                deadlines = []
+                for p in list(self.pending):
+                    timeout = p.timeout if p.timeout is not None else self.timeout
+                    if timeout <= 0:
+                        continue
+                    if now >= self.releasedAt + timeout:
+                        # left behind, it still finishes in its own time
+                        self.pending.discard(p)
+                        p.numLate += 1
+                        self.numLate += 1
+                    else:
+                        deadlines.append(self.releasedAt + timeout)
+                if len(self.pending) == 0:
+                    self.barrierTime.append(now - self.releasedAt)
+                    break
+                self.arrived.wait(min(deadlines) - now if len(deadlines) > 0 else None)
+    def stats(self):
+        '''
+        return dict of
+        participants, ticks: ticks that released anyone, late: left behind by timeout,
+        missed: ticks a participant was still busy at,
+        barrier: wall sec from a release until the clock may move, work: wall sec from release to arrival (p50, p90, p99, max)
+        '''
+        with self.lock:
+            return {
+                'participants': len(self.participants),
+                'ticks': self.numTicks,
+                'late': self.numLate,
+                'missed': self.numMissed,
+                'barrier': percentiles(self.barrierTime),
+                'work': percentiles(self.workTime),
+            }
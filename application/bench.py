@@ -0,0 +1,1187 @@
+'''
+Micro benchmarks of the python coordination layer
+They run without AirSim and NS3
+Usage:
+python3 bench.py wire
+python3 bench.py stress
+python3 bench.py runtime
+python3 bench.py scheduler [--waiters 10000] [--steps 1000] # coroutines, then 1000 threads for 100 steps
+python3 bench.py codec
+python3 bench.py capture [--uavs 16] [--steps 1000]
+python3 bench.py rpc [--uavs 16] [--steps 1000]
+python3 bench.py barrier [--uavs 16] [--steps 1000]
+python3 bench.py rx [--uavs 16] [--steps 1000]
+python3 bench.py decode [--uavs 16]
+python3 bench.py sink
+python3 bench.py adaptive [--uavs 16]
+python3 bench.py pipeline [--uavs 16] [--steps 1000]
+python3 bench.py profile [--steps 1000]
+python3 bench.py metrics [--uavs 16]
+python3 bench.py emulate [--uavs 16] [--steps 1000] [--sweep] [--trace path] [--transport tcp|ipc|inproc]
+python3 bench.py analytic [--uavs 16] [--steps 1000] [--sweep]
+python3 bench.py replay [--uavs 16] [--steps 1000]
+python3 bench.py transport [--uavs 16]
+python3 bench.py sweep
+'''
+import os
+import re
+import sys
+import time
+import asyncio
+import threading
+import argparse
+from collections import deque
+import pickle
+import zlib
+import tempfile
+import json
+import io
+import contextlib
+import subprocess
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+# custom imports
+from ctrl import *
+from msg import *
+from router import *
+from capture import CaptureService
+from pipeline import DecodePipeline, Frame
+from sink import makeSink, RingBufferReader
+from profiler import StepProfiler
+from metrics import FlowMetrics, percentiles
+from nsemu import NsEmulator, useStubClient
+from netmodel import maxMinFair
+from endpoint import mainEndpoints, TRANSPORTS
+from rpcpool import ClientPool
+from barrier import TickBarrier
+from sweep import Sweep, RESULTS
+
+def registerBench(router, uavsName):
+    '''
+    Register GCS and uavsName in the same order as main.py
+    and drain requests Router sends to NS
+    return the sink sockets
+    '''
+    sinks = []
+    for i, name in enumerate(['GCS'] + uavsName):
+        port = AIRSIM2NS_GCS_PORT_START if i == 0 else AIRSIM2NS_UAV_PORT_START + i - 1
+        router.register(name, port)
+        sink = router.context.socket(zmq.PULL)
+        sink.connect(mainEndpoints.connect(port))
+        sinks.append(sink)
+    router.compile()
+    return sinks
+
+def wireRecords(flows, chunk):
+    '''
+    Split each flow into SEND and RECV reports of at most chunk bytes
+    return [(op, src, dst, size, fid), ...]
+    '''
+    records = []
+    for f in flows:
+        left = f.size
+        while left > 0:
+            size = min(chunk, left)
+            records.append((WIRE_OP_SEND, f.src, f.dst, size, f.id))
+            records.append((WIRE_OP_RECV, f.src, f.dst, size, -1))
+            left -= size
+    return records
+
+def encodeText(records):
+    ret = []
+    for op, src, dst, size, fid in records:
+        if op == WIRE_OP_SEND:
+            ret.append(f'{src} {dst} {FLOWOP_SEND} {size} {fid}'.encode())
+        else:
+            ret.append(f'{src} {dst} {FLOWOP_RECV} {size}'.encode())
+    return ret
+
+def encodeBinary(router, records, batch):
+    ret = []
+    for i in range(0, len(records), batch):
+        part = records[i:i+batch]
+        frame = bytearray(WIRE_HEADER.pack(WIRE_VERSION, 0, len(part)))
+        for op, src, dst, size, fid in part:
+            frame += WIRE_RECORD.pack(router.endPoints[src].id, router.endPoints[dst].id, op, size, fid)
+        ret.append(memoryview(bytes(frame)))
+    return ret
+
+def benchWire(numUav=4, numFlows=500, flowSize=50*1024, chunk=1448, batch=4096):
+    '''
+    Compare Router.dispatch() throughput of the text and the binary wire protocol
+    The same reports are replayed in-process so only decoding and flow accounting are measured
+    '''
+    uavsName = [f'U{i}' for i in range(numUav)]
+    Ctrl.netConfig = {'useBinaryWire': 1}
+    sinks = registerBench(mainRouter, uavsName) # keep sinks alive or Router blocks on send
+    for proto in ['text', 'binary']:
+        flows = [Flow(uavsName[i % numUav], 'GCS', MsgRaw(bytes(flowSize))).start() for i in range(numFlows)]
+        records = wireRecords(flows, chunk)
+        frames = encodeText(records) if proto == 'text' else encodeBinary(mainRouter, records, batch)
+        t0 = time.perf_counter()
+        for frame in frames:
+            mainRouter.dispatch(frame)
+        t1 = time.perf_counter()
+        while mainRouter.recv('GCS', block=False, timeout=None) is not None:
+            pass
+        print(f'[{proto}] {len(records)} records in {len(frames)} frames, {t1 - t0:.3f} sec, {len(records)/(t1 - t0):.0f} records/sec')
+    for sink in sinks:
+        sink.close(linger=0)
+
+def fakeNs(router, sinks, chunk, stop):
+    '''
+    Stand in for NS apps: every request is reported as sent and received in chunks
+    '''
+    poller = zmq.Poller()
+    for sink in sinks:
+        poller.register(sink, zmq.POLLIN)
+    while not stop.is_set():
+        for sink, _ in poller.poll(100):
+            req = sink.recv()
+            records = []
+            for src, dst, op, size, fid in WIRE_RECORD.iter_unpack(req[WIRE_HEADER.size:]):
+                while size > 0:
+                    put = min(chunk, size)
+                    records.append(WIRE_RECORD.pack(src, dst, WIRE_OP_SEND, put, fid))
+                    records.append(WIRE_RECORD.pack(src, dst, WIRE_OP_RECV, put, -1))
+                    size -= put
+            frame = WIRE_HEADER.pack(WIRE_VERSION, 0, len(records)) + b''.join(records)
+            router.dispatch(memoryview(frame))
+
+def benchStress(numUav=127, numMsg=20, msgSize=4096, chunk=1448, timeout=60):
+    '''
+    numUav + 1 endpoint threads Tx and Rx concurrently through Router
+    each UAV sends numMsg to GCS and to its neighbor, GCS sends numMsg to each UAV
+    every message must be delivered exactly once
+    '''
+    uavsName = [f'U{i}' for i in range(numUav)]
+    Ctrl.netConfig = {'useBinaryWire': 1}
+    sinks = registerBench(mainRouter, uavsName)
+    stop = threading.Event()
+    ns = threading.Thread(target=fakeNs, args=(mainRouter, sinks, chunk, stop))
+    ns.start()
+    got = {}
+    def uav(i):
+        name = uavsName[i]
+        neighbor = uavsName[(i + 1) % numUav]
+        n = 0
+        for k in range(numMsg):
+            mainRouter.startFlow(Flow(name, 'GCS', MsgRaw(bytes(msgSize))))
+            mainRouter.startFlow(Flow(name, neighbor, MsgRaw(bytes(msgSize))))
+            while mainRouter.recv(name, block=False, timeout=None) is not None:
+                n += 1
+        deadline = time.time() + timeout
+        while n < 2 * numMsg and time.time() < deadline:
+            if mainRouter.recv(name, block=True, timeout=0.1) is not None:
+                n += 1
+        got[name] = n
+    def gcs():
+        n = 0
+        for k in range(numMsg):
+            for name in uavsName:
+                mainRouter.startFlow(Flow('GCS', name, MsgRaw(bytes(msgSize))))
+            while mainRouter.recv('GCS', block=False, timeout=None) is not None:
+                n += 1
+        deadline = time.time() + timeout
+        while n < numUav * numMsg and time.time() < deadline:
+            if mainRouter.recv('GCS', block=True, timeout=0.1) is not None:
+                n += 1
+        got['GCS'] = n
+    threads = [threading.Thread(target=uav, args=(i,)) for i in range(numUav)] + [threading.Thread(target=gcs)]
+    t0 = time.perf_counter()
+    for td in threads:
+        td.start()
+    for td in threads:
+        td.join()
+    t1 = time.perf_counter()
+    stop.set()
+    ns.join()
+    total = sum(got.values())
+    expected = 3 * numUav * numMsg
+    print(f'[stress] {len(threads)} endpoint threads, {total}/{expected} msgs delivered in {t1 - t0:.3f} sec, {total/(t1 - t0):.0f} msgs/sec')
+    print(f'[stress] router stats {mainRouter.stats()}')
+    if total != expected:
+        raise RuntimeError(f'{expected - total} msgs are lost')
+
+def resetCtrl(updateGranularity):
+    with Ctrl.mutex:
+        Ctrl.simTime = 0
+        Ctrl.isRunning = True
+        Ctrl.endTime = math.inf
+        Ctrl.netConfig = {'updateGranularity': updateGranularity, 'useBinaryWire': 1}
+    Ctrl.scheduler.setGranularity(updateGranularity)
+    Ctrl.barrier = TickBarrier(updateGranularity)
+
+def stepClock(numSteps, step, numApps, parked, notifiedAt=None):
+    '''
+    Stand in for Ctrl.run(): advance one step once all apps are parked
+    notifiedAt[0] is set to the wall time right before each notifyWait()
+    return wall time spent
+    '''
+    t0 = time.perf_counter()
+    for i in range(numSteps):
+        while parked() < numApps:
+            time.sleep(1e-4)
+        with Ctrl.mutex:
+            Ctrl.simTime += step
+        if notifiedAt is not None:
+            notifiedAt[0] = time.perf_counter()
+        Ctrl.notifyWait()
+    t1 = time.perf_counter()
+    with Ctrl.mutex:
+        Ctrl.isRunning = False
+    Ctrl.notifyWait()
+    return t1 - t0
+
+def benchRuntime(numApps=200, numSteps=200, step=0.01):
+    '''
+    Compare wakeup cost of one thread per app (Ctrl.Wait) against one event loop (Ctrl.sleep)
+    every app waits a single step repeatedly
+    '''
+    resetCtrl(step)
+    def threadApp():
+        while Ctrl.ShouldContinue():
+            Ctrl.Wait(step)
+    threads = [threading.Thread(target=threadApp) for i in range(numApps)]
+    for td in threads:
+        td.start()
+    spent = stepClock(numSteps, step, numApps, lambda: len(Ctrl.scheduler))
+    for td in threads:
+        td.join()
+    print(f'[thread] {numApps} apps, {numSteps} steps in {spent:.3f} sec, {numSteps/spent:.0f} steps/sec')
+
+    resetCtrl(step)
+    async def asyncApp():
+        while Ctrl.ShouldContinue():
+            await Ctrl.sleep(step)
+    async def runAll():
+        await asyncio.gather(*[asyncApp() for i in range(numApps)])
+    loop = threading.Thread(target=asyncio.run, args=(runAll(),))
+    loop.start()
+    spent = stepClock(numSteps, step, numApps, lambda: len(Ctrl.scheduler))
+    loop.join()
+    print(f'[async] {numApps} apps, {numSteps} steps in {spent:.3f} sec, {numSteps/spent:.0f} steps/sec')
+
+def printHistogram(title, samples):
+    '''
+    log2 histogram of samples in seconds
+    '''
+    samples = sorted(samples)
+    if len(samples) == 0:
+        return
+    print(f'{title}: n={len(samples)}, p50={samples[len(samples)//2]*1e6:.0f}us, p99={samples[int(len(samples)*0.99)]*1e6:.0f}us, max={samples[-1]*1e6:.0f}us')
+    bins = {}
+    for x in samples:
+        b = max(0, math.ceil(math.log2(max(x*1e6, 1))))
+        bins[b] = bins.get(b, 0) + 1
+    for b in sorted(bins):
+        print(f'  <= {2**b:>8} us | {bins[b]:>9} {"#"*max(1, 50*bins[b]//len(samples))}')
+
+def benchScheduler(numWaiters=10000, numSteps=1000, step=0.01, numThreads=1000, numThreadSteps=100):
+    '''
+    numWaiters coroutines on one event loop wait 1 to 4 ticks repeatedly through Ctrl.sleep(),
+    every step resumes all of its due ones with one callback (the batched path of Ctrl.notifyWait())
+    then numThreads threads do the same through Ctrl.WaitUntil() for numThreadSteps steps,
+    one OS thread wakeup per waiter, which is what bounds the step rate there and not the timer wheel
+    report step rate and the latency from notifyWait() to the waiter actually resuming
+    '''
+    for mode in ['async', 'thread']:
+        resetCtrl(step)
+        notifiedAt = [0.0]
+        latency = []
+        count, steps = (numWaiters, numSteps) if mode == 'async' else (numThreads, numThreadSteps)
+        async def waiterAsync(i):
+            ticks = 1 + i % 4
+            while Ctrl.ShouldContinue():
+                await Ctrl.sleep(step * ticks)
+                latency.append(time.perf_counter() - notifiedAt[0])
+        async def runAll():
+            await asyncio.gather(*[waiterAsync(i) for i in range(count)])
+        def waiter(i):
+            ticks = 1 + i % 4
+            while Ctrl.ShouldContinue():
+                Ctrl.Wait(step * ticks)
+                latency.append(time.perf_counter() - notifiedAt[0])
+        if mode == 'async':
+            threads = [threading.Thread(target=asyncio.run, args=(runAll(),))]
+        else:
+            threading.stack_size(256*1024)
+            threads = [threading.Thread(target=waiter, args=(i,)) for i in range(count)]
+        for td in threads:
+            td.start()
+        spent = stepClock(steps, step, count, lambda: len(Ctrl.scheduler), notifiedAt)
+        for td in threads:
+            td.join()
+        print(f'[scheduler {mode}] {count} waiters, {steps} steps in {spent:.3f} sec, {steps/spent:.0f} steps/sec, {len(latency)} wakeups')
+        printHistogram(f'[scheduler {mode}] wakeup latency', latency)
+
+def timeit(fn, minTime=0.2):
+    '''
+    return average wall time per call of fn()
+    '''
+    n = 0
+    t0 = time.perf_counter()
+    while True:
+        fn()
+        n += 1
+        t1 = time.perf_counter()
+        if t1 - t0 >= minTime:
+            return (t1 - t0) / n
+
+def benchCodec():
+    '''
+    Compare the typed codec (encode/decode) with pickling the whole msg
+    '''
+    rng = np.random.default_rng(0)
+    cases = [
+        ('telemetry raw 64B', MsgRaw(bytes(64))),
+        ('telemetry pose', MsgImg(rng.random(7), 1.23)),
+        ('1080p png bytes', MsgImg(rng.integers(0, 256, 2*1024*1024, dtype=np.uint8).tobytes(), 1.23)),
+        ('1080p array', MsgImg(rng.integers(0, 256, (1080, 1920, 3), dtype=np.uint8), 1.23)),
+    ]
+    for title, msg in cases:
+        pickled = pickle.dumps(msg)
+        encoded = msg.encode()
+        if type(decode(encoded)) is not type(msg):
+            raise RuntimeError(f'{title} is not decoded to {type(msg).__name__}')
+        tDumps = timeit(lambda: pickle.dumps(msg))
+        tLoads = timeit(lambda: pickle.loads(pickled))
+        tEncode = timeit(lambda: msg.encode())
+        tDecode = timeit(lambda: decode(encoded))
+        print(f'[codec] {title:>18}: pickle {len(pickled):>8} B, dumps {tDumps*1e6:9.1f} us, loads {tLoads*1e6:9.1f} us | codec {len(encoded):>8} B, encode {tEncode*1e6:9.1f} us, decode {tDecode*1e6:9.1f} us')
+
+class StubClient():
+    '''
+    Stand in for airsim.MultirotorClient
+    every RPC costs rpcLatency and every image costs imageLatency, served one at a time like AirSim
+    '''
+    def __init__(self, rpcLatency=1e-3, imageLatency=2e-4):
+        self.rpcLatency = rpcLatency
+        self.imageLatency = imageLatency
+        self.lock = threading.Lock()
+        self.numRpc = 0
+    def serve(self, vehicle_name, requests):
+        with self.lock:
+            self.numRpc += 1
+            time.sleep(self.rpcLatency + self.imageLatency * len(requests))
+        ret = []
+        for request in requests:
+            response = airsim.ImageResponse()
+            response.image_data_uint8 = f'{vehicle_name}/{request.camera_name}/{Ctrl.GetSimTime()}'.encode()
+            ret.append(response)
+        return ret
+    def simGetImage(self, camera_name, image_type, vehicle_name=''):
+        return self.serve(vehicle_name, [airsim.ImageRequest(camera_name, image_type)])[0].image_data_uint8
+    def simGetImages(self, requests, vehicle_name=''):
+        return self.serve(vehicle_name, requests)
+
+def benchCapture(numUav=16, numSteps=100, step=0.1):
+    '''
+    numUav apps capture camera 0 at every tick (Ctrl.JoinTick()), then read it again (e.g. another module of the same app)
+    compare one simGetImages per read against CaptureService from threads and from coroutines (as asyncAppBase.py)
+    the service must issue one batch per step and one RPC per vehicle of it
+    '''
+    uavsName = [f'U{i}' for i in range(numUav)]
+    request = [airsim.ImageRequest('0', airsim.ImageType.Scene)]
+    for mode in ['direct', 'service', 'service async']:
+        resetCtrl(step)
+        client = StubClient()
+        service = CaptureService(client, expected=numUav)
+        def capture(name):
+            for i in range(2):
+                if mode == 'direct':
+                    png = client.simGetImages(request, vehicle_name=name)[0].image_data_uint8
+                else:
+                    png = service.getImage(name, '0')
+            if png != f'{name}/0/{Ctrl.GetSimTime()}'.encode():
+                raise RuntimeError(f'{name} got a stale frame')
+        def uav(name):
+            tick = Ctrl.JoinTick(step)
+            while tick.wait():
+                capture(name)
+                tick.arrive()
+            tick.leave()
+        async def uavAsync(name):
+            tick = Ctrl.JoinTick(step, name=name)
+            loop = asyncio.get_running_loop()
+            while await tick.waitAsync():
+                await loop.run_in_executor(None, capture, name)
+                tick.arrive()
+            tick.leave()
+        async def runAll():
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(numUav))
+            await asyncio.gather(*[uavAsync(name) for name in uavsName])
+        if mode == 'service async':
+            threads = [threading.Thread(target=asyncio.run, args=(runAll(),))]
+        else:
+            threads = [threading.Thread(target=uav, args=(name,)) for name in uavsName]
+        for td in threads:
+            td.start()
+        while len(Ctrl.barrier) < numUav:
+            time.sleep(1e-4)
+        t0 = time.perf_counter()
+        for i in range(numSteps):
+            Ctrl.barrier.waitArrived()
+            with Ctrl.mutex:
+                Ctrl.simTime += step
+            Ctrl.notifyWait()
+        Ctrl.barrier.waitArrived()
+        spent = time.perf_counter() - t0
+        with Ctrl.mutex:
+            Ctrl.isRunning = False
+        Ctrl.notifyWait()
+        for td in threads:
+            td.join()
+        print(f'[capture {mode}] {numUav} uavs, {numSteps} steps in {spent:.3f} sec, {spent/numSteps*1e3:.2f} ms/step, {client.numRpc/numSteps:.1f} rpc/step')
+        if mode != 'direct':
+            stats = service.stats()
+            print(f'[capture {mode}] stats {stats}, {stats["batches"]/numSteps:.2f} batches/step')
+            if stats['batches'] != numSteps or stats['rpc'] != numUav * numSteps:
+                raise RuntimeError(f'{stats["batches"]} batches and {stats["rpc"]} rpc for {numSteps} steps of {numUav} vehicles')
+
+class StubServer():
+    '''
+    Stand in for the AirSim RPC server, every call costs rpcLatency and calls are served one at a time
+    '''
+    def __init__(self, rpcLatency=1e-4):
+        self.rpcLatency = rpcLatency
+        self.lock = threading.Lock()
+        self.numRpc = 0
+        self.numClients = 0
+    def connect(self):
+        with self.lock:
+            self.numClients += 1
+        return StubPoseClient(self)
+    def serve(self):
+        with self.lock:
+            self.numRpc += 1
+            time.sleep(self.rpcLatency)
+
+class StubPoseClient():
+    def __init__(self, server):
+        self.server = server
+    def simGetGroundTruthKinematics(self, vehicle_name=''):
+        self.server.serve()
+        return airsim.KinematicsState()
+    def simSetVehiclePose(self, pose, ignore_collision, vehicle_name=''):
+        self.server.serve()
+
+def benchRpc(numUav=16, numSteps=100, step=0.1, numNeighbours=4):
+    '''
+    numUav threads read the kinematics of numNeighbours UAVs (themselves included) every step then set their own pose
+    compare one client per thread (as appBase.py did) against ClientPool sharing the reads of a step
+    '''
+    uavsName = [f'U{i}' for i in range(numUav)]
+    for mode in ['direct', 'pool']:
+        resetCtrl(step)
+        server = StubServer()
+        pool = ClientPool(clock=Ctrl.GetSimTime)
+        pool.connect = server.connect
+        def uav(k):
+            client = server.connect() if mode == 'direct' else pool.proxy()
+            while Ctrl.ShouldContinue():
+                Ctrl.Wait(step)
+                with Ctrl.Frozen():
+                    for i in range(numNeighbours):
+                        client.simGetGroundTruthKinematics(vehicle_name=uavsName[(k + i) % numUav])
+                client.simSetVehiclePose(airsim.Pose(), True, vehicle_name=uavsName[k])
+        threads = [threading.Thread(target=uav, args=(k,)) for k in range(numUav)]
+        for td in threads:
+            td.start()
+        def parked():
+            with Ctrl.freezeCond:
+                return len(Ctrl.scheduler) if len(Ctrl.freezeSet) == 0 else 0
+        spent = stepClock(numSteps, step, numUav, parked)
+        for td in threads:
+            td.join()
+        print(f'[rpc {mode}] {numUav} uavs, {numSteps} steps in {spent:.3f} sec, {spent/numSteps*1e3:.2f} ms/step, {server.numRpc} rpc on {server.numClients} connections')
+        if mode == 'pool':
+            stats = pool.stats()['methods']
+            print(f'[rpc {mode}] ' + ', '.join(f"{method} calls {v['calls']} coalesced {v['coalesced']} wait p99 {v['wait'].get('p99', 0)*1e3:.2f} ms" for method, v in stats.items()))
+    benchRpcReserve()
+
+def benchRpcReserve(numBusy=8, callLatency=0.05, numSteps=20):
+    '''
+    numBusy threads keep every image and read slot of a ClientPool busy with calls of callLatency wall seconds each
+    Ctrl's simContinueForTime() must still get a connection at once, raise if it waits for one of them
+    '''
+    class SlowClient():
+        '''
+        calls run in parallel, a step costs nothing
+        '''
+        def simGetImages(self, requests, vehicle_name=''):
+            time.sleep(callLatency)
+            return []
+        def simGetGroundTruthKinematics(self, vehicle_name=''):
+            time.sleep(callLatency)
+            return airsim.KinematicsState()
+        def simContinueForTime(self, seconds):
+            pass
+    pool = ClientPool()
+    pool.connect = SlowClient
+    isRunning = [True]
+    def busy(k):
+        client = pool.proxy()
+        while isRunning[0]:
+            if k % 2 == 0:
+                client.simGetImages([], vehicle_name=f'U{k}')
+            else:
+                client.simGetGroundTruthKinematics(vehicle_name=f'U{k}')
+    threads = [threading.Thread(target=busy, args=(k,)) for k in range(numBusy)]
+    for td in threads:
+        td.start()
+    time.sleep(callLatency) # every image and read slot taken, more waiting
+    client = pool.proxy()
+    wait = []
+    for i in range(numSteps):
+        t0 = time.perf_counter()
+        client.simContinueForTime(0.01)
+        wait.append(time.perf_counter() - t0)
+        time.sleep(callLatency / 4)
+    isRunning[0] = False
+    for td in threads:
+        td.join()
+    printHistogram(f'[rpc reserve] step wait under {numBusy} busy image/read threads on {pool.size} connections', wait)
+    if max(wait) >= callLatency / 2:
+        raise RuntimeError(f'a step waited {max(wait)*1e3:.1f} ms for a connection held by image or read calls')
+
+def benchBarrier(numUav=16, numSteps=500, step=0.01, period=0.1, jitter=2e-3, stepCost=5e-4):
+    '''
+    numUav threads capture camera 0 every period, each after up to jitter wall seconds of its own work
+    compare Ctrl.Wait() + Ctrl.Frozen() against Ctrl.JoinTick(), both through CaptureService
+    every step of the clock costs stepCost like simContinueForTime()
+    '''
+    uavsName = [f'U{i}' for i in range(numUav)]
+    rng = np.random.default_rng(0)
+    delays = rng.uniform(0, jitter, (numUav, numSteps))
+    for mode in ['frozen', 'barrier']:
+        resetCtrl(step)
+        client = StubClient(rpcLatency=2e-4, imageLatency=5e-5)
+        service = CaptureService(client, expected=numUav)
+        captured = [] # (name, sim time)
+        def uav(k):
+            n = 0
+            if mode == 'frozen':
+                while Ctrl.ShouldContinue():
+                    Ctrl.Wait(period)
+                    time.sleep(delays[k, n % numSteps])
+                    n += 1
+                    with Ctrl.Frozen():
+                        service.getImage(uavsName[k], '0')
+                        captured.append((k, Ctrl.GetSimTime()))
+            else:
+                tick = Ctrl.JoinTick(period)
+                while tick.wait():
+                    time.sleep(delays[k, n % numSteps])
+                    n += 1
+                    service.getImage(uavsName[k], '0')
+                    captured.append((k, Ctrl.GetSimTime()))
+                    tick.arrive()
+                tick.leave()
+        threads = [threading.Thread(target=uav, args=(k,)) for k in range(numUav)]
+        for td in threads:
+            td.start()
+        time.sleep(0.05) # every UAV is parked
+        t0 = time.perf_counter()
+        for i in range(numSteps):
+            # Ctrl.waitUnfrozen()
+            Ctrl.barrier.waitArrived()
+            with Ctrl.freezeCond:
+                while len(Ctrl.freezeSet) != 0:
+                    Ctrl.freezeCond.wait()
+            time.sleep(stepCost)
+            with Ctrl.mutex:
+                Ctrl.simTime += step
+            Ctrl.notifyWait()
+        spent = time.perf_counter() - t0
+        with Ctrl.mutex:
+            Ctrl.isRunning = False
+        Ctrl.notifyWait()
+        for td in threads:
+            td.join()
+        # a capture off its tick sees a later frame than the other UAVs of the same tick
+        offTick = sum(1 for k, t in captured if abs(t / period - round(t / period)) > step / period / 2)
+        spread = len(set(round(t / step) for k, t in captured))
+        print(f'[barrier {mode}] {numUav} uavs, {numSteps} steps in {spent:.3f} sec, {spent/numSteps*1e3:.2f} ms/step, {len(captured)} captures at {spread} distinct steps, {offTick} off their tick')
+        if mode == 'barrier':
+            print(f'[barrier {mode}] stats {Ctrl.barrier.stats()}')
+
+def benchDecode(numUav=16, numFrames=50, fps=10, size=1920*1080):
+    '''
+    GCS receive loop consuming numFrames from each of numUav sources, each sending fps frames per wall second
+    compare decoding inline against DecodePipeline, report how far the loop lags behind arrivals
+    zlib stands in for cv2.imdecode, both release the GIL
+    '''
+    rng = np.random.default_rng(0)
+    data = zlib.compress(rng.integers(0, 16, size, dtype=np.uint8).tobytes(), 1)
+    frames = [(f'U{i}', k) for k in range(numFrames) for i in range(numUav)]
+    interval = 1 / (fps * numUav)
+    def receive(consume):
+        '''
+        return the max lag of the loop behind arrivals
+        '''
+        lag = 0
+        t0 = time.perf_counter()
+        for n, (src, k) in enumerate(frames):
+            arrival = t0 + n * interval
+            now = time.perf_counter()
+            if now < arrival:
+                time.sleep(arrival - now)
+            lag = max(lag, time.perf_counter() - arrival)
+            consume(src, k)
+        return lag
+    lag = receive(lambda src, k: zlib.decompress(data))
+    print(f'[decode inline] {len(frames)} frames at {fps * numUav} fps, max lag {lag:.3f} sec')
+
+    lastSeq = {}
+    reads = [0]
+    def decoder(png):
+        zlib.decompress(png)
+        return png
+    pipeline = DecodePipeline(decoder=decoder)
+    def consume(src, k):
+        pipeline.submit(src, data, k)
+        # the loop also reads the buffer without blocking, e.g. for display
+        frame = pipeline.latest.get(src)
+        if frame is not None:
+            if frame.seq < lastSeq.get(src, 0):
+                raise RuntimeError(f'{src} went back from {lastSeq[src]} to {frame.seq}')
+            lastSeq[src] = frame.seq
+            reads[0] += 1
+    lag = receive(consume)
+    pipeline.close()
+    print(f'[decode pipeline] {len(frames)} frames at {fps * numUav} fps, max lag {lag:.3f} sec, {reads[0]} reads, stats {pipeline.stats()}')
+
+def benchSink(numFrames=200, numThreads=4):
+    '''
+    numThreads decode workers put 1080p frames to each headless sink
+    report the time put() takes, which is what a decode worker waits for
+    '''
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 256, (1080, 1920, 3), dtype=np.uint8) for i in range(4)]
+    with tempfile.TemporaryDirectory() as folder:
+        for kind in ['null', 'ring', 'file']:
+            sink = makeSink(kind, folder=folder) if kind == 'file' else makeSink(kind)
+            latency = []
+            def worker(i):
+                for k in range(i, numFrames, numThreads):
+                    frame = Frame(f'U{i}', k, k * 0.1, images[k % len(images)])
+                    t0 = time.perf_counter()
+                    sink.put(frame)
+                    latency.append(time.perf_counter() - t0)
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(numThreads)]
+            for td in threads:
+                td.start()
+            for td in threads:
+                td.join()
+            if kind == 'ring':
+                # frames are copied in by the writer thread of the sink
+                while sink.stats()['written'] + sink.stats()['dropped'] < numFrames:
+                    time.sleep(1e-3)
+                reader = RingBufferReader(sink.path)
+                seq, src, timestamp, image = reader.read()
+                if seq != sink.stats()['written'] or image.shape != images[0].shape:
+                    raise RuntimeError(f'ring buffer has frame {seq} of shape {image.shape}')
+                reader.close()
+            t0 = time.perf_counter()
+            sink.close()
+            t1 = time.perf_counter()
+            printHistogram(f'[sink {kind}] put latency', latency)
+            print(f'[sink {kind}] close {t1 - t0:.3f} sec, stats {sink.stats()}')
+
+def benchAdaptive(numUav=16, endTime=60.0, step=0.01, period=5.0, flowTime=0.2, rtt=1e-3):
+    '''
+    Every UAV sends a flow lasting flowTime every period (staggered), the network is idle otherwise
+    each step costs rtt of wall time as a stand-in for the NS/AirSim round trip
+    compare fixed steps against adaptiveStep
+    '''
+    for adaptive in [0, 1]:
+        resetCtrl(step)
+        Ctrl.netConfig.update({'adaptiveStep': adaptive, 'maxStepSize': 1.0})
+        Ctrl.endTime = endTime
+        ctrl = Ctrl.__new__(Ctrl) # only the stepping logic, no sockets or AirSim
+        ctrl.netConfig = Ctrl.netConfig
+        ctrl.numSteps = ctrl.numCoarseSteps = ctrl.numSaved = 0
+        lock = threading.Lock()
+        flowEnds = []
+        def probe():
+            with lock:
+                return sum(1 for t in flowEnds if t > Ctrl.GetSimTime()), 0
+        Ctrl.trafficProbe = probe
+        def uav(i):
+            Ctrl.Wait(period * i / numUav)
+            while Ctrl.ShouldContinue():
+                with lock:
+                    flowEnds.append(Ctrl.GetSimTime() + flowTime)
+                Ctrl.Wait(period)
+        threads = [threading.Thread(target=uav, args=(i,)) for i in range(numUav)]
+        for td in threads:
+            td.start()
+        t0 = time.perf_counter()
+        while Ctrl.ShouldContinue():
+            while len(Ctrl.scheduler) < numUav:
+                time.sleep(1e-4)
+            dt = ctrl.nextSimStepSize()
+            ctrl.countStep(dt)
+            time.sleep(rtt)
+            with Ctrl.mutex:
+                Ctrl.simTime += dt
+            Ctrl.notifyWait()
+        t1 = time.perf_counter()
+        with Ctrl.mutex:
+            Ctrl.isRunning = False
+        Ctrl.notifyWait()
+        for td in threads:
+            td.join()
+        Ctrl.trafficProbe = None
+        print(f'[adaptive={adaptive}] {endTime} sim sec in {t1 - t0:.3f} sec, {ctrl.stepStats()}')
+
+class StubSim():
+    '''
+    Stand in for the AirSim client of Ctrl
+    simContinueForTime costs cost wall seconds, UAV i flies along x at i m/s
+    '''
+    def __init__(self, cost):
+        self.cost = cost
+        self.t = 0.0
+    def simContinueForTime(self, step):
+        time.sleep(self.cost)
+        self.t += step
+    def simGetGroundTruthKinematics(self, vehicle_name=''):
+        v = lambda x=0.0, y=0.0, z=0.0, w=0.0: SimpleNamespace(x_val=x, y_val=y, z_val=z, w_val=w)
+        speed = float(vehicle_name[1:])
+        return SimpleNamespace(position=v(speed * self.t), orientation=v(w=1.0), linear_velocity=v(speed), angular_velocity=v())
+
+def stubNs(context, cost, name, steps=None):
+    '''
+    Stand in for AirSimSync::takeTurn(), every step costs cost wall seconds
+    the steps it simulated are appended to steps
+    '''
+    recv = context.socket(zmq.PULL)
+    recv.connect(f'inproc://bench-ctrl-down-{name}')
+    send = context.socket(zmq.PUSH)
+    send.connect(f'inproc://bench-ctrl-up-{name}')
+    send.send(b'0') # startAirSim()
+    while True:
+        send.send(b'0')
+        parts = recv.recv_multipart()
+        if parts[0].startswith(b'bye'):
+            break
+        if steps is not None:
+            steps.append(float(parts[0]))
+        time.sleep(cost)
+    recv.close()
+    send.close()
+
+def benchPipeline(numUav=16, numSteps=1000, step=0.01, nsCost=1e-3, airsimCost=1e-3, skews=(0, 1, 2)):
+    '''
+    Ctrl.run() against stub AirSim and NS that each take a fixed wall time per step
+    compare stepping in turn against pipelineSkew 1 and 2, report the position error NS sees
+    '''
+    for skew in skews:
+        resetCtrl(step)
+        Ctrl.netConfig.update({'pipelineSkew': skew, 'uavsName': [f'U{i}' for i in range(numUav)]})
+        Ctrl.endTime = numSteps * step
+        Ctrl.fleetIndex = {f'U{i}': i for i in range(numUav)}
+        ctrl = Ctrl.__new__(Ctrl)
+        threading.Thread.__init__(ctrl)
+        ctrl.netConfig = Ctrl.netConfig
+        ctrl.client = StubSim(airsimCost)
+        ctrl.numSteps = ctrl.numCoarseSteps = ctrl.numSaved = 0
+        ctrl.ahead = deque()
+        ctrl.nsTime = ctrl.maxSkew = ctrl.posErrorSum = ctrl.maxPosError = ctrl.numNsSteps = ctrl.numDeferred = 0
+        ctrl.nsFleetState = None
+        ctrl.zmqSendSocket = context.socket(zmq.PUSH)
+        ctrl.zmqSendSocket.bind(f'inproc://bench-ctrl-down-{skew}')
+        ctrl.zmqRecvSocket = context.socket(zmq.PULL)
+        ctrl.zmqRecvSocket.bind(f'inproc://bench-ctrl-up-{skew}')
+        nsSteps = []
+        ns = threading.Thread(target=stubNs, args=(context, nsCost, skew, nsSteps))
+        ns.start()
+        ctrl.zmqRecvSocket.recv() # NS kick start
+        t0 = time.perf_counter()
+        ctrl.run()
+        t1 = time.perf_counter()
+        ns.join()
+        ctrl.zmqSendSocket.close()
+        ctrl.zmqRecvSocket.close()
+        print(f'[pipeline skew={skew}] {numSteps} steps in {t1 - t0:.3f} sec, {numSteps/(t1 - t0):.0f} steps/sec, NS simulated {sum(nsSteps):.3f} of {Ctrl.GetSimTime():.3f} sim sec, {ctrl.pipelineStats()}')
+        if abs(sum(nsSteps) - Ctrl.GetSimTime()) > step / 2:
+            raise RuntimeError(f'NS stopped {Ctrl.GetSimTime() - sum(nsSteps):.3f} sim sec before apps')
+
+def benchProfile(numSteps=1000):
+    '''
+    Cost of StepProfiler.record() and a profiled Ctrl.run() against stub AirSim and NS (NS is the slower side)
+    '''
+    profiler = StepProfiler(capacity=1024)
+    for enabled in [False, True]:
+        profiler.enabled = enabled
+        n = 100000
+        t0 = time.perf_counter()
+        for i in range(n):
+            profiler.record(i * 0.01, 0.01, 1e-3, 1e-3, 0.0, 1e-5, 3, 2, 1)
+        t1 = time.perf_counter()
+        print(f'[profile] record() enabled={enabled}: {(t1 - t0) / n * 1e6:.2f} us')
+    Ctrl.profiler = StepProfiler(enabled=True)
+    benchPipeline(numSteps=numSteps, nsCost=2e-3, skews=(0,)) # Ctrl.run() prints the summary
+    with tempfile.TemporaryDirectory() as folder:
+        for name in ['profile.csv', 'profile.json']:
+            path = os.path.join(folder, name)
+            Ctrl.profiler.export(path)
+            print(f'[profile] exported {os.path.getsize(path)} bytes to {name}')
+
+def benchRx(numUav=64, numSteps=500, step=0.01, period=0.5, msgSize=1024):
+    '''
+    numUav threads receive one msg from GCS every period, the clock steps every step
+    compare polling (Rx() then Ctrl.Wait(step)) against RxUntil(), delivery is inline so every step is deterministic
+    '''
+    uavsName = [f'U{i}' for i in range(numUav)]
+    resetCtrl(step)
+    Ctrl.netConfig['useBinaryWire'] = 1
+    sinks = registerBench(mainRouter, uavsName)
+    poller = zmq.Poller()
+    for sink in sinks:
+        poller.register(sink, zmq.POLLIN)
+    def deliver(numFlows):
+        '''
+        report every request as sent and received at once, like fakeNs() but in this thread
+        '''
+        while numFlows > 0:
+            for sink, _ in poller.poll(1000):
+                req = sink.recv()
+                records = []
+                for src, dst, op, size, fid in WIRE_RECORD.iter_unpack(req[WIRE_HEADER.size:]):
+                    records.append(WIRE_RECORD.pack(src, dst, WIRE_OP_SEND, size, fid))
+                    records.append(WIRE_RECORD.pack(src, dst, WIRE_OP_RECV, size, -1))
+                    numFlows -= 1
+                mainRouter.dispatch(memoryview(WIRE_HEADER.pack(WIRE_VERSION, 0, len(records)) + b''.join(records)))
+    uavEndPoints = [mainRouter.endPoints[name] for name in uavsName]
+    for mode in ['poll', 'rxuntil']:
+        resetCtrl(step)
+        Ctrl.netConfig['useBinaryWire'] = 1
+        mainRouter.metrics = FlowMetrics()
+        got = [0] * numUav
+        delay = [] # sim sec from delivery to Rx
+        deliveredAt = 0
+        def uav(k):
+            name = uavsName[k]
+            while Ctrl.ShouldContinue():
+                if mode == 'poll':
+                    if mainRouter.recv(name, block=False, timeout=None) is not None:
+                        got[k] += 1
+                        delay.append(Ctrl.GetSimTime() - deliveredAt)
+                    Ctrl.Wait(step)
+                else:
+                    # AppBase.RxUntil(Ctrl.GetEndTime())
+                    if mainRouter.recv(name, block=False, timeout=None) is not None:
+                        got[k] += 1
+                        delay.append(Ctrl.GetSimTime() - deliveredAt)
+                    else:
+                        mainRouter.select([name], Ctrl.GetEndTime())
+        def parked():
+            if mode == 'poll':
+                return len(Ctrl.scheduler)
+            return sum(len(endPoint.waiters) for endPoint in uavEndPoints)
+        threads = [threading.Thread(target=uav, args=(k,)) for k in range(numUav)]
+        for td in threads:
+            td.start()
+        woken = 0
+        every = round(period / step)
+        t0 = time.perf_counter()
+        for i in range(numSteps):
+            while parked() < numUav:
+                time.sleep(1e-5)
+            if i % every == 0:
+                for name in uavsName:
+                    mainRouter.startFlow(Flow('GCS', name, MsgRaw(bytes(msgSize))))
+                deliveredAt = Ctrl.GetSimTime()
+                deliver(numUav)
+                # woken by delivery, every receiver takes its msg before the clock moves
+                while mode == 'rxuntil' and (parked() < numUav or sum(got) < numUav * (i // every + 1)):
+                    time.sleep(1e-5)
+            with Ctrl.mutex:
+                Ctrl.simTime += step
+            Ctrl.notifyWait()
+            woken += Ctrl.numWoken
+        spent = time.perf_counter() - t0
+        with Ctrl.mutex:
+            Ctrl.isRunning = False
+        Ctrl.notifyWait()
+        mainRouter.finish()
+        for td in threads:
+            td.join()
+        print(f'[rx {mode}] {numUav} uavs, {numSteps} steps in {spent:.3f} sec, {spent/numSteps*1e3:.2f} ms/step, {sum(got)} msgs, mean Rx delay {sum(delay)/max(1, len(delay))*1e3:.1f} ms sim, {woken} wakeups by the clock')
+
+def benchMetrics(numUav=16, numMsg=50, msgSize=50*1024, chunk=1448, step=0.01):
+    '''
+    Flows of every UAV to GCS through fakeNs while the sim clock advances, then per-pair metrics
+    UAV i sends every i + 1 steps so goodput differs by pair
+    '''
+    uavsName = [f'U{i}' for i in range(numUav)]
+    Ctrl.netConfig = {'useBinaryWire': 1}
+    resetCtrl(step)
+    mainRouter.metrics = FlowMetrics()
+    sinks = registerBench(mainRouter, uavsName)
+    stop = threading.Event()
+    ns = threading.Thread(target=fakeNs, args=(mainRouter, sinks, chunk, stop))
+    ns.start()
+    got = 0
+    t0 = time.perf_counter()
+    k = 0
+    while got < numUav * numMsg:
+        for i, name in enumerate(uavsName):
+            if k % (i + 1) == 0 and k // (i + 1) < numMsg:
+                mainRouter.startFlow(Flow(name, 'GCS', MsgRaw(bytes(msgSize))))
+        k += 1
+        time.sleep(1e-3) # let fakeNs report within this step
+        with Ctrl.mutex:
+            Ctrl.simTime += step
+        while mainRouter.recv('GCS', block=False, timeout=None) is not None:
+            got += 1
+    t1 = time.perf_counter()
+    stop.set()
+    ns.join()
+    query = mainRouter.metrics.query(dst='GCS')
+    for name in [uavsName[0], uavsName[-1]]:
+        m = query[(name, 'GCS')]
+        print(f'[metrics] {name} -> GCS: flows {m["flows"]}, goodput {m["goodput"]/1e6:.2f} Mbps, latency {m["latency"]}, wall latency p50 {m["wallLatency"]["p50"]*1e3:.2f} ms')
+    t2 = time.perf_counter()
+    n = 100
+    for i in range(n):
+        mainRouter.metrics.query()
+    t3 = time.perf_counter()
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'metrics.jsonl')
+        mainRouter.metrics.dump(path, Ctrl.GetSimTime())
+        print(f'[metrics] {got} flows in {t1 - t0:.3f} sec, query() of {len(query)} pairs {(t3 - t2) / n * 1e3:.2f} ms, dump {os.path.getsize(path)} bytes')
+
+def benchEmulate(numUav=16, numSteps=1000, step=0.01, period=0.1, msgSize=4096, stepLatency=1e-3, useAnalyticNet=False, tracePath='', transport='tcp'):
+    '''
+    Load test of Ctrl, Router and coroutine apps against NsEmulator (or AnalyticNet) and the stub AirSim client
+    Every UAV flies and sends msgSize to GCS each period, same startup order as main.py
+    AirSim takes stepLatency per step, apps run while it steps like they do with Unreal
+    tracePath: record the run, see benchReplay()
+    transport: of every socket, see endpoint.py
+    '''
+    useStubClient(stepLatency=stepLatency)
+    mainEndpoints.configure(transport, runDir=os.path.join(tempfile.gettempdir(), f'airsimn-bench-{os.getpid()}'))
+    uavsName = [f'U{i}' for i in range(numUav)]
+    settings = {'Vehicles': {name: {'VehicleType': 'SimpleFlight'} for name in uavsName},
+        'updateGranularity': step, 'endTime': numSteps * step, 'tracePath': tracePath}
+    if useAnalyticNet:
+        ns = None
+        settings.update({'useAnalyticNet': 1, 'initEnbApPos': [[0, 0, 0], [20, 0, 0]], 'analyticLinkRate': 20e6, 'analyticRange': 5.0})
+    else:
+        # own context like a separate process unless inproc, which only connects within one context
+        ns = NsEmulator(context if transport == 'inproc' else None, bandwidth=20e6, delay=5e-3)
+        ns.start()
+    ctrl = Ctrl(context)
+    with tempfile.TemporaryDirectory() as folder:
+        settingsPath = os.path.join(folder, 'settings.json')
+        with open(settingsPath, 'w') as f:
+            json.dump(settings, f)
+        with contextlib.redirect_stdout(io.StringIO()): # the parsed config is long
+            ctrl.sendNetConfig(settingsPath)
+    for i, name in enumerate(['GCS'] + uavsName):
+        mainRouter.register(name, AIRSIM2NS_GCS_PORT_START if i == 0 else AIRSIM2NS_UAV_PORT_START + i - 1)
+    mainRouter.compile()
+    ctrl.waitForSyncStart()
+    client = airsim.MultirotorClient()
+    for i, name in enumerate(uavsName):
+        client.moveByVelocityAsync(math.cos(i), math.sin(i), 0, numSteps * step, vehicle_name=name)
+    numRx = 0
+    async def uav(name):
+        while Ctrl.ShouldContinue():
+            await Ctrl.sleep(period)
+            mainRouter.startFlow(Flow(name, 'GCS', MsgRaw(bytes(msgSize))))
+    async def gcs():
+        nonlocal numRx
+        while await mainRouter.recvAsync('GCS') is not None:
+            numRx += 1
+    async def runAll():
+        await asyncio.gather(gcs(), *[uav(name) for name in uavsName])
+    t0 = time.perf_counter()
+    mainRouter.start()
+    ctrl.start()
+    asyncio.run(runAll())
+    ctrl.join()
+    mainRouter.join()
+    if ns is not None:
+        ns.join()
+    t1 = time.perf_counter()
+    latency = percentiles([x for pair in mainRouter.metrics.pairs.values() for x in pair.latency])
+    stats = mainRouter.stats()
+    print(f'[{"analytic" if useAnalyticNet else "emulate"} {transport}] {numUav} UAVs, {ctrl.numSteps} steps in {t1 - t0:.3f} sec, {ctrl.numSteps/(t1 - t0):.0f} steps/sec, '
+        f'realtime x{Ctrl.GetSimTime()/(t1 - t0):.2f}, {stats["startedFlows"]} flows, {numRx} delivered, {stats["retiredFlows"]} retired, {stats["cutoffFlows"]} cut off at endTime, '
+        f'latency p50 {latency.get("p50", 0)*1e3:.1f} ms p99 {latency.get("p99", 0)*1e3:.1f} ms, '
+        f'network {Ctrl.netModel.stats() if useAnalyticNet else ns.stats()}')
+
+def sweepEmulate(uavs=(1, 10, 100, 1000), steps=1000, target='emulate'):
+    '''
+    benchEmulate() for each number of UAVs in its own process (ports and Ctrl are per process)
+    '''
+    for numUav in uavs:
+        subprocess.run([sys.executable, __file__, target, '--uavs', str(numUav), '--steps', str(steps)], check=True)
+
+def benchAnalytic(numUav=16, numSteps=1000, numPairs=1000, numResources=100):
+    '''
+    Cost of one max-min fair allocation, then benchEmulate() with AnalyticNet
+    '''
+    # two flows on a 10 link, one of them also on a 3 link: 3 and 7
+    print(f'[analytic] maxMinFair sanity {maxMinFair(np.array([0, 0, 1]), np.array([0, 1, 0]), np.array([10.0, 3.0]), 2)}')
+    rng = np.random.default_rng(0)
+    incPair = np.repeat(np.arange(numPairs), 3)
+    incRes = rng.integers(0, numResources, len(incPair))
+    capacity = rng.uniform(1e6, 1e8, numResources)
+    spent = timeit(lambda: maxMinFair(incPair, incRes, capacity, numPairs))
+    print(f'[analytic] maxMinFair of {numPairs} pairs over {numResources} resources: {spent * 1e3:.2f} ms')
+    benchEmulate(numUav, numSteps, useAnalyticNet=True)
+
+def stepPingPong(transport, numSteps, numUav):
+    '''
+    Internal use only
+    return round trip times of the step handshake between Ctrl and NS (ntf, step + fleet state) over transport
+    '''
+    mainEndpoints.configure(transport, runDir=os.path.join(tempfile.gettempdir(), f'airsimn-bench-{os.getpid()}'))
+    nsContext = context if transport == 'inproc' else zmq.Context() # NS is another process unless inproc
+    ctrlSend = context.socket(zmq.PUSH)
+    ctrlSend.bind(mainEndpoints.bind(AIRSIM2NS_CTRL_PORT))
+    ctrlRecv = context.socket(zmq.PULL)
+    ctrlRecv.connect(mainEndpoints.connect(NS2AIRSIM_CTRL_PORT))
+    def ns():
+        recv = nsContext.socket(zmq.PULL)
+        recv.connect(mainEndpoints.connect(AIRSIM2NS_CTRL_PORT))
+        send = nsContext.socket(zmq.PUSH)
+        send.bind(mainEndpoints.bind(NS2AIRSIM_CTRL_PORT))
+        for i in range(numSteps + 1):
+            send.send(b'0')
+            recv.recv_multipart()
+        recv.close(linger=0)
+        send.close(linger=0)
+    td = threading.Thread(target=ns)
+    td.start()
+    fleetState = np.zeros((numUav, FLEET_WIDTH))
+    rtts = []
+    ctrlRecv.recv()
+    ctrlSend.send_string('0.01', zmq.SNDMORE)
+    ctrlSend.send(fleetState, copy=False)
+    for i in range(numSteps):
+        t0 = time.perf_counter()
+        ctrlRecv.recv()
+        ctrlSend.send_string('0.01', zmq.SNDMORE)
+        ctrlSend.send(fleetState, copy=False)
+        rtts.append(time.perf_counter() - t0)
+    td.join()
+    ctrlSend.close(linger=0)
+    ctrlRecv.close(linger=0)
+    if nsContext is not context:
+        nsContext.term()
+    return rtts
+
+def benchTransport(numUav=16, numSteps=5000, numEmulateSteps=1000):
+    '''
+    Step round trip of Ctrl <-> NS over every transport (sockets only),
+    then benchEmulate() over each in its own process
+    the time Ctrl waits for NS in recv() covers the send of the previous step and the next ntf
+    '''
+    for transport in TRANSPORTS:
+        stepPingPong(transport, 200, numUav) # warm up
+        printHistogram(f'[transport {transport}] step round trip', stepPingPong(transport, numSteps, numUav))
+    for transport in TRANSPORTS:
+        subprocess.run([sys.executable, __file__, 'emulate', '--uavs', str(numUav), '--steps', str(numEmulateSteps), '--transport', transport], check=True)
+
+def benchReplay(numUav=16, numSteps=1000):
+    '''
+    Record benchEmulate(), then replay its flows without NsEmulator, AirSim and apps (replay.py)
+    one process each, both bind the ports of Ctrl and Router
+    raise if the replay delivers a different number of flows than the recorded run
+    '''
+    def run(args):
+        out = subprocess.run([sys.executable] + args, check=True, capture_output=True, text=True).stdout
+        print(out, end='')
+        return out
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'trace.bin')
+        out = run([__file__, 'emulate', '--uavs', str(numUav), '--steps', str(numSteps), '--trace', path])
+        recorded = int(re.search(r'(\d+) delivered', out).group(1))
+        print(f'[replay] trace of {os.path.getsize(path)} bytes')
+        out = run([os.path.join(os.path.dirname(os.path.abspath(__file__)), 'replay.py'), path])
+        replayed = int(re.search(r"'drained': (\d+)", out).group(1))
+        if replayed != recorded:
+            raise RuntimeError(f'replay delivered {replayed} flows, the recorded run {recorded}')
+
+def benchSweep(repeat=2, endTime=3.0):
+    '''
+    One emulated throughput cell of sweep.py, run repeat times (one main.py process each)
+    raise unless every run gives the same sweep.RESULTS, the apps run in lockstep with the clock (lockstep.py)
+    '''
+    settings = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'settings', 'static.json')
+    with tempfile.TemporaryDirectory() as folder:
+        sweep = Sweep(settings, {}, {'TARGET': 'throughput', 'SINK': 'null', 'PERIOD': 0.01, 'endTime': endTime}, folder, repeat=repeat)
+        t0 = time.perf_counter()
+        rows = sweep.run(repeat)
+        print(f'[sweep] {repeat} runs in {time.perf_counter() - t0:.1f} sec: ' + ', '.join(f'{name} {rows[0][name]}' for name in RESULTS))
+    if rows[0]['returncode'] != 0 or rows[0]['flows'] == 0:
+        raise RuntimeError(f'the cell failed: {rows[0]}')
+    if not rows[0]['agree']:
+        raise RuntimeError(f'{repeat} runs of the same cell disagree')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('target', choices=['wire', 'stress', 'runtime', 'scheduler', 'codec', 'capture', 'rpc', 'barrier', 'rx', 'decode', 'sink', 'adaptive', 'pipeline', 'profile', 'metrics', 'emulate', 'analytic', 'replay', 'transport', 'sweep'])
+    parser.add_argument('--waiters', type=int, default=10000)
+    parser.add_argument('--steps', type=int, default=1000)
+    parser.add_argument('--uavs', type=int, default=16)
+    parser.add_argument('--trace', default='', help='emulate: record the run to this file')
+    parser.add_argument('--transport', default='tcp', choices=TRANSPORTS, help='emulate: transport of every socket')
+    parser.add_argument('--sweep', action='store_true', help='emulate, analytic: run 1 to 1000 UAVs, one process each')
+    args = parser.parse_args()
+    if args.target == 'wire':
+        benchWire()
+    elif args.target == 'stress':
+        benchStress()
+    elif args.target == 'runtime':
+        benchRuntime()
+    elif args.target == 'scheduler':
+        benchScheduler(args.waiters, args.steps)
+    elif args.target == 'codec':
+        benchCodec()
+    elif args.target == 'capture':
+        benchCapture(args.uavs, args.steps)
+    elif args.target == 'rpc':
+        benchRpc(args.uavs, args.steps)
+    elif args.target == 'barrier':
+        benchBarrier(args.uavs, args.steps)
+    elif args.target == 'rx':
+        benchRx(args.uavs, args.steps)
+    elif args.target == 'decode':
+        benchDecode(args.uavs)
+    elif args.target == 'sink':
+        benchSink()
+    elif args.target == 'adaptive':
+        benchAdaptive(args.uavs)
+    elif args.target == 'pipeline':
+        benchPipeline(args.uavs, args.steps)
+    elif args.target == 'profile':
+        benchProfile(args.steps)
+    elif args.target == 'metrics':
+        benchMetrics(args.uavs)
+    elif args.target == 'emulate':
+        if args.sweep:
+            sweepEmulate(steps=args.steps)
+        else:
+            benchEmulate(args.uavs, args.steps, tracePath=args.trace, transport=args.transport)
+    elif args.target == 'analytic':
+        if args.sweep:
+            sweepEmulate(steps=args.steps, target='analytic')
+        else:
+            benchAnalytic(args.uavs, args.steps)
+    elif args.target == 'replay':
+        benchReplay(args.uavs, args.steps)
+    elif args.target == 'transport':
+        benchTransport(args.uavs)
+    elif args.target == 'sweep':
+        benchSweep()
+    context.destroy(linger=0)
+    sys.exit()
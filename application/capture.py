@@ -0,0 +1,162 @@
+import setup_path
+import airsim
+import threading
+import time
+from concurrent.futures import Future
+from ctrl import Ctrl
+from rpcpool import mainClientPool
+
+POLL = 1e-3 # wall sec between looks at Ctrl.barrier while a batch is not filled
+
+class CaptureService():
+    '''
+    Shared camera capture for all apps
+    Usage:
+    with Ctrl.Frozen():
+        png = mainCapture.getImage(vehicleName, '0') # same as client.simGetImage('0', Scene, vehicle_name)
+        response = mainCapture.get(vehicleName, '0', airsim.ImageType.DepthPerspective, pixelsAsFloat=True)
+
+    Requests made at the same sim time are gathered into one batch,
+    the batch is issued as one simGetImages() per vehicle by the first requester (the leader)
+    once expected requests have arrived, or once every participant released at this tick of Ctrl.barrier
+    has either requested or arrived, timeout seconds (wall time) at most
+    With expected 0 the leader waits window seconds (wall time) instead
+    AirSim serves one vehicle per simGetImages(), so a step costs one batch of one RPC per vehicle
+    however many cameras, image types and readers it has
+    A frame is cached per (vehicle, camera, image type, sim time), repeated readers share it without RPC
+    '''
+    def __init__(self, client=None, window=0.002, expected=0, timeout=1.0):
+        '''
+        @param client: anything with simGetImages(requests, vehicle_name), mainClientPool by default
+        @param window: how long the leader waits for others when expected is 0
+        @param expected: flush once this many requests are gathered, 0 to always wait window
+        @param timeout: safety bound of the wait for expected requests, a batch is never split before
+        '''
+        self.client = client
+        self.window = window
+        self.expected = expected
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.rpcLock = threading.Lock() # one batch at a time
+        self.filled = threading.Condition(self.lock)
+        self.batch = [] # [(key, Future), ...] not yet issued
+        self.requesters = set() # threads with a request in self.batch
+        self.cache = {} # key -> Future, only frames of cacheTime
+        self.cacheTime = None
+        self.numRequests = 0
+        self.numHits = 0
+        self.numRpc = 0
+        self.numBatches = 0
+    def setExpected(self, expected):
+        with self.lock:
+            self.expected = expected
+    def GetClient(self):
+        '''
+        Internal use only, self.rpcLock must be held
+        '''
+        if self.client is None:
+            self.client = mainClientPool.proxy()
+        return self.client
+    def request(self, vehicleName, camera='0', imageType=airsim.ImageType.Scene, pixelsAsFloat=False, compress=True):
+        '''
+        return concurrent.futures.Future of airsim.ImageResponse
+        Call this in Ctrl.Frozen() so that every request of this step sees the same frame
+        '''
+        t = Ctrl.GetSimTime()
+        key = (vehicleName, str(camera), imageType, pixelsAsFloat, compress)
+        with self.lock:
+            if t != self.cacheTime:
+                self.cache = {}
+                self.cacheTime = t
+            fut = self.cache.get(key)
+            if fut is not None:
+                self.numHits += 1
+                return fut
+            fut = Future()
+            self.cache[key] = fut
+            self.batch.append((key, fut))
+            self.requesters.add(threading.get_ident())
+            self.numRequests += 1
+            isLeader = len(self.batch) == 1
+            if self.expected > 0:
+                self.filled.notify()
+        if isLeader:
+            self.flush()
+        return fut
+    def get(self, *args, **kwargs):
+        '''
+        Blocking version of request()
+        '''
+        return self.request(*args, **kwargs).result()
+    def getImage(self, vehicleName, camera='0', imageType=airsim.ImageType.Scene):
+        '''
+        Drop-in replacement of client.simGetImage(), return compressed image bytes
+        '''
+        return self.get(vehicleName, camera, imageType).image_data_uint8
+    def isFilled(self):
+        '''
+        Internal use only, self.lock must be held
+        True once expected requests are in or no participant of the current tick can still request
+        '''
+        if len(self.batch) >= self.expected:
+            return True
+        # a participant with a request in the batch is blocked on it, the others have arrived or still may ask
+        pending = Ctrl.barrier.numPending()
+        return pending > 0 and len(self.requesters) >= pending
+    def flush(self):
+        '''
+        Internal use only
+        Wait for the batch to fill then issue it
+        '''
+        if self.expected > 0:
+            deadline = time.perf_counter() + self.timeout
+        else:
+            deadline = time.perf_counter() + self.window
+        with self.lock:
+            while self.expected <= 0 or not self.isFilled():
+                left = deadline - time.perf_counter()
+                if left <= 0:
+                    break
+                if self.expected > 0:
+                    # arrivals at the barrier do not notify, look again every POLL
+                    left = min(left, POLL)
+                self.filled.wait(left)
+            batch = self.batch
+            self.batch = []
+            self.requesters = set()
+            if len(batch) > 0:
+                self.numBatches += 1
+        groups = {} # vehicle -> [(key, Future), ...]
+        for key, fut in batch:
+            groups.setdefault(key[0], []).append((key, fut))
+        with self.rpcLock:
+            client = self.GetClient()
+            for vehicleName, group in groups.items():
+                requests = [airsim.ImageRequest(key[1], key[2], key[3], key[4]) for key, fut in group]
+                try:
+                    responses = client.simGetImages(requests, vehicle_name=vehicleName)
+                    self.numRpc += 1
+                except Exception as e:
+                    for key, fut in group:
+                        fut.set_exception(e)
+                    continue
+                if len(responses) != len(group):
+                    e = RuntimeError(f'{len(group)} images requested from {vehicleName}, got {len(responses)}')
+                    for key, fut in group:
+                        fut.set_exception(e)
+                    continue
+                for (key, fut), response in zip(group, responses):
+                    fut.set_result(response)
+    def stats(self):
+        '''
+        return dict of counters
+        '''
+        with self.lock:
+            return {
+                'requests': self.numRequests,
+                'cacheHits': self.numHits,
+                'rpc': self.numRpc,
+                'batches': self.numBatches,
+            }
+
+mainCapture = CaptureService()
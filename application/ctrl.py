@@ -2,15 +2,25 @@ import setup_path
 import airsim
 import threading
 import re
+import struct
 import zmq
 import time
 import sys
-import heapq
 import json
 import math
+import asyncio
+import numpy as np
+from collections import deque
+from scheduler import Scheduler
+from barrier import TickBarrier
+from lockstep import Lockstep
+from profiler import StepProfiler
+from endpoint import mainEndpoints
+from rpcpool import mainClientPool
 
 # ! CONST VALUE "DON'T MODIFY ANY OF THEN"
 # Theses vars correspond to AirSimSync.h
+# they name the sockets, the address depends on the transport (see endpoint.py)
 AIRSIM2NS_UAV_PORT_START = 6000
 AIRSIM2NS_GCS_PORT_START = 4998
 # Ctrl sync ZMQ port
@@ -19,8 +29,29 @@ AIRSIM2NS_CTRL_PORT = 8001
 # UAV,GCS -> (Pub-Sub) -> Router
 NS2ROUTER_PORT = 9000
 
+# Fleet state columns, one row per UAV in uavsName order (see Ctrl.GetFleetState())
+# Sent to NS as float64 right after the step, corresponds to FLEET_WIDTH in AirSimSync.h
+FLEET_POS = slice(0, 3) # x, y, z
+FLEET_ORIENT = slice(3, 7) # x, y, z, w (same order as airsim.Quaternionr)
+FLEET_LINVEL = slice(7, 10)
+FLEET_ANGVEL = slice(10, 13)
+FLEET_WIDTH = 13
+
+# Binary wire protocol between Router/NsEmulator and NS, corresponds to flow.h
+# frame = header + count * record, little-endian
+# with WIRE_FLAG_TIMED (NS -> Router), each record is followed by the sim time of the event (float64)
+WIRE_VERSION = 1
+WIRE_OP_SEND = 1
+WIRE_OP_RECV = 2
+WIRE_OP_STOP = 3
+WIRE_FLAG_TIMED = 0x1
+WIRE_HEADER = struct.Struct('<BBH') # version, flags, count
+WIRE_RECORD = struct.Struct('<HHB3xIi') # src, dst, op, size, fid
+WIRE_TIMED_RECORD = struct.Struct('<HHB3xIid') # WIRE_RECORD + sim time
+WIRE_MAX_RECORDS = 4096 # records batched in one frame
+
 VERBOSE=False # to print sync message
-TIME_TEST=False # to tract time spent on ns3 and AirSim 
+PROFILE=False # to record per-step timing from the start, see Ctrl.profiler
 
 class Ctrl(threading.Thread):
     '''
@@ -32,22 +63,46 @@ class Ctrl(threading.Thread):
     
     with Ctrl.Frozen():
         # do some work
+
+    # once per 0.1 sim sec together with every other participant, the clock waits for all (see barrier.py)
+    tick = Ctrl.JoinTick(0.1)
+    while tick.wait():
+        # do some work
+        tick.arrive()
+    tick.leave()
+
+    # in a coroutine (see asyncAppBase.py)
+    await Ctrl.sleep_until(t)
+
+    # kinematics of every UAV at this step, read-only and shared by all apps
+    pos = Ctrl.GetKinematics(name)[FLEET_POS]
     '''
     endTime = math.inf
     mutex = threading.Lock()
     simTime = 0
     isRunning = True
-    suspended = []
+    scheduler = Scheduler() # pending WaitUntil() and sleep_until(), woken in batch by notifyWait()
+    local = threading.local() # per thread waiter, see GetWaiter()
+    lockstep = Lockstep() # off unless configured, the clock waits for every app to park (main.py --emulate)
+    barrier = TickBarrier(lockstep=lockstep) # per-tick participants, see JoinTick()
     netConfig = {}
-    sn = 0 # serial number
     freezeSet = set()
     freezeCond = threading.Condition()
+    trafficProbe = None # return (live flows, queued msgs) of Router, set by Router.compile()
+    releaseRequests = None # Router.release(t), send flow requests held back until NS reaches t, set by Router.compile()
+    netModel = None # netmodel.AnalyticNet stepped in place of NS if useAnalyticNet, set by Router.compile()
+    recorder = None # replay.TraceRecorder if tracePath is set, set by Router.compile()
+    profiler = StepProfiler(enabled=PROFILE) # per-step records, Ctrl.profiler.enable()/disable() at runtime
+    numWoken = 0 # waiters resumed by the last notifyWait()
+    fleetIndex = {} # UAV name -> row of fleetState
+    fleetState = np.zeros((0, FLEET_WIDTH)) # replaced (never modified) once per step
 
-    def __init__(self, context, **kwargs):
+    def __init__(self, context, client=None, **kwargs):
         '''
         Control the pace of simulation
         Note that there should be only 1 instance of this class
         since some of the feature is static
+        @param client: anything like airsim.MultirotorClient, mainClientPool if None
         '''
         zmqSendPort = AIRSIM2NS_CTRL_PORT
         zmqRecvPort = NS2AIRSIM_CTRL_PORT
@@ -55,13 +110,23 @@ class Ctrl(threading.Thread):
         NS2AIRSIM_CTRL_PORT
         threading.Thread.__init__(self)
         self.zmqRecvSocket = context.socket(zmq.PULL)
-        self.zmqRecvSocket.connect(f'tcp://localhost:{zmqRecvPort}')
+        self.zmqRecvSocket.connect(mainEndpoints.connect(zmqRecvPort))
 
         self.zmqSendSocket = context.socket(zmq.PUSH)
-        self.zmqSendSocket.bind(f'tcp://*:{zmqSendPort}')
-        self.client = airsim.MultirotorClient()
-        self.client.confirmConnection()
+        self.zmqSendSocket.bind(mainEndpoints.bind(zmqSendPort))
+        self.client = client if client is not None else mainClientPool.proxy()
         self.client.simRunConsoleCommand('stat fps')
+        self.numSteps = 0
+        self.numCoarseSteps = 0
+        self.numSaved = 0
+        self.ahead = deque() # (step, fleetState) simulated by AirSim but not yet sent to NS
+        self.nsTime = 0 # end of the step NS is simulating
+        self.nsFleetState = None # fleet state NS is simulating with
+        self.maxSkew = 0
+        self.posErrorSum = 0
+        self.maxPosError = 0
+        self.numNsSteps = 0
+        self.numDeferred = 0
     
     @staticmethod
     def WaitUntil(t, cb=None):
@@ -73,16 +138,16 @@ class Ctrl(threading.Thread):
         with Ctrl.mutex:
             isRunning = Ctrl.isRunning
             tsim = Ctrl.simTime
-            sn = Ctrl.sn
-            Ctrl.sn += 1
         # suspended
         if isRunning is True and t > tsim:
-            cond = threading.Condition()
+            waiter = Ctrl.GetWaiter()
+            timer = Ctrl.lockstep.park(waiter, lambda: Ctrl.scheduler.schedule(t, waiter))
             with Ctrl.mutex:
-                heapq.heappush(Ctrl.suspended, (t, sn, cond, cb))
-            cond.acquire()
-            cond.wait()
-            cond.release()
+                isRunning = Ctrl.isRunning
+            # simulation stopped before the timer was visible to notifyWait()
+            if isRunning or not Ctrl.scheduler.cancel(timer):
+                waiter.acquire()
+            Ctrl.lockstep.resume(waiter)
         if cb is not None:
             return cb()
         return None
@@ -90,6 +155,48 @@ class Ctrl(threading.Thread):
     def Wait(delay, cb=None):
         Ctrl.WaitUntil(Ctrl.GetSimTime() + delay, cb)
     @staticmethod
+    async def sleep_until(t):
+        '''
+        Coroutine version of WaitUntil(), suspend the calling task until t
+        Return immediately if this thread is not running
+        '''
+        with Ctrl.mutex:
+            isRunning = Ctrl.isRunning
+            tsim = Ctrl.simTime
+        if isRunning is True and t > tsim:
+            fut = asyncio.get_running_loop().create_future()
+            timer = Ctrl.lockstep.park(fut, lambda: Ctrl.scheduler.schedule(t, fut))
+            with Ctrl.mutex:
+                isRunning = Ctrl.isRunning
+            try:
+                if isRunning or not Ctrl.scheduler.cancel(timer):
+                    try:
+                        await fut
+                    except asyncio.CancelledError:
+                        Ctrl.scheduler.cancel(timer)
+                        raise
+            finally:
+                Ctrl.lockstep.resume(fut)
+    @staticmethod
+    async def sleep(delay):
+        '''
+        Coroutine version of Wait()
+        '''
+        await Ctrl.sleep_until(Ctrl.GetSimTime() + delay)
+    @staticmethod
+    def GetWaiter():
+        '''
+        Internal use only
+        A held lock per thread, released by notifyWait() to resume the thread
+        reused by every WaitUntil() of this thread
+        '''
+        waiter = getattr(Ctrl.local, 'waiter', None)
+        if waiter is None:
+            waiter = threading.Lock()
+            waiter.acquire()
+            Ctrl.local.waiter = waiter
+        return waiter
+    @staticmethod
     def ShouldContinue():
         '''
         All threads should call this to check whether simulation is still running
@@ -120,6 +227,35 @@ class Ctrl(threading.Thread):
             ret = Ctrl.netConfig
         return ret
     @staticmethod
+    def GetFleetState():
+        '''
+        return read-only (numUav, FLEET_WIDTH) array of the current step
+        It is not copied, a new array is made for the next step so this one stays consistent
+        '''
+        with Ctrl.mutex:
+            ret = Ctrl.fleetState
+        return ret
+    @staticmethod
+    def GetKinematics(name):
+        '''
+        return read-only row of UAV name in GetFleetState()
+        '''
+        return Ctrl.GetFleetState()[Ctrl.fleetIndex[name]]
+    @staticmethod
+    def RpcStats():
+        '''
+        return per method counters and wall latency of the AirSim calls made through mainClientPool
+        '''
+        return mainClientPool.stats()
+    @staticmethod
+    def JoinTick(period, timeout=None, name=None):
+        '''
+        return barrier.TickParticipant of the calling thread released every period sim seconds
+        @param timeout: wall seconds the clock waits for it, None for barrierTimeout of settings.json
+        @param name: shown in stats, the thread name by default (pass the app name from a coroutine)
+        '''
+        return Ctrl.barrier.join(Ctrl.GetSimTime(), period, name, timeout)
+    @staticmethod
     def Freeze(toFreeze):
         '''
         Internal use only
@@ -148,12 +284,38 @@ class Ctrl(threading.Thread):
         to synchronize start
         Corresponds to nsAirSimBegin() in AirSimSync.cc
         '''
-        self.zmqRecvSocket.recv()
+        if Ctrl.netModel is None:
+            self.zmqRecvSocket.recv()
         self.client.reset()
         self.client.simPause(False)
+        fleetState = self.gatherFleetState(0)
         # static member init
         with Ctrl.mutex:
             Ctrl.simTime = 0
+            Ctrl.fleetState = fleetState
+    def gatherFleetState(self, t):
+        '''
+        Internal use only
+        return read-only fleet state read from AirSim once the step ending at t is simulated
+        the reads are shared through mainClientPool with apps reading the same kinematics at t
+        AirSim has no fleet-wide query, this is one read per UAV per step
+        '''
+        readAt = getattr(self.client, 'readAt', None) # ClientProxy, None for a plain client
+        fleetState = np.empty((len(Ctrl.fleetIndex), FLEET_WIDTH))
+        for name, i in Ctrl.fleetIndex.items():
+            if readAt is not None:
+                state = readAt(t, 'simGetGroundTruthKinematics', vehicle_name=name)
+            else:
+                state = self.client.simGetGroundTruthKinematics(vehicle_name=name)
+            p, q, v, w = state.position, state.orientation, state.linear_velocity, state.angular_velocity
+            fleetState[i] = (
+                p.x_val, p.y_val, p.z_val,
+                q.x_val, q.y_val, q.z_val, q.w_val,
+                v.x_val, v.y_val, v.z_val,
+                w.x_val, w.y_val, w.z_val
+            )
+        fleetState.flags.writeable = False
+        return fleetState
     def sendNetConfig(self, json_path):
         '''
         send network configuration to and config ns
@@ -182,6 +344,8 @@ class Ctrl(threading.Thread):
             "p2pMtu": 1500,
             "p2pDelay": 1e-3,
             "useWifi": 0,
+            "useAnalyticNet": 0, # not sent, run netmodel.AnalyticNet in process instead of NS
+            "useBinaryWire": 1,
             
             "isMainLogEnabled": 1,
             "isGcsLogEnabled": 1,
@@ -190,7 +354,27 @@ class Ctrl(threading.Thread):
             "isSyncLogEnabled": 0,
 
             # var not sent
-            "endTime":math.inf
+            "endTime":math.inf,
+            "adaptiveStep": 0, # step up to maxStepSize while the network is idle
+            "maxStepSize": 1.0,
+            "pipelineSkew": 0, # steps AirSim may run ahead of NS, 0 to step them in turn
+            "profilePath": "", # export Ctrl.profiler to this .csv or .json at the end
+            "metricsPath": "", # append Router.metrics as JSON lines every metricsPeriod and at the end
+            "metricsPeriod": 0, # in sim seconds, 0 to dump only at the end
+            "tracePath": "", # record steps, flows and NS reports to this file, see replay.py
+            "traceFleet": 0, # also record the fleet state of every step
+            # read by mainEndpoints.load() before Ctrl is created, see endpoint.py
+            "zmqTransport": "tcp", # tcp | ipc | inproc
+            "zmqPortBase": 0, # added to every tcp port
+            "zmqRunDir": "", # ipc sockets go here, /tmp/airsimn if empty
+            "rpcPoolSize": 4, # AirSim connections shared by Ctrl and the apps, see rpcpool.py
+            "barrierTimeout": 0, # wall sec a tick waits for a Ctrl.JoinTick() participant, 0 to wait forever
+            # useAnalyticNet only, see netmodel.py
+            "analyticCellCapacity": 50e6, # bits/sec of each cell uplink and downlink
+            "analyticLinkRate": 0, # bits/sec of a UAV radio within analyticRange of its cell, 0 for no per-UAV limit
+            "analyticRange": 100.0,
+            "analyticDelay": 5e-3, # one-way, plus p2pDelay to and from GCS
+            "analyticPairDelay": [], # [[src, dst, delay], ...] overriding the above
         }
         # overwrite default settings
         with open(json_path) as f:
@@ -222,7 +406,7 @@ class Ctrl(threading.Thread):
         s += f'{netConfig["nRbs"]} {netConfig["TcpSndBufSize"]} {netConfig["TcpRcvBufSize"]} {netConfig["CqiTimerThreshold"]} '
         s += f'{netConfig["LteTxPower"]} {netConfig["p2pDataRate"]} {netConfig["p2pMtu"]} {netConfig["p2pDelay"]} '
         
-        s += f'{netConfig["useWifi"]} '
+        s += f'{netConfig["useWifi"]} {netConfig["useBinaryWire"]} '
         s += f'{netConfig["isMainLogEnabled"]} {netConfig["isGcsLogEnabled"]} {netConfig["isUavLogEnabled"]} {netConfig["isCongLogEnabled"]} {netConfig["isSyncLogEnabled"]} '
         
         # check for name validity
@@ -230,26 +414,62 @@ class Ctrl(threading.Thread):
             if ' ' in name or 'GCS' in name:
                 raise ValueError(f'UAV name: {name} is illegal, any whitespace or literally GCS is not allowd')
         
-        self.zmqSendSocket.send_string(s)
+        # NS is not running with the analytic model, nobody would take the config
+        if not netConfig['useAnalyticNet']:
+            self.zmqSendSocket.send_string(s)
         # rm timeout
         # self.zmqRecvSocket.setsockopt(zmq.RCVTIMEO, int(10*1000*netConfig["updateGranularity"]))
         self.netConfig = netConfig
         Ctrl.netConfig = netConfig
+        Ctrl.fleetIndex = {name: i for i, name in enumerate(netConfig['uavsName'])}
+        Ctrl.scheduler.setGranularity(netConfig['updateGranularity'])
+        Ctrl.barrier.configure(netConfig['updateGranularity'], netConfig['barrierTimeout'])
         Ctrl.SetEndTime(netConfig["endTime"])
+        mainClientPool.configure(netConfig['rpcPoolSize'])
         return netConfig
     
     def nextSimStepSize(self):
         '''
         return the next simulation step
+        In adaptive mode, steps to the next wakeup (at most maxStepSize) if Router holds nothing
+        and nobody was woken by the last step (they get one fine step to Tx or wait again)
         '''
+        nextDue = min(Ctrl.scheduler.nextDue(), Ctrl.barrier.nextDue())
+        isIdle = self.netConfig.get('adaptiveStep', 0) and Ctrl.numWoken == 0
+        isIdle = isIdle and Ctrl.trafficProbe is not None and sum(Ctrl.trafficProbe()) == 0
         with self.mutex:
+            ret = self.netConfig['updateGranularity']
             # The suspended event occur earlier
-            if len(Ctrl.suspended) > 0 and Ctrl.suspended[0][0] < Ctrl.simTime + self.netConfig['updateGranularity']:
-                ret = Ctrl.suspended[0][0] - Ctrl.simTime
-            else:
-                ret = self.netConfig['updateGranularity']
+            if nextDue < Ctrl.simTime + ret:
+                ret = nextDue - Ctrl.simTime
+            elif isIdle:
+                ret = max(ret, min(nextDue, Ctrl.endTime) - Ctrl.simTime)
+                ret = min(ret, self.netConfig['maxStepSize'])
         return ret
-    def notifyWait(self):
+    def countStep(self, step):
+        '''
+        Internal use only
+        count round trips saved by steps longer than updateGranularity
+        '''
+        granularity = self.netConfig['updateGranularity']
+        self.numSteps += 1
+        if step > granularity * (1 + 1e-6):
+            self.numCoarseSteps += 1
+            self.numSaved += math.ceil(step / granularity - 1e-6) - 1
+    def stepStats(self):
+        '''
+        return dict of
+        steps: round trips made
+        coarseSteps: steps longer than updateGranularity
+        savedRoundTrips: steps of updateGranularity the coarse steps replaced
+        '''
+        return {
+            'steps': self.numSteps,
+            'coarseSteps': self.numCoarseSteps,
+            'savedRoundTrips': self.numSaved,
+        }
+    @staticmethod
+    def notifyWait():
         '''
         internal use only
         notfiy the waiting thread if delay is expired
@@ -258,70 +478,250 @@ class Ctrl(threading.Thread):
         with Ctrl.mutex:
             isRunning = Ctrl.isRunning
             tsim = Ctrl.simTime
-            if isRunning:
-                while len(Ctrl.suspended) > 0 and Ctrl.suspended[0][0] <= Ctrl.simTime + Ctrl.netConfig['updateGranularity']/2:
-                    t, sn, cond, cb = Ctrl.suspended[0]
-                    cond.acquire()
-                    cond.notify()
-                    cond.release()
-                    heapq.heappop(Ctrl.suspended)
-            else: # release all pending threads
-                while len(Ctrl.suspended) > 0:
-                    t, sn, cond, cb = heapq.heappop(Ctrl.suspended)
-                    cond.acquire()
-                    cond.notify()
-                    cond.release()
+        if isRunning:
+            due = Ctrl.scheduler.popDue(tsim)
+        else: # release all pending threads
+            due = Ctrl.scheduler.popAll()
+        # participants of this tick run while the woken threads do
+        Ctrl.numWoken = len(due) + Ctrl.barrier.release(tsim, isRunning)
+        futures = []
+        for timer in due:
+            # running from now on, not when its thread or loop gets to it
+            Ctrl.lockstep.resume(timer.waiter)
+            if isinstance(timer.waiter, asyncio.Future):
+                futures.append(timer.waiter)
+            else:
+                timer.waiter.release()
+        # coroutines are resumed together by a single callback in their loop
+        if len(futures) > 0:
+            futures[0].get_loop().call_soon_threadsafe(Ctrl.resolveAll, futures)
+    @staticmethod
+    def resolveAll(futures):
+        '''
+        Internal use only
+        Run in the event loop of async apps to resume every future in futures
+        '''
+        for fut in futures:
+            if not fut.done():
+                fut.set_result(None)
     def advance(self):
         '''
         advace the simulation by a small step
         '''
-        Ctrl.freezeCond.acquire()
-        if len(Ctrl.freezeSet) != 0:
-            # print(f'GCS, {len(Ctrl.freezeSet)}')
-            Ctrl.freezeCond.wait()
-        Ctrl.freezeCond.release()
+        t0 = time.perf_counter()
+        self.waitUnfrozen()
+        t1 = time.perf_counter()
         try:
             # ns3 has finished the previous simulation step
-            if TIME_TEST:
-                t0 = time.time()
-            
             msg = self.zmqRecvSocket.recv()
-            
-            if TIME_TEST:
-                t1 = time.time()
-                self.nsSpent += (t1 - t0)
-                print(f'<NS spent> {t1 - t0} sec')
-            
+            t2 = time.perf_counter()
+            # flows started up to the beginning of this step, later ones wait for the next (see Router.release())
+            if Ctrl.releaseRequests is not None:
+                Ctrl.releaseRequests(Ctrl.GetSimTime())
             # this will block until resumed
             step = self.nextSimStepSize()
             self.client.simContinueForTime(step)
+            self.countStep(step)
+            fleetState = self.gatherFleetState(Ctrl.GetSimTime() + step)
             with Ctrl.mutex:
                 Ctrl.simTime += step
-            self.zmqSendSocket.send_string(f'{step}')
-            if TIME_TEST:
-                t0 = time.time()
-                self.AirSimSpent += (t0 - t1)
-                print(f'<AirSim spent> {t0 - t1} sec')
+                Ctrl.fleetState = fleetState
+            self.record(step, fleetState)
+            # NS updates mobility from the second part instead of querying AirSim
+            self.zmqSendSocket.send_string(f'{step}', zmq.SNDMORE)
+            self.zmqSendSocket.send(fleetState, copy=False)
+            t3 = time.perf_counter()
             if VERBOSE:
                 print(f'[Ctrl], Time = {Ctrl.simTime}')
             self.notifyWait()
+            t4 = time.perf_counter()
+            self.profile(step, t2 - t1, t3 - t2, t1 - t0, t4 - t3)
+        except zmq.ZMQError:
+            print('ctrl msg not received')
+    def advanceAnalytic(self):
+        '''
+        advance AirSim then Ctrl.netModel by a small step, no NS round trip
+        '''
+        t0 = time.perf_counter()
+        self.waitUnfrozen()
+        t1 = time.perf_counter()
+        step = self.nextSimStepSize()
+        self.client.simContinueForTime(step)
+        self.countStep(step)
+        fleetState = self.gatherFleetState(Ctrl.GetSimTime() + step)
+        with Ctrl.mutex:
+            t = Ctrl.simTime
+        t2 = time.perf_counter()
+        # flows progress before apps see the new time, like NS reporting before its turn ends
+        Ctrl.netModel.advance(t, step, fleetState)
+        t3 = time.perf_counter()
+        with Ctrl.mutex:
+            Ctrl.simTime += step
+            Ctrl.fleetState = fleetState
+        self.record(step, fleetState)
+        if VERBOSE:
+            print(f'[Ctrl], Time = {Ctrl.simTime}')
+        self.notifyWait()
+        t4 = time.perf_counter()
+        self.profile(step, t3 - t2, t2 - t1, t1 - t0, t4 - t3)
+    def profile(self, step, ns, airsimTime, freezeWait, wakeup):
+        '''
+        Internal use only
+        '''
+        if Ctrl.profiler.enabled:
+            liveFlows, queuedMsgs = Ctrl.trafficProbe() if Ctrl.trafficProbe is not None else (0, 0)
+            Ctrl.profiler.record(Ctrl.GetSimTime(), step, ns, airsimTime, freezeWait, wakeup, Ctrl.numWoken, liveFlows, queuedMsgs)
+    def record(self, step, fleetState):
+        '''
+        Internal use only
+        '''
+        if Ctrl.recorder is not None:
+            Ctrl.recorder.step(Ctrl.GetSimTime(), step, fleetState)
+    def waitUnfrozen(self):
+        '''
+        Internal use only
+        block while any thread is in Ctrl.Frozen(), a participant of the last tick has not arrived
+        or, in lockstep, an app has not parked again
+        '''
+        Ctrl.barrier.waitArrived()
+        Ctrl.lockstep.waitSettled()
+        Ctrl.freezeCond.acquire()
+        if len(Ctrl.freezeSet) != 0:
+            Ctrl.freezeCond.wait()
+        Ctrl.freezeCond.release()
+    def stepAirSim(self):
+        '''
+        Internal use only
+        advance AirSim and the clock seen by apps by one step, wake due apps
+        return (step, fleetState, AirSim time, notifyWait time)
+        '''
+        t0 = time.perf_counter()
+        step = self.nextSimStepSize()
+        self.client.simContinueForTime(step)
+        self.countStep(step)
+        fleetState = self.gatherFleetState(Ctrl.GetSimTime() + step)
+        with Ctrl.mutex:
+            Ctrl.simTime += step
+            Ctrl.fleetState = fleetState
+        self.record(step, fleetState)
+        if VERBOSE:
+            print(f'[Ctrl], Time = {Ctrl.simTime}')
+        t1 = time.perf_counter()
+        self.notifyWait()
+        t2 = time.perf_counter()
+        return step, fleetState, t1 - t0, t2 - t1
+    def advancePipelined(self):
+        '''
+        advance AirSim up to pipelineSkew steps ahead of NS, then hand NS its next step
+        AirSim simulates while NS is busy with the step sent last time
+        NS always gets the fleet state of the step it simulates,
+        so the network sees positions up to pipelineSkew steps older than the ones apps see
+        Flows keep their sim time: Router holds back the request of a flow until NS reaches its Tx (see Router.release())
+        '''
+        skew = self.netConfig['pipelineSkew']
+        freezeWait, airsimTime, wakeup = 0, 0, 0
+        while len(self.ahead) < skew and Ctrl.ShouldContinue():
+            t0 = time.perf_counter()
+            self.waitUnfrozen()
+            freezeWait += time.perf_counter() - t0
+            step, fleetState, dtAirSim, dtWakeup = self.stepAirSim()
+            airsimTime += dtAirSim
+            wakeup += dtWakeup
+            self.ahead.append((step, fleetState))
+        if len(self.ahead) == 0:
+            return
+        # reconcile: how far the network view (the step NS is busy with) lags behind what apps see
+        if self.nsFleetState is not None:
+            current = Ctrl.GetFleetState()
+            posError = float(np.linalg.norm(current[:, FLEET_POS] - self.nsFleetState[:, FLEET_POS], axis=1).max(initial=0.0))
+            self.numNsSteps += 1
+            self.posErrorSum += posError
+            self.maxPosError = max(self.maxPosError, posError)
+            self.maxSkew = max(self.maxSkew, Ctrl.GetSimTime() - self.nsTime)
+        t0 = time.perf_counter()
+        step = self.handToNs()
+        if step is not None:
+            # AirSim steps made during this NS step are recorded together
+            self.profile(step, time.perf_counter() - t0, airsimTime, freezeWait, wakeup)
+    def handToNs(self):
+        '''
+        Internal use only
+        send NS the oldest step of self.ahead once it has finished the previous one
+        return the step, None if NS did not answer
+        '''
+        try:
+            # ns3 has finished the previous simulation step
+            self.zmqRecvSocket.recv()
         except zmq.ZMQError:
             print('ctrl msg not received')
+            return None
+        step, fleetState = self.ahead.popleft()
+        # flows started up to the beginning of this step
+        if Ctrl.releaseRequests is not None:
+            self.numDeferred += Ctrl.releaseRequests(self.nsTime)
+        self.zmqSendSocket.send_string(f'{step}', zmq.SNDMORE)
+        self.zmqSendSocket.send(fleetState, copy=False)
+        self.nsTime += step
+        self.nsFleetState = fleetState
+        return step
+    def pipelineStats(self):
+        '''
+        return dict of
+        maxSkew: the largest lead of AirSim over NS in sim seconds
+        meanPosError, maxPosError: largest distance per step between the position NS simulates a UAV at
+        and the one apps see meanwhile
+        deferredFlows: flow requests held back until NS reached their Tx
+        '''
+        return {
+            'maxSkew': self.maxSkew,
+            'meanPosError': self.posErrorSum / max(self.numNsSteps, 1),
+            'maxPosError': self.maxPosError,
+            'deferredFlows': self.numDeferred,
+        }
     def run(self):
         '''
         control and advance the whole simulation
         '''
-        if TIME_TEST:
-            self.nsSpent = 0
-            self.AirSimSpent = 0
+        isAnalytic = Ctrl.netModel is not None
+        isPipelined = self.netConfig.get('pipelineSkew', 0) > 0 and not isAnalytic
+        if not isAnalytic and Ctrl.releaseRequests is not None:
+            # NS is at 0 until the first step is handed to it
+            Ctrl.releaseRequests(0)
         while Ctrl.ShouldContinue():
-            self.advance()
+            if isAnalytic:
+                self.advanceAnalytic()
+            elif isPipelined:
+                self.advancePipelined()
+            else:
+                self.advance()
+        # NS simulates up to the end time too, with the requests of the last steps
+        while isPipelined and len(self.ahead) > 0 and self.handToNs() is not None:
+            pass
+        if not isAnalytic and Ctrl.releaseRequests is not None:
+            self.numDeferred += Ctrl.releaseRequests(math.inf)
         with Ctrl.mutex:
             Ctrl.isRunning = False
-        self.zmqSendSocket.send_string(f'bye {Ctrl.GetEndTime()}')
+        if not isAnalytic:
+            self.zmqSendSocket.send_string(f'bye {Ctrl.GetEndTime()}')
         self.notifyWait()
-        if TIME_TEST:
-            print(f'<NS spent {self.nsSpent}>, <AirSim spent {self.AirSimSpent}>')
+        if self.netConfig.get('adaptiveStep', 0):
+            print(f'[Ctrl] {self.stepStats()}')
+        if isPipelined:
+            print(f'[Ctrl] pipelined {self.pipelineStats()}')
+        if isAnalytic:
+            print(f'[Ctrl] analytic network {Ctrl.netModel.stats()}')
+        if Ctrl.barrier.numTicks > 0:
+            print(f'[Ctrl] barrier {Ctrl.barrier.stats()}')
+        if Ctrl.lockstep.numApps > 0:
+            print(f'[Ctrl] lockstep {Ctrl.lockstep.stats()}')
+        rpc = Ctrl.RpcStats()
+        if len(rpc['methods']) > 0:
+            print(f'[Ctrl] rpc on {rpc["connections"]} connections: ' + ', '.join(
+                f'{method} {v["calls"]}+{v["coalesced"]} p99 {v["latency"].get("p99", 0)*1e3:.2f} ms' for method, v in rpc['methods'].items()))
+        if Ctrl.profiler.count > 0:
+            print(f'[Ctrl] profile {Ctrl.profiler.summary()}')
+            if self.netConfig.get('profilePath', ''):
+                Ctrl.profiler.export(self.netConfig['profilePath'])
 
 class CtrlFrozen():
     '''
@@ -332,4 +732,6 @@ class CtrlFrozen():
     def __enter__(self):
         Ctrl.Freeze(True)
     def __exit__(self, exc_type, exc_value, tb):
-        Ctrl.Freeze(False)
\ No newline at end of file
+        Ctrl.Freeze(False)
+# reads of the same step share one RPC
+mainClientPool.clock = Ctrl.GetSimTime
@@ -0,0 +1,76 @@
+import os
+import sys
+import json
+import argparse
+
+'''
+Where the ZMQ sockets of Ctrl, Router, NS (AirSimSync.h) and nsemu.py bind and connect
+The ports of ctrl.py name the sockets, the transport decides the address:
+tcp: localhost, port + zmqPortBase (another zmqPortBase runs another simulation on the same host)
+ipc: a unix socket named after the port under zmqRunDir
+inproc: in the same zmq context, only when nothing runs outside this process (main.py --emulate, useAnalyticNet)
+Usage:
+mainEndpoints.load(json_path) # before Ctrl and nsemu are created and before Router.compile()
+socket.bind(mainEndpoints.bind(port))
+socket.connect(mainEndpoints.connect(port))
+python3 endpoint.py settings.json # ns-3 arguments of the same settings, see run.sh
+'''
+
+TRANSPORTS = ('tcp', 'ipc', 'inproc')
+DEFAULT_RUN_DIR = '/tmp/airsimn'
+RECONNECT_IVL = 10 # ms, zmq default is 100, a connect issued before the peer binds is retried this soon
+
+class Endpoints():
+    def __init__(self):
+        self.transport = 'tcp'
+        self.portBase = 0
+        self.runDir = DEFAULT_RUN_DIR
+    def configure(self, transport='tcp', portBase=0, runDir=''):
+        if transport not in TRANSPORTS:
+            raise ValueError(f'zmqTransport "{transport}" is not one of {TRANSPORTS}')
+        self.transport = transport
+        self.portBase = int(portBase)
+        self.runDir = runDir if runDir else DEFAULT_RUN_DIR
+        if transport == 'ipc':
+            os.makedirs(self.runDir, exist_ok=True)
+    def load(self, json_path):
+        '''
+        configure() from zmqTransport, zmqPortBase and zmqRunDir of settings.json, missing keys are defaults
+        '''
+        with open(json_path) as f:
+            settings = json.load(f)
+        self.configure(settings.get('zmqTransport', 'tcp'), settings.get('zmqPortBase', 0), settings.get('zmqRunDir', ''))
+    def bind(self, port):
+        '''
+        return the address to bind the socket named port
+        '''
+        if self.transport == 'tcp':
+            return f'tcp://*:{port + self.portBase}'
+        return self.connect(port)
+    def connect(self, port):
+        '''
+        return the address to connect to the socket named port
+        '''
+        if self.transport == 'tcp':
+            return f'tcp://localhost:{port + self.portBase}'
+        if self.transport == 'ipc':
+            return f'ipc://{self.runDir}/{port}'
+        return f'inproc://airsimn-{port}'
+    def nsArgs(self):
+        '''
+        return the command line of the ns-3 binary for the same endpoints (network/main.cc)
+        '''
+        if self.transport == 'inproc':
+            raise ValueError('zmqTransport "inproc" only works with the NS stand-in in process')
+        return f'--zmqTransport={self.transport} --zmqPortBase={self.portBase} --zmqRunDir={self.runDir}'
+
+# endpoints of the whole simulation
+mainEndpoints = Endpoints()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='print the ns-3 arguments for the endpoints of settings.json')
+    parser.add_argument('settings')
+    args = parser.parse_args()
+    mainEndpoints.load(args.settings)
+    print(mainEndpoints.nsArgs())
+    sys.exit()
@@ -0,0 +1,123 @@
+import time
+import threading
+
+'''
+Lockstep of Ctrl and the apps: the clock moves only once every app is parked in a sim time wait
+(Ctrl.WaitUntil(), Ctrl.sleep_until(), Router.select(), Router.recvAsync(), a tick of Ctrl.JoinTick()) or has returned,
+so what an app does at a step never depends on how soon its thread got to run
+An app parks its own wait, whoever wakes it unparks it at once, so a woken app counts as running before it is scheduled
+Usage:
+Ctrl.lockstep.configure(numApps) # 0 turns it off (the default, AirSim runs in wall time anyway)
+timer = Ctrl.lockstep.park(waiter, lambda: Ctrl.scheduler.schedule(t, waiter)) # by the app
+Ctrl.lockstep.resume(waiter) # by whoever wakes it, and by the app once it runs again
+Ctrl.lockstep.leave() # at the end of every app (see AppBase.run())
+Ctrl.lockstep.waitSettled() # by Ctrl before the clock moves
+'''
+
+class Lockstep():
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.numApps = 0 # 0 for off
+        self.timeout = 0
+        self.parked = set() # waiters of parked apps
+        self.numLeft = 0 # apps returned
+        self.numHeld = 0 # work started by an app that must finish before the clock moves (see hold())
+        self.numSettles = 0
+        self.numTimeouts = 0
+        self.settleTime = 0 # wall sec Ctrl waited in total
+    def configure(self, numApps, timeout=0):
+        '''
+        Call before any app starts
+        @param timeout: wall seconds Ctrl waits for the apps, 0 to wait forever
+        '''
+        with self.cond:
+            self.numApps = numApps
+            self.timeout = timeout
+            self.parked = set()
+            self.numLeft = 0
+            self.numHeld = 0
+    def park(self, waiter, register=None):
+        '''
+        Count the app of waiter as parked, register() makes waiter visible to its wakers
+        Both happen at once for Ctrl, so the clock never moves between them
+        return what register() returns
+        '''
+        if self.numApps == 0:
+            return register() if register is not None else None
+        with self.cond:
+            ret = register() if register is not None else None
+            self.parked.add(waiter)
+            if self.isSettled():
+                self.cond.notify_all()
+        return ret
+    def resume(self, waiter):
+        '''
+        The app of waiter runs again, called by its wakers and by itself (any number of times)
+        Never call it with a lock its app takes in park()
+        '''
+        if self.numApps == 0:
+            return
+        with self.cond:
+            self.parked.discard(waiter)
+    def hold(self):
+        '''
+        Keep the clock where it is until release(), for work an app hands to another thread (see asyncAppBase.TxHandoff)
+        '''
+        if self.numApps == 0:
+            return
+        with self.cond:
+            self.numHeld += 1
+    def release(self):
+        if self.numApps == 0:
+            return
+        with self.cond:
+            self.numHeld -= 1
+            if self.isSettled():
+                self.cond.notify_all()
+    def leave(self):
+        '''
+        The calling app has returned, it never parks again
+        '''
+        if self.numApps == 0:
+            return
+        with self.cond:
+            self.numLeft += 1
+            if self.isSettled():
+                self.cond.notify_all()
+    def isSettled(self):
+        '''
+        Internal use only, self.cond must be held
+        '''
+        return self.numHeld == 0 and len(self.parked) + self.numLeft >= self.numApps
+    def waitSettled(self):
+        '''
+        Internal use only, called by Ctrl before the clock moves
+        block until every app is parked or has returned, or timeout wall seconds
+        '''
+        if self.numApps == 0:
+            return
+        t0 = time.perf_counter()
+        with self.cond:
+            while not self.isSettled():
+                left = t0 + self.timeout - time.perf_counter() if self.timeout > 0 else None
+                if left is not None and left <= 0:
+                    # an app blocked outside a sim time wait, the clock moves on without it
+                    self.numTimeouts += 1
+                    break
+                self.cond.wait(left)
+            self.numSettles += 1
+            self.settleTime += time.perf_counter() - t0
+    def stats(self):
+        '''
+        return dict of
+        apps, left: apps returned, settles: steps Ctrl waited at, timeouts: steps it moved on without every app,
+        settleMs: mean wall ms Ctrl waited per step
+        '''
+        with self.cond:
+            return {
+                'apps': self.numApps,
+                'left': self.numLeft,
+                'settles': self.numSettles,
+                'timeouts': self.numTimeouts,
+                'settleMs': self.settleTime / max(self.numSettles, 1) * 1e3,
+            }
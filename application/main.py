@@ -1,51 +1,137 @@
+import time
+T0 = time.perf_counter() # the startup breakdown counts from here, imports included
 import sys
 from pathlib import Path
-import matplotlib.pyplot as plt
 import argparse
+import threading
+import ast
+from concurrent.futures import ThreadPoolExecutor
 
 # custom import 
-from app import GcsApp, UavApp
+# matplotlib and cv2 are imported only by the sinks and decoders that need them (sink.py, pipeline.py)
+from app import GcsApp, UavApp, AsyncGcsApp, AsyncUavApp
+import appBase
+from asyncAppBase import runAsyncApps
 from msg import *
 from ctrl import *
 from router import mainRouter, context
+from capture import mainCapture
+from profiler import PhaseTimer
 
 # check an Unreal Env has been set up
 import setup_path
 import airsim
 
+def connectAirSim():
+    client = airsim.MultirotorClient()
+    client.confirmConnection()
+    return client
+
+def registerAll(uavsName):
+    '''
+    GCS first then uavsName, the order NS expects
+    '''
+    gcsEndPoint = mainRouter.register('GCS', AIRSIM2NS_GCS_PORT_START)
+    endPoints = [mainRouter.register(name, AIRSIM2NS_UAV_PORT_START+i) for i, name in enumerate(uavsName) ]
+    mainRouter.compile()
+    return gcsEndPoint, endPoints
+
 if __name__ == '__main__':    
+    startup = PhaseTimer(T0)
+    startup.mark('imports')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--emulate', action='store_true', help='run against nsemu.py (stub AirSim client and python NS) instead of Unreal and ns-3')
+    parser.add_argument('--settings', default=str(Path.home()/'Documents'/'AirSim'/'settings.json'))
+    parser.add_argument('--replay', help='run the apps against a trace recorded with tracePath instead of Unreal and ns-3, see replay.py')
+    parser.add_argument('--scenario', action='append', default=[], metavar='NAME=VALUE', help='override a module global of appBase.py, see appBase.SCENARIO')
+    args = parser.parse_args()
+    for item in args.scenario:
+        name, value = item.split('=', 1)
+        if name not in appBase.SCENARIO:
+            raise ValueError(f'scenario {name} is not one of {appBase.SCENARIO}')
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            pass # a plain string such as throughput
+        setattr(appBase, name, value)
+    json_path = Path(args.settings)
+    replay = None
+    if args.replay or args.emulate:
+        from nsemu import NsEmulator, useStubClient
+        useStubClient()
+    # AirSim connects while the endpoints and NS come up
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='startup')
+    clientFuture = pool.submit(startup.timed('airsim', connectAirSim))
+    if args.replay:
+        from replay import TraceReplay
+        replay = TraceReplay(args.replay, mode='network', pace=True)
+    else:
+        # every socket after this follows zmqTransport, zmqPortBase and zmqRunDir
+        mainEndpoints.load(json_path)
+        if args.emulate:
+            with startup.phase('nsemu'):
+                # must be listening before Ctrl sends the config, inproc only connects within one context
+                nsThread = NsEmulator(context if mainEndpoints.transport == 'inproc' else None)
+                nsThread.start()
     try:
-        client = airsim.MultirotorClient()
-        client.confirmConnection()
+        client = clientFuture.result()
     except:
         sys.exit()
-        
-    json_path = Path.home()/'Documents'/'AirSim'/'settings.json'
+    # the first connection of the pool shared by Ctrl and the apps
+    mainClientPool.adopt(client)
     
-    ctrlThread = Ctrl(context)
-    netConfig = ctrlThread.sendNetConfig(json_path)
+    if replay is None:
+        with startup.phase('config'):
+            ctrlThread = Ctrl(context)
+            netConfig = ctrlThread.sendNetConfig(json_path)
+    else:
+        # the trace takes the place of Ctrl and NS, Router only delivers
+        ctrlThread = threading.Thread(target=replay.run)
+        netConfig = replay.netConfig
 
+    # sockets are bound while the apps are built, NS builds its topology meanwhile
+    endpointsFuture = pool.submit(startup.timed('endpoints', registerAll), netConfig['uavsName'])
+    with startup.phase('apps'):
+        if appBase.RUNTIME == 'async':
+            gcsThread = AsyncGcsApp(name='GCS')
+            uavsThread = [ AsyncUavApp(name=name) for i, name in enumerate(netConfig['uavsName']) ]
+        else:
+            gcsThread = GcsApp(name='GCS')
+            uavsThread = [ UavApp(name=name) for i, name in enumerate(netConfig['uavsName']) ]
+    gcsEndPoint, endPoints = endpointsFuture.result()
+    pool.shutdown()
 
-    gcsThread = GcsApp(name='GCS')
-    gcsEndPoint = mainRouter.register('GCS', AIRSIM2NS_GCS_PORT_START)
-    uavsThread = [ UavApp(name=name) for i, name in enumerate(netConfig['uavsName']) ]
-    endPoints = [mainRouter.register(name, AIRSIM2NS_UAV_PORT_START+i) for i, name in enumerate(netConfig['uavsName']) ]
-
-    mainRouter.compile()
-
-    ctrlThread.waitForSyncStart()
-    # NS will wait until AirSim sends back something from now on
+    # UAVs capturing at the same step are flushed as soon as all of them have asked
+    mainCapture.setExpected(len(netConfig['uavsName']))
+    if args.emulate:
+        # nothing runs in wall time, the clock moves once every app waits again so runs are reproducible
+        Ctrl.lockstep.configure(1 + len(uavsThread))
 
-    mainRouter.start()
+    if replay is None:
+        with startup.phase('sync'):
+            ctrlThread.waitForSyncStart()
+        # NS will wait until AirSim sends back something from now on
+        mainRouter.start()
+    else:
+        replay.attach(mainRouter)
+    print(f'[startup] {startup.summary()}')
     ctrlThread.start()
-    for td in uavsThread:
-        td.start()
-    # GCS run in the main thread for plotting   
-    gcsThread.run()
+    if appBase.RUNTIME == 'async':
+        # all apps share one event loop in the main thread (GCS plots here)
+        runAsyncApps([gcsThread] + uavsThread)
+    else:
+        for td in uavsThread:
+            td.start()
+        # GCS run in the main thread for plotting   
+        gcsThread.run()
 
     # End of simulation
-    mainRouter.join()
+    if replay is None:
+        mainRouter.join()
     ctrlThread.join()
-    for td in uavsThread:
-        td.join()
+    if appBase.RUNTIME != 'async':
+        for td in uavsThread:
+            td.join()
+    if replay is not None:
+        print(f'[replay] {replay.stats()}')
     sys.exit()
@@ -0,0 +1,112 @@
+import json
+import threading
+from collections import deque
+import numpy as np
+
+'''
+Flow-level metrics aggregated per (src, dst) by Router
+Usage:
+mainRouter.metrics.query() # {(src, dst): {...}, ...}
+mainRouter.metrics.query(dst='GCS')
+mainRouter.metrics.dump('metrics.jsonl') # appends one line per call
+'''
+
+def percentiles(samples, ps=(50, 90, 99)):
+    if len(samples) == 0:
+        return {}
+    values = np.fromiter(samples, dtype=float, count=len(samples))
+    ret = {f'p{p}': float(v) for p, v in zip(ps, np.percentile(values, ps))}
+    ret['max'] = float(values.max())
+    return ret
+
+class PairMetrics():
+    '''
+    Internal use only
+    Totals of one (src, dst) pair and the latest samples of each delay
+    '''
+    def __init__(self, maxSamples):
+        self.numFlows = 0 # delivered
+        self.numRx = 0
+        self.bytes = 0
+        self.firstTx = None # sim time
+        self.lastRecv = None # sim time
+        self.latency = deque(maxlen=maxSamples) # Tx -> last RECV, sim
+        self.queueing = deque(maxlen=maxSamples) # Tx -> first SEND, sim
+        self.wallLatency = deque(maxlen=maxSamples) # Tx -> last RECV, wall
+        self.rxDelay = deque(maxlen=maxSamples) # last RECV -> Rx, sim
+    def summary(self):
+        '''
+        goodput is delivered bits per sim second from the first Tx to the last RECV of this pair
+        '''
+        span = (self.lastRecv - self.firstTx) if self.numFlows > 0 else 0
+        return {
+            'flows': self.numFlows,
+            'rx': self.numRx,
+            'bytes': self.bytes,
+            'goodput': self.bytes * 8 / span if span > 0 else 0.0,
+            'latency': percentiles(self.latency),
+            'queueing': percentiles(self.queueing),
+            'wallLatency': percentiles(self.wallLatency),
+            'rxDelay': percentiles(self.rxDelay),
+        }
+
+class FlowMetrics():
+    '''
+    Fed by Router with flows carrying (sim, wall) timestamps:
+    tTx: Router.startFlow(), tFirstSend: first SEND report, tLastRecv: last RECV report, tRx: handed out by Rx
+    '''
+    def __init__(self, maxSamples=4096):
+        self.maxSamples = maxSamples
+        self.lock = threading.Lock()
+        self.pairs = {} # (src, dst) -> PairMetrics
+    def pair(self, f):
+        '''
+        Internal use only, self.lock must be held
+        '''
+        key = (f.src, f.dst)
+        ret = self.pairs.get(key)
+        if ret is None:
+            ret = PairMetrics(self.maxSamples)
+            self.pairs[key] = ret
+        return ret
+    def onDelivered(self, f):
+        '''
+        Internal use only, f is fully received
+        '''
+        txSim, txWall = f.tTx
+        recvSim, recvWall = f.tLastRecv
+        sendSim = f.tFirstSend[0] if f.tFirstSend is not None else recvSim
+        with self.lock:
+            pair = self.pair(f)
+            pair.numFlows += 1
+            pair.bytes += f.size
+            pair.firstTx = txSim if pair.firstTx is None else min(pair.firstTx, txSim)
+            pair.lastRecv = recvSim if pair.lastRecv is None else max(pair.lastRecv, recvSim)
+            pair.latency.append(recvSim - txSim)
+            pair.queueing.append(sendSim - txSim)
+            pair.wallLatency.append(recvWall - txWall)
+    def onRx(self, f):
+        '''
+        Internal use only, f is handed out by Rx
+        '''
+        with self.lock:
+            pair = self.pair(f)
+            pair.numRx += 1
+            pair.rxDelay.append(f.tRx[0] - f.tLastRecv[0])
+    def query(self, src=None, dst=None):
+        '''
+        return {(src, dst): summary} of matching pairs, see PairMetrics.summary()
+        delays are in seconds, goodput in bits per sim second
+        '''
+        with self.lock:
+            return {
+                key: pair.summary() for key, pair in self.pairs.items()
+                if (src is None or key[0] == src) and (dst is None or key[1] == dst)
+            }
+    def dump(self, path, simTime=None):
+        '''
+        append query() of all pairs as one JSON line
+        '''
+        line = {'simTime': simTime, 'pairs': [{'src': src, 'dst': dst, **summary} for (src, dst), summary in self.query().items()]}
+        with open(path, 'a') as f:
+            f.write(json.dumps(line) + '\n')
@@ -1,7 +1,6 @@
 import sys, inspect
 import numpy as np
-from appProtocolBase import MsgBase
-import pickle
+from appProtocolBase import MsgBase, MSG_HEADER, MSG_FLAG_OOB, MSG_FLAG_ARRAY, dumpsArray, loadsArray
 
 '''
 Custom message
@@ -9,11 +8,15 @@ Note:
     MsgBase-like object is not needed for AppBase.Tx(...) anymore
     Objects that has __len__() are allowed to be transmitted
     MsgBase-like object is not recommended since serialization may consume extra resources
+    serialize() of every Msg here is MSG_HEADER + payload, decode() turns it back by type id
+    wire_size() of every Msg here is the payload alone, msgs are handed over in process and never framed on the simulated link
 '''  
 class MsgRaw(MsgBase):
     '''
     The simplest MsgBase subclass
-    directly transform data to bytes if possible
+    data is any object supporting the buffer protocol (bytes, bytearray, memoryview, numpy array)
+    it is neither copied nor serialized by Tx
+    the payload on the wire is data itself, take memoryview(msg.data) for a view of it
     '''
     def __init__(self, data=bytes(0), **kwargs):
         self.data = data
@@ -21,25 +24,48 @@ class MsgRaw(MsgBase):
     @classmethod
     def GetTypeId(self):
         return 0
+    def wire_size(self):
+        return memoryview(self.data).nbytes
+    def payload(self):
+        return 0, [self.data]
+    @classmethod
+    def FromPayload(cls, payload, timestamp, flags):
+        return MsgRaw(payload)
     def serialize(self):
-        return bytes(self.data)
+        return self.encode()
     @classmethod
     def Deserialize(cls, data):
-        return MsgRaw(data)
+        return decode(data)
     def __str__(self):
         return str(self.data)
 class MsgImg(MsgBase):
+    '''
+    png is either encoded image bytes (simGetImage) or a numpy array of plain numbers
+    bytes are sent as they are, arrays as dtype, shape and data (dumpsArray()) without being copied
+    '''
     def __init__(self, png=np.zeros((0,)), timestamp=0.0, **kwargs):
         self.png = png
         self.timestamp = timestamp
     @classmethod
     def GetTypeId(self):
         return 2
+    def wire_size(self):
+        if isinstance(self.png, (bytes, bytearray)):
+            return len(self.png)
+        return len(self.serialized()) - MSG_HEADER.size
+    def payload(self):
+        if isinstance(self.png, (bytes, bytearray)):
+            return 0, [self.png]
+        return MSG_FLAG_ARRAY, dumpsArray(self.png)
+    @classmethod
+    def FromPayload(cls, payload, timestamp, flags):
+        png = loadsArray(payload) if flags & MSG_FLAG_ARRAY else bytes(payload)
+        return MsgImg(png, timestamp)
     def serialize(self):
-        return pickle.dumps(self)
+        return self.encode()
     @classmethod
     def Deserialize(cls, data):
-        return pickle.loads(data)
+        return decode(data)
     def __str__(self):
         return f'ts:{self.timestamp}, img size:{np.size(self.png)}'
 
@@ -52,4 +78,19 @@ for name, obj in inspect.getmembers(sys.modules[__name__]):
                 raise ValueError(f'{obj().GetTypeId()} is already registered')
             else:
                 MsgProtocol[obj().GetTypeId()] = obj
- 
\ No newline at end of file
+
+def decode(data):
+    '''
+    Reconstruct a Msg from MsgBase.encode() output by its type id in MsgProtocol
+    data is any bytes-like object, payloads of raw messages refer to it without copying
+    '''
+    view = memoryview(data)
+    typeId, flags, length, timestamp = MSG_HEADER.unpack_from(view, 0)
+    if typeId not in MsgProtocol:
+        raise ValueError(f'unknown type id {typeId}')
+    if flags & MSG_FLAG_OOB and not MsgProtocol[typeId].allowPickle:
+        raise ValueError(f'type id {typeId} does not accept pickled payloads')
+    if view.nbytes < MSG_HEADER.size + length:
+        raise ValueError(f'truncated msg, expect {length} bytes of payload, got {view.nbytes - MSG_HEADER.size}')
+    payload = view[MSG_HEADER.size:MSG_HEADER.size+length]
+    return MsgProtocol[typeId].FromPayload(payload, timestamp, flags)
@@ -0,0 +1,221 @@
+import re
+from collections import deque
+import numpy as np
+
+'''
+Flow-level network model run inside Ctrl's step, replacing ns-3 (useAnalyticNet in settings.json)
+Usage (done by Router.compile() and Ctrl.advanceAnalytic()):
+net = AnalyticNet(router, netConfig)
+net.request(srcId, dstId, size, fid) # instead of the request to NS
+net.advance(t, step, fleetState) # reports SEND/RECV progress to router directly
+
+Topology:
+every UAV attaches to its nearest cell (initEnbApPos), GCS is wired to the cells (p2pDataRate, p2pDelay)
+flows of the same (src, dst) pair are sent in order like one TCP connection in NS,
+pairs with data share their resources max-min fairly:
+cell uplink/downlink (analyticCellCapacity), GCS link in/out (p2pDataRate)
+and, if analyticLinkRate > 0, each UAV radio (analyticLinkRate within analyticRange of its cell, falling off as 1/d^2 beyond)
+bytes arrive delay later, delay is analyticDelay (+ p2pDelay for GCS) unless set by analyticPairDelay
+'''
+
+def parseDataRate(s):
+    '''
+    "<number><G|M|K>b/s" (same as ns3::DataRate) to bits/sec
+    '''
+    m = re.fullmatch(r'([0-9.eE+-]+)\s*([GMK]?)b(ps|/s)', str(s).strip())
+    if m is None:
+        raise ValueError(f'data rate "{s}" is not in "<number><G|M|K>b/s"')
+    return float(m.group(1)) * {'G': 1e9, 'M': 1e6, 'K': 1e3, '': 1}[m.group(2)]
+
+def maxMinFair(incPair, incRes, capacity, numPairs):
+    '''
+    Progressive filling, return the rate of each pair
+    @param incPair, incRes: pair incPair[k] uses resource incRes[k]
+    @param capacity: capacity of each resource
+    Every pair must use at least one resource, each round saturates at least one resource
+    '''
+    rate = np.zeros(numPairs)
+    frozen = np.zeros(numPairs, dtype=bool)
+    left = capacity.astype(float)
+    eps = capacity * 1e-9
+    while not frozen.all():
+        live = ~frozen[incPair]
+        users = np.bincount(incRes[live], minlength=len(capacity))
+        used = users > 0
+        delta = (left[used] / users[used]).min()
+        rate[~frozen] += delta
+        left -= delta * users
+        saturated = used & (left <= eps)
+        frozen[incPair[live & saturated[incRes]]] = True
+    return rate
+
+class Pair():
+    '''
+    Internal use only
+    '''
+    __slots__ = ('src', 'dst', 'srcName', 'dstName', 'delay', 'flows', 'carry', 'inflight')
+    def __init__(self, src, dst, srcName, dstName, delay):
+        self.src = src # endpoint id
+        self.dst = dst
+        self.srcName = srcName
+        self.dstName = dstName
+        self.delay = delay
+        self.flows = deque() # [fid, bytes left], head is being sent
+        self.carry = 0.0 # fraction of a byte not sent yet
+        self.inflight = deque() # [first sent, last sent, bytes], in sent order
+
+class AnalyticNet():
+    '''
+    In-process replacement of NS, see the module doc
+    request() may be called by any thread, advance() only by Ctrl
+    '''
+    def __init__(self, router, netConfig):
+        self.router = router
+        self.names = list(router.idToName) # endpoint id -> name, GCS is 0
+        self.numUav = len(self.names) - 1
+        self.cells = np.asarray(netConfig['initEnbApPos'], dtype=float).reshape(-1, 3)
+        numCell = len(self.cells)
+        self.cellCapacity = float(netConfig.get('analyticCellCapacity', 50e6))
+        self.gcsCapacity = parseDataRate(netConfig['p2pDataRate'])
+        self.linkRate = float(netConfig.get('analyticLinkRate', 0))
+        self.range = float(netConfig.get('analyticRange', 100.0))
+        # resources: cell uplinks, cell downlinks, GCS in, GCS out, UAV radios
+        self.resCellUp = 0
+        self.resCellDown = numCell
+        self.resGcsIn = 2 * numCell
+        self.resGcsOut = 2 * numCell + 1
+        self.resRadio = 2 * numCell + 2
+        self.delays = np.full((len(self.names), len(self.names)), float(netConfig.get('analyticDelay', 5e-3)))
+        self.delays[0, :] += netConfig['p2pDelay']
+        self.delays[:, 0] += netConfig['p2pDelay']
+        for src, dst, delay in netConfig.get('analyticPairDelay', []):
+            self.delays[self.names.index(src), self.names.index(dst)] = delay
+        self.requests = deque() # (src, dst, size, fid), appended by app threads
+        self.pairs = {} # (src, dst) -> Pair
+        self.busy = set() # pairs with flows or bytes in flight
+        self.numFlows = 0
+        self.numBytes = 0 # delivered
+    def request(self, src, dst, size, fid):
+        '''
+        Start flow fid of size bytes from endpoint id src to dst
+        '''
+        self.requests.append((src, dst, size, fid))
+    def pair(self, src, dst):
+        '''
+        Internal use only
+        '''
+        ret = self.pairs.get((src, dst))
+        if ret is None:
+            ret = Pair(src, dst, self.names[src], self.names[dst], self.delays[src, dst])
+            self.pairs[(src, dst)] = ret
+        return ret
+    def capacity(self, fleetState):
+        '''
+        Internal use only
+        return (capacity of every resource, cell of every UAV)
+        '''
+        pos = fleetState[:, 0:3] if len(fleetState) == self.numUav else np.zeros((self.numUav, 3))
+        dist = np.linalg.norm(pos[:, None, :] - self.cells[None, :, :], axis=2)
+        cell = dist.argmin(axis=1)
+        numCell = len(self.cells)
+        capacity = np.empty(self.resRadio + self.numUav)
+        capacity[:2 * numCell] = self.cellCapacity
+        capacity[self.resGcsIn] = self.gcsCapacity
+        capacity[self.resGcsOut] = self.gcsCapacity
+        if self.linkRate > 0:
+            d = dist[np.arange(self.numUav), cell]
+            capacity[self.resRadio:] = self.linkRate * np.minimum(1.0, (self.range / np.maximum(d, 1e-9)) ** 2)
+        else:
+            capacity[self.resRadio:] = np.inf
+        return capacity, cell
+    def allocate(self, active, fleetState):
+        '''
+        Internal use only
+        return bits/sec of every pair in active
+        '''
+        capacity, cell = self.capacity(fleetState)
+        src = np.fromiter((pair.src for pair in active), dtype=np.int64, count=len(active))
+        dst = np.fromiter((pair.dst for pair in active), dtype=np.int64, count=len(active))
+        index = np.arange(len(active))
+        isSrcUav = src > 0
+        isDstUav = dst > 0
+        # endpoint id i > 0 is UAV i - 1
+        incPair = [index[isSrcUav], index[~isSrcUav], index[isDstUav], index[~isDstUav]]
+        incRes = [self.resCellUp + cell[src[isSrcUav] - 1], np.full((~isSrcUav).sum(), self.resGcsOut),
+            self.resCellDown + cell[dst[isDstUav] - 1], np.full((~isDstUav).sum(), self.resGcsIn)]
+        if self.linkRate > 0:
+            incPair += [index[isSrcUav], index[isDstUav]]
+            incRes += [self.resRadio + src[isSrcUav] - 1, self.resRadio + dst[isDstUav] - 1]
+        return maxMinFair(np.concatenate(incPair), np.concatenate(incRes), capacity, len(active))
+    def advance(self, t, step, fleetState):
+        '''
+        Simulate [t, t + step] and report progress to router, called by Ctrl once per step
+        '''
+        while len(self.requests) > 0:
+            src, dst, size, fid = self.requests.popleft()
+            pair = self.pair(src, dst)
+            pair.flows.append([fid, size])
+            self.busy.add(pair)
+            self.numFlows += 1
+        active = [pair for pair in self.busy if len(pair.flows) > 0]
+        if len(active) > 0:
+            for pair, rate in zip(active, self.allocate(active, fleetState)):
+                self.send(pair, rate / 8, t, step)
+        end = t + step
+        for pair in list(self.busy):
+            size, arrival = self.deliver(pair, end)
+            if size > 0:
+                self.router.onRecv(pair.srcName, pair.dstName, size, arrival)
+                self.numBytes += size
+            if len(pair.flows) == 0 and len(pair.inflight) == 0:
+                self.busy.discard(pair)
+    def send(self, pair, rate, t, step):
+        '''
+        Internal use only
+        send rate * step bytes of pair in flow order
+        '''
+        if rate <= 0:
+            return
+        budget = rate * step + pair.carry
+        left = int(budget)
+        sent = 0
+        while left > 0 and len(pair.flows) > 0:
+            fid, size = pair.flows[0]
+            put = min(size, left)
+            pair.inflight.append([t + sent / rate, t + (sent + put) / rate, put])
+            self.router.onSend(pair.srcName, pair.dstName, put, fid, t + (sent + put) / rate)
+            sent += put
+            left -= put
+            if put == size:
+                pair.flows.popleft()
+            else:
+                pair.flows[0][1] = size - put
+        pair.carry = budget - int(budget) if len(pair.flows) > 0 else 0.0
+    def deliver(self, pair, end):
+        '''
+        Internal use only
+        return (bytes of pair arrived by end, sim time the last of them arrived), bytes of a segment are sent evenly over it
+        '''
+        arrived = end - pair.delay # everything sent by then has arrived
+        ret = 0
+        tLast = end
+        while len(pair.inflight) > 0:
+            first, last, size = pair.inflight[0]
+            if last <= arrived:
+                ret += size
+                tLast = last + pair.delay
+                pair.inflight.popleft()
+                continue
+            if first < arrived:
+                put = int(size * (arrived - first) / (last - first))
+                ret += put
+                tLast = end
+                pair.inflight[0] = [arrived, last, size - put]
+            break
+        return ret, tLast
+    def stats(self):
+        return {
+            'flows': self.numFlows,
+            'bytes': self.numBytes,
+            'busyPairs': len(self.busy),
+        }
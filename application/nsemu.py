@@ -0,0 +1,419 @@
+import sys
+import time
+import zlib
+import struct
+import argparse
+import threading
+from collections import deque
+import zmq
+import numpy as np
+
+import setup_path
+import airsim
+from ctrl import AIRSIM2NS_UAV_PORT_START, AIRSIM2NS_GCS_PORT_START, NS2AIRSIM_CTRL_PORT, AIRSIM2NS_CTRL_PORT, NS2ROUTER_PORT, FLEET_WIDTH
+from ctrl import WIRE_VERSION, WIRE_OP_SEND, WIRE_OP_RECV, WIRE_FLAG_TIMED, WIRE_HEADER, WIRE_RECORD, WIRE_TIMED_RECORD, WIRE_MAX_RECORDS
+from endpoint import mainEndpoints, RECONNECT_IVL
+
+'''
+Pure python stand-in for the NS side (network/*.cc) and a stub AirSim client
+to run Ctrl, Router and the apps without ns-3 and Unreal
+Usage:
+# in process, before Ctrl is created (see main.py --emulate)
+useStubClient()
+ns = NsEmulator(bandwidth=20e6, delay=5e-3)
+ns.setLink('U0', 'GCS', 1e6, 20e-3)
+ns.start()
+
+# or as its own process in place of the ns-3 binary
+python3 nsemu.py [--bandwidth 20e6] [--delay 5e-3] [--link U0 GCS 1e6 20e-3] [--settings settings.json]
+sockets follow mainEndpoints (endpoint.py), with inproc the context of Router must be passed in
+'''
+
+def parseNetConfig(s):
+    '''
+    Parse the config string of Ctrl.sendNetConfig(), same as operator>> of NetConfig in AirSimSync.cc
+    return dict with the keys of Ctrl.netConfig
+    '''
+    tokens = iter(s.split())
+    config = {}
+    config['updateGranularity'] = float(next(tokens))
+    config['segmentSize'] = int(next(tokens))
+    config['numOfCong'] = float(next(tokens))
+    config['congRate'] = float(next(tokens))
+    config['congArea'] = [float(next(tokens)) for i in range(3)]
+    config['uavsName'] = [next(tokens) for i in range(int(next(tokens)))]
+    config['initEnbApPos'] = [[float(next(tokens)) for j in range(3)] for i in range(int(next(tokens)))]
+    for key in ['nRbs', 'TcpSndBufSize', 'TcpRcvBufSize', 'CqiTimerThreshold']:
+        config[key] = int(next(tokens))
+    config['LteTxPower'] = float(next(tokens))
+    config['p2pDataRate'] = next(tokens)
+    config['p2pMtu'] = int(next(tokens))
+    config['p2pDelay'] = float(next(tokens))
+    for key in ['useWifi', 'useBinaryWire', 'isMainLogEnabled', 'isGcsLogEnabled', 'isUavLogEnabled', 'isCongLogEnabled', 'isSyncLogEnabled']:
+        config[key] = int(next(tokens))
+    return config
+
+class Link():
+    '''
+    Internal use only
+    One direction of a src -> dst connection, flows are sent one after another like a TCP socket in NS
+    '''
+    __slots__ = ('src', 'dst', 'rate', 'delay', 'flows', 'clock', 'inflight')
+    def __init__(self, src, dst, bandwidth, delay):
+        self.src = src # endpoint id
+        self.dst = dst
+        self.rate = bandwidth / 8 # bytes per sec
+        self.delay = delay
+        self.flows = deque() # [fid, bytes left], head is being sent
+        self.clock = 0.0 # when the link is free to send again
+        self.inflight = deque() # (arrival time, size), arrival times are increasing
+    def isIdle(self):
+        return len(self.flows) == 0 and len(self.inflight) == 0
+
+class NsEmulator(threading.Thread):
+    '''
+    Speaks the NS side of every ZMQ socket:
+    config from Ctrl on AIRSIM2NS_CTRL_PORT, step handshake on NS2AIRSIM_CTRL_PORT,
+    requests from Router.register() ports, SEND/RECV reports to NS2ROUTER_PORT
+
+    Each (src, dst) pair is a link of bandwidth (bits/sec) and one-way delay (sec)
+    Bytes of a flow leave at the link rate and arrive delay later, flows of a link are sent in order
+    Reports are batched over a step and flushed at the start of the next turn, like flushReport() in NS
+    Congestion nodes, LTE/Wifi and mobility are not modelled, the fleet state is only kept in self.fleetState
+    '''
+    def __init__(self, context=None, bandwidth=20e6, delay=5e-3, links=None, verbose=False):
+        '''
+        @param links: {(src name, dst name): (bandwidth, delay)} overriding the defaults
+        '''
+        super().__init__(name='nsemu', daemon=True)
+        if context is None:
+            context = zmq.Context()
+            context.setsockopt(zmq.RECONNECT_IVL, RECONNECT_IVL)
+        self.context = context
+        self.bandwidth = bandwidth
+        self.delay = delay
+        self.linkConfig = dict(links) if links is not None else {}
+        self.verbose = verbose
+        # same sockets as AirSimSync
+        self.zmqRecvSocket = self.context.socket(zmq.PULL)
+        self.zmqRecvSocket.connect(mainEndpoints.connect(AIRSIM2NS_CTRL_PORT))
+        self.zmqSendSocket = self.context.socket(zmq.PUSH)
+        self.zmqSendSocket.bind(mainEndpoints.bind(NS2AIRSIM_CTRL_PORT))
+        self.config = None
+        self.names = [] # endpoint id -> name
+        self.reqSockets = [] # endpoint id -> PULL socket
+        self.reportSocket = None
+        self.links = {} # (src id, dst id) -> Link
+        self.active = set() # links with flows or bytes in flight
+        self.records = [] # packed WIRE_TIMED_RECORD not yet flushed
+        self.now = 0.0
+        self.fleetState = None
+        self.numSteps = 0
+        self.numFlows = 0
+        self.numBytes = 0 # delivered
+    def setLink(self, src, dst, bandwidth, delay):
+        '''
+        Override bandwidth and delay of src -> dst, call before start()
+        '''
+        self.linkConfig[(src, dst)] = (bandwidth, delay)
+    def setup(self):
+        '''
+        Internal use only
+        Read the config and connect one socket pair per app, same as main.cc
+        '''
+        self.config = parseNetConfig(self.zmqRecvSocket.recv_string())
+        self.names = ['GCS'] + self.config['uavsName']
+        ports = [AIRSIM2NS_GCS_PORT_START] + [AIRSIM2NS_UAV_PORT_START + i for i in range(len(self.config['uavsName']))]
+        for port in ports:
+            socket = self.context.socket(zmq.PULL)
+            socket.connect(mainEndpoints.connect(port))
+            self.reqSockets.append(socket)
+        self.reportSocket = self.context.socket(zmq.PUSH)
+        self.reportSocket.connect(mainEndpoints.connect(NS2ROUTER_PORT))
+        if self.verbose:
+            print(f'[nsemu] {len(self.names)} endpoints, bandwidth {self.bandwidth}, delay {self.delay}, {len(self.linkConfig)} custom links')
+    def link(self, src, dst):
+        '''
+        Internal use only
+        '''
+        key = (src, dst)
+        ret = self.links.get(key)
+        if ret is None:
+            bandwidth, delay = self.linkConfig.get((self.names[src], self.names[dst]), (self.bandwidth, self.delay))
+            ret = Link(src, dst, bandwidth, delay)
+            self.links[key] = ret
+        return ret
+    def enqueueFlow(self, src, dst, size, fid):
+        link = self.link(src, dst)
+        link.flows.append([fid, size])
+        self.active.add(link)
+        self.numFlows += 1
+    def processReq(self):
+        '''
+        Internal use only
+        Take every pending request, same as AirSimNAppBase::processReq()
+        '''
+        for src, socket in enumerate(self.reqSockets):
+            while True:
+                try:
+                    req = socket.recv(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                if len(req) >= WIRE_HEADER.size and req[0] == WIRE_VERSION:
+                    for _, dst, op, size, fid in WIRE_RECORD.iter_unpack(req[WIRE_HEADER.size:]):
+                        if op != WIRE_OP_SEND:
+                            raise RuntimeError(f'In NsEmulator, op {op} not handled')
+                        self.enqueueFlow(src, dst, size, fid)
+                else:
+                    fid, op, size, dst = req.decode().split()
+                    self.enqueueFlow(src, self.names.index(dst), int(size), int(fid))
+    def simulate(self, step):
+        '''
+        Internal use only
+        Move bytes over every active link from self.now to self.now + step
+        '''
+        end = self.now + step
+        for link in list(self.active):
+            link.clock = max(link.clock, self.now)
+            while len(link.flows) > 0 and link.clock < end:
+                fid, left = link.flows[0]
+                size = min(left, int((end - link.clock) * link.rate))
+                if size <= 0:
+                    break
+                link.clock += size / link.rate
+                link.inflight.append((link.clock + link.delay, size))
+                self.records.append(WIRE_TIMED_RECORD.pack(link.src, link.dst, WIRE_OP_SEND, size, fid, link.clock))
+                if size == left:
+                    link.flows.popleft()
+                else:
+                    link.flows[0][1] = left - size
+            size = 0
+            while len(link.inflight) > 0 and link.inflight[0][0] <= end:
+                arrival, put = link.inflight.popleft()
+                size += put
+            if size > 0:
+                # RECV carries no fid, Router assigns bytes to flows of the pair in order
+                self.records.append(WIRE_TIMED_RECORD.pack(link.src, link.dst, WIRE_OP_RECV, size, -1, arrival))
+                self.numBytes += size
+            if link.isIdle():
+                self.active.discard(link)
+        self.now = end
+    def flushReport(self):
+        '''
+        Internal use only
+        '''
+        records = self.records
+        self.records = []
+        if self.config['useBinaryWire']:
+            for i in range(0, len(records), WIRE_MAX_RECORDS):
+                part = records[i:i+WIRE_MAX_RECORDS]
+                self.reportSocket.send(WIRE_HEADER.pack(WIRE_VERSION, WIRE_FLAG_TIMED, len(part)) + b''.join(part))
+            return
+        for rec in records:
+            src, dst, op, size, fid, t = WIRE_TIMED_RECORD.unpack(rec)
+            if op == WIRE_OP_SEND:
+                self.reportSocket.send_string(f'{self.names[src]} {self.names[dst]} SEND {size} {fid} {t!r}')
+            else:
+                self.reportSocket.send_string(f'{self.names[src]} {self.names[dst]} RECV {size} {t!r}')
+    def takeTurn(self):
+        '''
+        Internal use only, same as AirSimSync::takeTurn()
+        return False once Ctrl says bye
+        '''
+        self.flushReport()
+        self.zmqSendSocket.send(b'\0')
+        msg = self.zmqRecvSocket.recv()
+        if b'bye' in msg:
+            self.zmqSendSocket.send(b'\0', zmq.NOBLOCK)
+            return False
+        step = float(msg)
+        if self.zmqRecvSocket.getsockopt(zmq.RCVMORE):
+            fleet = self.zmqRecvSocket.recv()
+            self.fleetState = np.frombuffer(fleet, dtype=np.float64).reshape(-1, FLEET_WIDTH)
+        self.processReq()
+        self.simulate(step)
+        self.numSteps += 1
+        return True
+    def run(self):
+        self.setup()
+        # startAirSim()
+        self.zmqSendSocket.send(b'\0')
+        while self.takeTurn():
+            pass
+        if self.verbose:
+            print(f'[nsemu] {self.stats()}')
+        for socket in self.reqSockets + [self.reportSocket, self.zmqRecvSocket, self.zmqSendSocket]:
+            socket.close(linger=0)
+    def stats(self):
+        return {
+            'steps': self.numSteps,
+            'simTime': self.now,
+            'flows': self.numFlows,
+            'bytes': self.numBytes,
+        }
+
+def makePng(width, height):
+    '''
+    return bytes of a valid BGRA PNG filled with a gradient, so stub images can be decoded like real ones
+    '''
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+    row = np.zeros((height, 1 + width * 4), dtype=np.uint8) # filter byte + RGBA
+    row[:, 1::4] = np.arange(width, dtype=np.uint8)
+    row[:, 2::4] = np.arange(height, dtype=np.uint8)[:, None]
+    row[:, 4::4] = 255
+    header = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(row.tobytes())) + chunk(b'IEND', b'')
+
+class StubWorld():
+    '''
+    Internal use only
+    Kinematics of every vehicle, shared by all StubMultirotorClient
+    Vehicles appear at the origin when first used and move at constant velocity between steps
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.vehicles = {} # name -> FLEET_WIDTH row (see ctrl.py)
+        self.moveUntil = {} # name -> sim time the commanded velocity ends
+        self.time = 0.0
+        self.paused = False
+    def get(self, name):
+        '''
+        self.lock must be held
+        '''
+        ret = self.vehicles.get(name)
+        if ret is None:
+            ret = np.zeros(FLEET_WIDTH)
+            ret[6] = 1.0 # w of the identity quaternion
+            self.vehicles[name] = ret
+        return ret
+    def advance(self, dt):
+        with self.lock:
+            for name, state in self.vehicles.items():
+                until = self.moveUntil.get(name, self.time)
+                moving = min(dt, max(until - self.time, 0.0))
+                state[0:3] += state[7:10] * moving
+                if until <= self.time + dt:
+                    state[7:10] = 0.0
+            self.time += dt
+    def reset(self):
+        with self.lock:
+            self.vehicles = {}
+            self.moveUntil = {}
+            self.time = 0.0
+
+class StubMultirotorClient():
+    '''
+    Drop-in for airsim.MultirotorClient covering the calls made in this folder, without Unreal
+    Every call takes rpcLatency wall seconds, simContinueForTime() takes stepLatency more (physics and rendering)
+    simGetImage(s) return the same small PNG for every camera
+    '''
+    world = StubWorld()
+    rpcLatency = 0.0
+    stepLatency = 0.0
+    imageSize = (64, 48)
+    png = None
+    def __init__(self, ip='', port=41451, timeout_value=3600):
+        pass
+    def call(self):
+        '''
+        Internal use only
+        '''
+        if StubMultirotorClient.rpcLatency > 0:
+            time.sleep(StubMultirotorClient.rpcLatency)
+    def confirmConnection(self):
+        self.call()
+        return True
+    def reset(self):
+        self.call()
+        StubMultirotorClient.world.reset()
+    def simPause(self, is_paused):
+        self.call()
+        StubMultirotorClient.world.paused = is_paused
+    def simRunConsoleCommand(self, command):
+        self.call()
+        return True
+    def enableApiControl(self, is_enabled, vehicle_name=''):
+        self.call()
+    def armDisarm(self, arm, vehicle_name=''):
+        self.call()
+        return True
+    def simContinueForTime(self, seconds):
+        self.call()
+        if StubMultirotorClient.stepLatency > 0:
+            time.sleep(StubMultirotorClient.stepLatency)
+        StubMultirotorClient.world.advance(seconds)
+    def simGetGroundTruthKinematics(self, vehicle_name=''):
+        self.call()
+        world = StubMultirotorClient.world
+        with world.lock:
+            row = world.get(vehicle_name).copy()
+        state = airsim.KinematicsState()
+        state.position = airsim.Vector3r(*row[0:3])
+        state.orientation = airsim.Quaternionr(*row[3:7])
+        state.linear_velocity = airsim.Vector3r(*row[7:10])
+        state.angular_velocity = airsim.Vector3r(*row[10:13])
+        return state
+    def simSetVehiclePose(self, pose, ignore_collision, vehicle_name=''):
+        self.call()
+        world = StubMultirotorClient.world
+        with world.lock:
+            row = world.get(vehicle_name)
+            p, q = pose.position, pose.orientation
+            row[0:7] = (p.x_val, p.y_val, p.z_val, q.x_val, q.y_val, q.z_val, q.w_val)
+    def moveByVelocityAsync(self, vx, vy, vz, duration, vehicle_name='', **kwargs):
+        '''
+        return an object with join() like the msgpack future of AirSim, it does not wait
+        '''
+        self.call()
+        world = StubMultirotorClient.world
+        with world.lock:
+            world.get(vehicle_name)[7:10] = (vx, vy, vz)
+            world.moveUntil[vehicle_name] = world.time + duration
+        return StubFuture()
+    def simGetImage(self, camera_name, image_type, vehicle_name='', external=False):
+        self.call()
+        if StubMultirotorClient.png is None:
+            StubMultirotorClient.png = makePng(*StubMultirotorClient.imageSize)
+        return StubMultirotorClient.png
+    def simGetImages(self, requests, vehicle_name='', external=False):
+        self.call()
+        width, height = StubMultirotorClient.imageSize
+        responses = []
+        for request in requests:
+            response = airsim.ImageResponse()
+            response.image_data_uint8 = self.simGetImage(request.camera_name, request.image_type, vehicle_name)
+            response.width = width
+            response.height = height
+            response.camera_name = request.camera_name
+            response.image_type = request.image_type
+            response.compress = request.compress
+            responses.append(response)
+        return responses
+
+class StubFuture():
+    def join(self):
+        return None
+
+def useStubClient(rpcLatency=0.0, stepLatency=0.0):
+    '''
+    Replace airsim.MultirotorClient by StubMultirotorClient for every module, call before any client is made
+    '''
+    StubMultirotorClient.rpcLatency = rpcLatency
+    StubMultirotorClient.stepLatency = stepLatency
+    airsim.MultirotorClient = StubMultirotorClient
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='stand-in for the ns-3 side, start it before or after main.py')
+    parser.add_argument('--bandwidth', type=float, default=20e6, help='bits/sec of every link')
+    parser.add_argument('--delay', type=float, default=5e-3, help='one-way delay in sec of every link')
+    parser.add_argument('--link', nargs=4, action='append', default=[], metavar=('SRC', 'DST', 'BANDWIDTH', 'DELAY'))
+    parser.add_argument('--settings', help='take zmqTransport, zmqPortBase and zmqRunDir from this settings.json')
+    args = parser.parse_args()
+    if args.settings:
+        mainEndpoints.load(args.settings)
+    links = {(src, dst): (float(bandwidth), float(delay)) for src, dst, bandwidth, delay in args.link}
+    ns = NsEmulator(bandwidth=args.bandwidth, delay=args.delay, links=links, verbose=True)
+    ns.start()
+    ns.join()
+    sys.exit()
@@ -0,0 +1,180 @@
+import threading
+import concurrent.futures
+
+'''
+Frame decoding off the GCS thread
+Usage:
+pipeline = DecodePipeline(sink=makeSink('null')) # see sink.py
+pipeline.submit(name, msg.png, msg.timestamp) # never blocks
+frame = pipeline.latest.get(name) # Frame or None, never blocks
+pipeline.close()
+'''
+
+def decodeFrame(png):
+    '''
+    Default decoder, compressed BGRA image bytes to a BGR array
+    cv2 releases the GIL while decoding so threads run in parallel
+    '''
+    import cv2
+    import numpy as np
+    img = cv2.imdecode(np.frombuffer(png, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    return cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+
+class Frame():
+    __slots__ = ('src', 'seq', 'timestamp', 'image')
+    def __init__(self, src, seq, timestamp, image):
+        self.src = src
+        self.seq = seq # submit order of src
+        self.timestamp = timestamp # sim time of capture
+        self.image = image
+
+class LatestFrames():
+    '''
+    The latest decoded Frame per source
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frames = {} # src -> Frame
+        self.version = 0 # bumped on every update, to tell whether anything is new
+    def put(self, frame):
+        '''
+        return False if a newer frame of the same source is already there
+        '''
+        with self.lock:
+            old = self.frames.get(frame.src)
+            if old is not None and old.seq > frame.seq:
+                return False
+            self.frames[frame.src] = frame
+            self.version += 1
+            return True
+    def get(self, src):
+        with self.lock:
+            return self.frames.get(src)
+    def snapshot(self):
+        '''
+        return (version, {src: Frame})
+        '''
+        with self.lock:
+            return self.version, dict(self.frames)
+    def newest(self):
+        '''
+        return the Frame with the largest timestamp or None
+        '''
+        with self.lock:
+            return max(self.frames.values(), key=lambda frame: frame.timestamp, default=None)
+
+class Source():
+    '''
+    Internal use only
+    At most one frame per source is being decoded, later ones wait in queued
+    '''
+    __slots__ = ('seq', 'busy', 'queued')
+    def __init__(self):
+        self.seq = 0
+        self.busy = False
+        self.queued = None # (seq, data, timestamp)
+
+class DecodePipeline():
+    '''
+    Decode frames by a worker pool and keep the latest one per source in self.latest
+    Frames of a source are decoded in order, one at a time, so different sources run in parallel
+    If a frame arrives while an older one of the same source is still queued, the older one is dropped (drop stale)
+    Decoded frames are also put to sink by the worker
+    '''
+    def __init__(self, numWorkers=4, useProcess=False, decoder=decodeFrame, sink=None):
+        '''
+        @param useProcess: decode in processes instead of threads, decoder must be picklable
+        @param sink: sink.FrameSink or None
+        '''
+        if useProcess:
+            self.executor = concurrent.futures.ProcessPoolExecutor(numWorkers)
+        else:
+            self.executor = concurrent.futures.ThreadPoolExecutor(numWorkers, thread_name_prefix='decode')
+        self.decoder = decoder
+        self.sink = sink
+        self.latest = LatestFrames()
+        self.lock = threading.Lock()
+        self.sources = {} # src -> Source
+        self.numSubmitted = 0
+        self.numDecoded = 0
+        self.numDropped = 0
+        self.numFailed = 0
+        self.isClosed = False
+    def submit(self, src, data, timestamp=0.0):
+        '''
+        Queue data of src for decoding, return immediately
+        '''
+        with self.lock:
+            if self.isClosed:
+                return
+            self.numSubmitted += 1
+            source = self.sources.get(src)
+            if source is None:
+                source = Source()
+                self.sources[src] = source
+            source.seq += 1
+            job = (source.seq, data, timestamp)
+            if source.busy:
+                if source.queued is not None:
+                    self.numDropped += 1
+                source.queued = job
+                return
+            source.busy = True
+        self.start(src, job)
+    def start(self, src, job):
+        '''
+        Internal use only
+        '''
+        seq, data, timestamp = job
+        try:
+            fut = self.executor.submit(self.decoder, data)
+        except RuntimeError: # closed
+            with self.lock:
+                self.sources[src].busy = False
+            return
+        fut.add_done_callback(lambda fut: self.done(src, seq, timestamp, fut))
+    def done(self, src, seq, timestamp, fut):
+        '''
+        Internal use only, run by a worker when a frame is decoded
+        '''
+        try:
+            image = fut.result()
+            isFailed = False
+        except Exception as e:
+            isFailed = True
+            print(f'decoding frame {seq} from {src} failed: {e}')
+        if not isFailed:
+            frame = Frame(src, seq, timestamp, image)
+            if self.latest.put(frame) and self.sink is not None:
+                self.sink.put(frame)
+        with self.lock:
+            if isFailed:
+                self.numFailed += 1
+            else:
+                self.numDecoded += 1
+            source = self.sources[src]
+            job = source.queued
+            source.queued = None
+            if job is None or self.isClosed:
+                source.busy = False
+                return
+        self.start(src, job)
+    def stats(self):
+        with self.lock:
+            return {
+                'submitted': self.numSubmitted,
+                'decoded': self.numDecoded,
+                'dropped': self.numDropped,
+                'failed': self.numFailed,
+            }
+    def close(self, wait=True):
+        '''
+        Stop accepting frames, queued ones are dropped
+        '''
+        with self.lock:
+            self.isClosed = True
+            for source in self.sources.values():
+                if source.queued is not None:
+                    self.numDropped += 1
+                    source.queued = None
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,149 @@
+import json
+import time
+import threading
+import contextlib
+import numpy as np
+
+'''
+Per-step profiling of Ctrl
+Usage:
+Ctrl.profiler.enable() # or PROFILE = True in ctrl.py, can be switched at any time
+# ... run
+print(Ctrl.profiler.summary())
+Ctrl.profiler.export('profile.csv') # or .json
+
+Startup phases of main.py, see PhaseTimer
+'''
+
+# wall times are in seconds
+STEP_RECORD = np.dtype([
+    ('simTime', 'f8'), # sim time after the step
+    ('step', 'f8'),
+    ('ns', 'f8'), # waiting for NS to finish its step (or Ctrl.netModel.advance())
+    ('airsim', 'f8'), # simContinueForTime and reading the fleet state
+    ('freezeWait', 'f8'), # waiting for Ctrl.Frozen() blocks to exit
+    ('wakeup', 'f8'), # notifyWait()
+    ('woken', 'i4'), # waiters resumed by notifyWait()
+    ('liveFlows', 'i4'), # Router flows in flight
+    ('queuedMsgs', 'i4'), # delivered msgs not yet taken by Rx
+])
+TIMING_FIELDS = ['ns', 'airsim', 'freezeWait', 'wakeup']
+
+class StepProfiler():
+    '''
+    Ring buffer of the latest capacity step records
+    record() is a row assignment into a preallocated array and a no-op while disabled
+    '''
+    def __init__(self, capacity=1<<16, enabled=False):
+        self.records = np.zeros(capacity, dtype=STEP_RECORD)
+        self.capacity = capacity
+        self.count = 0 # records ever made
+        self.enabled = enabled
+        self.lock = threading.Lock()
+    def enable(self):
+        self.enabled = True
+    def disable(self):
+        self.enabled = False
+    def record(self, simTime, step, ns, airsim, freezeWait, wakeup, woken, liveFlows, queuedMsgs):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.records[self.count % self.capacity] = (simTime, step, ns, airsim, freezeWait, wakeup, woken, liveFlows, queuedMsgs)
+            self.count += 1
+    def snapshot(self):
+        '''
+        return a copy of the kept records, oldest first
+        '''
+        with self.lock:
+            if self.count <= self.capacity:
+                return self.records[:self.count].copy()
+            head = self.count % self.capacity
+            return np.concatenate([self.records[head:], self.records[:head]])
+    def summary(self, percentiles=(50, 90, 99)):
+        '''
+        return dict of
+        steps: number of records kept (dropped: overwritten ones)
+        <field>: {total, p50, p90, p99, max} for each timing field, and {p50, p90, p99, max} for queue depths
+        bottleneck: the timing field with the largest total
+        '''
+        records = self.snapshot()
+        ret = {'steps': len(records), 'dropped': max(0, self.count - self.capacity)}
+        if len(records) == 0:
+            return ret
+        for field in TIMING_FIELDS + ['woken', 'liveFlows', 'queuedMsgs']:
+            values = records[field]
+            stats = {f'p{p}': float(v) for p, v in zip(percentiles, np.percentile(values, percentiles))}
+            stats['max'] = float(values.max())
+            if field in TIMING_FIELDS:
+                stats['total'] = float(values.sum())
+            ret[field] = stats
+        ret['bottleneck'] = max(TIMING_FIELDS, key=lambda field: ret[field]['total'])
+        return ret
+    def export(self, path):
+        '''
+        write the kept records to path, JSON (records and summary) if it ends with .json, CSV otherwise
+        '''
+        records = self.snapshot()
+        if path.endswith('.json'):
+            with open(path, 'w') as f:
+                json.dump({
+                    'summary': self.summary(),
+                    'records': [dict(zip(STEP_RECORD.names, row.tolist())) for row in records],
+                }, f)
+        else:
+            np.savetxt(path, records, delimiter=',', header=','.join(STEP_RECORD.names), comments='',
+                fmt=['%.6f', '%.6f', '%.9f', '%.9f', '%.9f', '%.9f', '%d', '%d', '%d'])
+
+class PhaseTimer():
+    '''
+    Wall time of named phases from t0, phases run in other threads may overlap
+    Usage:
+    timer = PhaseTimer(t0) # time.perf_counter() taken before the imports
+    timer.mark('imports') # from t0 (or the previous mark) to now
+    with timer.phase('airsim'):
+        # ...
+    fn = timer.timed('endpoints', fn) # for an executor
+    print(timer.summary())
+    '''
+    def __init__(self, t0=None):
+        self.t0 = time.perf_counter() if t0 is None else t0
+        self.last = self.t0
+        self.lock = threading.Lock()
+        self.phases = {} # name -> (start, end) relative to t0
+    def add(self, name, start, end):
+        '''
+        Internal use only
+        '''
+        with self.lock:
+            self.phases[name] = (start - self.t0, end - self.t0)
+    def mark(self, name):
+        now = time.perf_counter()
+        self.add(name, self.last, now)
+        self.last = now
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.add(name, start, end)
+            self.last = max(self.last, end)
+    def timed(self, name, fn):
+        '''
+        return fn wrapped in phase(name)
+        '''
+        def wrapper(*args, **kwargs):
+            with self.phase(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    def summary(self):
+        '''
+        return {name: seconds, ..., 'total': seconds from t0 to the end of the last phase}
+        in start order
+        '''
+        with self.lock:
+            phases = sorted(self.phases.items(), key=lambda item: item[1][0])
+        ret = {name: round(end - start, 4) for name, (start, end) in phases}
+        ret['total'] = round(max((end for start, end in self.phases.values()), default=0), 4)
+        return ret
@@ -0,0 +1,345 @@
+import sys
+import json
+import time
+import struct
+import argparse
+import threading
+from collections import deque
+import numpy as np
+
+from ctrl import *
+
+'''
+Record the steps of Ctrl and the NS reports of Router to a file, then replay them without AirSim and NS
+Recording: "tracePath" in settings.json, Router.compile() sets Ctrl.recorder
+Ctrl records every step, Router every SEND/RECV record from NS (or netmodel.AnalyticNet) and every flow started
+Replay:
+python3 replay.py trace.bin # re-issue the recorded flows, no apps
+python3 main.py --replay trace.bin # run the apps against the recorded network
+'''
+
+TRACE_MAGIC = b'ATRC'
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct('<4sHHI') # magic, version, reserved, length of the JSON netConfig that follows
+RECORD_HEADER = struct.Struct('<BIdd') # kind, payload length, sim time, wall time since the start
+RECORD_STEP = 1 # payload: step (f8) [+ fleet state, float64 (numUav, FLEET_WIDTH)]
+RECORD_REPORT = 2 # payload: REPORT_RECORD
+RECORD_TX = 3 # payload: TX_RECORD
+STEP_RECORD = struct.Struct('<d')
+REPORT_RECORD = WIRE_RECORD # src id, dst id, op, size, fid
+TX_RECORD = struct.Struct('<iHHI') # fid, src id, dst id, size
+REPORT_SEND = WIRE_OP_SEND
+REPORT_RECV = WIRE_OP_RECV
+
+class TraceRecorder():
+    '''
+    Append-only writer, called by Ctrl (steps), Router.onSend()/onRecv() (reports) and Router.startFlow() (flows)
+    Records are appended in the order they happen, a truncated last record is ignored by TraceReader
+    '''
+    def __init__(self, path, netConfig, recordFleet=False):
+        self.lock = threading.Lock()
+        self.file = open(path, 'wb')
+        self.recordFleet = recordFleet
+        self.t0 = time.perf_counter()
+        self.numRecords = 0
+        config = json.dumps({key: value for key, value in netConfig.items() if key != 'tracePath'}).encode()
+        self.file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, 0, len(config)))
+        self.file.write(config)
+    def write(self, kind, simTime, *parts):
+        '''
+        Internal use only
+        '''
+        length = sum(len(part) for part in parts)
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(RECORD_HEADER.pack(kind, length, simTime, time.perf_counter() - self.t0))
+            for part in parts:
+                self.file.write(part)
+            self.numRecords += 1
+    def step(self, simTime, step, fleetState):
+        '''
+        simTime: after the step
+        '''
+        if self.recordFleet:
+            self.write(RECORD_STEP, simTime, STEP_RECORD.pack(step), np.ascontiguousarray(fleetState, dtype=np.float64).data)
+        else:
+            self.write(RECORD_STEP, simTime, STEP_RECORD.pack(step))
+    def report(self, simTime, src, dst, op, size, fid=-1):
+        self.write(RECORD_REPORT, simTime, REPORT_RECORD.pack(src, dst, op, size, fid))
+    def tx(self, simTime, fid, src, dst, size):
+        self.write(RECORD_TX, simTime, TX_RECORD.pack(fid, src, dst, size))
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+class TraceReader():
+    '''
+    reader = TraceReader(path)
+    reader.netConfig # as recorded
+    for kind, simTime, wall, payload in reader: ...
+    '''
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        magic, version, _, length = TRACE_HEADER.unpack_from(self.data, 0)
+        if magic != TRACE_MAGIC or version != TRACE_VERSION:
+            raise ValueError(f'{path} is not a version {TRACE_VERSION} trace')
+        self.netConfig = json.loads(self.data[TRACE_HEADER.size:TRACE_HEADER.size+length])
+        self.offset = TRACE_HEADER.size + length
+    def __iter__(self):
+        data = memoryview(self.data)
+        offset = self.offset
+        while offset + RECORD_HEADER.size <= len(data):
+            kind, length, simTime, wall = RECORD_HEADER.unpack_from(data, offset)
+            offset += RECORD_HEADER.size
+            if offset + length > len(data): # cut off while recording
+                break
+            yield kind, simTime, wall, data[offset:offset+length]
+            offset += length
+
+class ReplayPayload():
+    '''
+    Internal use only
+    Stands in for the msg of a recorded flow, Flow only needs its length
+    '''
+    __slots__ = ('size',)
+    def __init__(self, size):
+        self.size = size
+    def __len__(self):
+        return self.size
+
+class TraceReplay():
+    '''
+    Drive the clock of Ctrl and the reports of Router from a trace, in place of Ctrl.run() and NS
+    mode 'flows': the recorded flows are started again by the replay itself and drained as if received, no apps
+    mode 'network': apps start flows, reports are matched to them by (src, dst, order within the pair)
+    reports of a flow the apps have not started yet are held back (per pair, in order) and retried every step,
+    those still held at the end are counted in stats()
+    pace: step no faster than the recorded run (wall), apps then see about the same pace as when recorded
+    Usage:
+    replay = TraceReplay(path, mode)
+    netConfig = replay.netConfig # as Ctrl.sendNetConfig() would return
+    # register endpoints of netConfig['uavsName'] and compile mainRouter as in main.py
+    replay.attach(mainRouter)
+    replay.run() # in the thread Ctrl would run in
+    '''
+    def __init__(self, path, mode='flows', pace=False):
+        if mode not in ('flows', 'network'):
+            raise ValueError(f'unknown replay mode {mode}')
+        self.reader = TraceReader(path)
+        self.mode = mode
+        self.pace = pace
+        netConfig = self.reader.netConfig
+        netConfig['useAnalyticNet'] = 0
+        netConfig['endTime'] = netConfig.get('endTime', math.inf)
+        self.netConfig = netConfig
+        # nothing outside this process takes part, and a simulation running meanwhile keeps its ports
+        mainEndpoints.configure('inproc')
+        with Ctrl.mutex:
+            Ctrl.simTime = 0
+            Ctrl.isRunning = True
+            Ctrl.netConfig = netConfig
+        Ctrl.fleetIndex = {name: i for i, name in enumerate(netConfig['uavsName'])}
+        Ctrl.fleetState = np.zeros((len(netConfig['uavsName']), FLEET_WIDTH))
+        Ctrl.scheduler.setGranularity(netConfig['updateGranularity'])
+        Ctrl.barrier.configure(netConfig['updateGranularity'], netConfig.get('barrierTimeout', 0))
+        Ctrl.SetEndTime(netConfig['endTime'])
+        self.router = None
+        self.lock = threading.Lock()
+        self.live = {} # (src id, dst id) -> [live fid, ...] in start order
+        self.liveBytes = {} # (src id, dst id) -> bytes of live flows started so far
+        self.recvBytes = {} # (src id, dst id) -> RECV bytes replayed so far
+        self.recorded = {} # recorded fid -> order within its pair
+        self.numRecorded = {} # (src id, dst id) -> flows recorded so far
+        self.held = {} # (src id, dst id) -> deque of (op, size, order within the pair) not replayed yet
+        self.numSteps = 0
+        self.numReports = 0
+        self.numUnmatched = 0 # SEND of a recorded flow no live flow corresponds to
+        self.droppedBytes = 0 # RECV bytes without a live flow to put them in
+        self.numDrained = 0
+        self.wallSpan = 0 # wall time the recording took
+    def attach(self, router):
+        '''
+        Take over requests of router (nothing is sent to NS) after router.compile()
+        '''
+        self.router = router
+        router.netModel = self
+        Ctrl.netModel = self
+    def request(self, src, dst, size, fid):
+        '''
+        Internal use only, called by Router.startFlow() in place of the request to NS
+        '''
+        with self.lock:
+            self.live.setdefault((src, dst), []).append(fid)
+            self.liveBytes[(src, dst)] = self.liveBytes.get((src, dst), 0) + size
+    def advance(self, t, step, fleetState):
+        '''
+        Ctrl.netModel interface, the trace is driven by run() instead
+        '''
+        pass
+    def stats(self):
+        '''
+        return dict of
+        steps, reports: replayed records
+        unmatched: SEND reports of recorded flows without a live flow (apps diverged from the recording)
+        droppedBytes: RECV bytes without a live flow to put them in
+        drained: msgs taken in mode 'flows'
+        recordedWall: wall seconds the recorded run took
+        '''
+        return {
+            'steps': self.numSteps,
+            'reports': self.numReports,
+            'unmatched': self.numUnmatched,
+            'droppedBytes': self.droppedBytes,
+            'drained': self.numDrained,
+            'recordedWall': self.wallSpan,
+        }
+    def apply(self, key, op, size, k, t):
+        '''
+        Internal use only
+        return False if the live flows of key are not there yet
+        '''
+        src, dst = key
+        with self.lock:
+            live = self.live.get(key, [])
+            if op == REPORT_SEND:
+                if k >= len(live):
+                    return False
+                fid = live[k]
+            else:
+                recv = self.recvBytes.get(key, 0)
+                if self.liveBytes.get(key, 0) < recv + size:
+                    return False
+                self.recvBytes[key] = recv + size
+        if op == REPORT_SEND:
+            self.router.onSend(self.router.idToName[src], self.router.idToName[dst], size, fid, t)
+        else:
+            self.router.onRecv(self.router.idToName[src], self.router.idToName[dst], size, t)
+        return True
+    def report(self, t, src, dst, op, size, fid):
+        '''
+        Internal use only
+        t: recorded sim time of the report
+        '''
+        key = (src, dst)
+        k = -1
+        if op == REPORT_SEND:
+            k = self.recorded.get(fid, -1)
+            if k < 0:
+                self.numUnmatched += 1
+                return
+        held = self.held.get(key)
+        if held is None and self.apply(key, op, size, k, t):
+            return
+        if held is None:
+            held = self.held[key] = deque()
+        held.append((op, size, k, t))
+    def flush(self):
+        '''
+        Internal use only
+        retry held reports in order
+        '''
+        for key in list(self.held):
+            held = self.held[key]
+            while len(held) > 0 and self.apply(key, *held[0]):
+                held.popleft()
+            if len(held) == 0:
+                del self.held[key]
+    def onTx(self, fid, src, dst, size):
+        '''
+        Internal use only
+        '''
+        key = (src, dst)
+        k = self.numRecorded.get(key, 0)
+        self.numRecorded[key] = k + 1
+        self.recorded[fid] = k
+        if self.mode == 'flows':
+            from router import Flow
+            self.router.startFlow(Flow(self.router.idToName[src], self.router.idToName[dst], ReplayPayload(size)))
+    def onStep(self, simTime, payload):
+        '''
+        Internal use only
+        '''
+        self.waitUnfrozen()
+        self.flush()
+        fleetState = None
+        if len(payload) > STEP_RECORD.size:
+            fleetState = np.frombuffer(payload[STEP_RECORD.size:], dtype=np.float64).reshape(-1, FLEET_WIDTH)
+        with Ctrl.mutex:
+            Ctrl.simTime = simTime
+            if fleetState is not None:
+                Ctrl.fleetState = fleetState
+        self.numSteps += 1
+        Ctrl.notifyWait()
+        self.drain()
+    def drain(self):
+        '''
+        Internal use only
+        take delivered msgs like apps would
+        '''
+        if self.mode == 'flows':
+            for name in self.router.endPoints:
+                while self.router.recv(name, block=False, timeout=None) is not None:
+                    self.numDrained += 1
+    def waitUnfrozen(self):
+        '''
+        Internal use only, same as Ctrl.waitUnfrozen()
+        '''
+        Ctrl.barrier.waitArrived()
+        with Ctrl.freezeCond:
+            if len(Ctrl.freezeSet) != 0:
+                Ctrl.freezeCond.wait()
+    def run(self):
+        '''
+        Feed the whole trace (or until Ctrl.SetEndTime()), then end the simulation like Ctrl.run() and Router.run()
+        '''
+        t0 = time.perf_counter()
+        for kind, simTime, wall, payload in self.reader:
+            # reports and flows after the last step still belong to it, NS flushes them at the end
+            if kind == RECORD_STEP and not Ctrl.ShouldContinue():
+                break
+            self.wallSpan = wall
+            if self.pace:
+                time.sleep(max(0, t0 + wall - time.perf_counter()))
+            if kind == RECORD_STEP:
+                self.onStep(simTime, payload)
+            elif kind == RECORD_REPORT:
+                self.numReports += 1
+                self.report(simTime, *REPORT_RECORD.unpack(payload))
+            elif kind == RECORD_TX:
+                self.onTx(*TX_RECORD.unpack(payload))
+        self.flush()
+        self.drain()
+        for held in self.held.values():
+            for op, size, k, t in held:
+                if op == REPORT_SEND:
+                    self.numUnmatched += 1
+                else:
+                    self.droppedBytes += size
+        with Ctrl.mutex:
+            Ctrl.isRunning = False
+        Ctrl.notifyWait()
+        self.router.finish()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='replay the recorded flows of a trace through Router, without AirSim, NS and apps')
+    parser.add_argument('path')
+    parser.add_argument('--pace', action='store_true', help='no faster than the recorded run')
+    args = parser.parse_args()
+    replay = TraceReplay(args.path, mode='flows', pace=args.pace)
+    from router import mainRouter, context
+    netConfig = replay.netConfig
+    mainRouter.register('GCS', AIRSIM2NS_GCS_PORT_START)
+    for i, name in enumerate(netConfig['uavsName']):
+        mainRouter.register(name, AIRSIM2NS_UAV_PORT_START+i)
+    mainRouter.compile()
+    replay.attach(mainRouter)
+    t0 = time.perf_counter()
+    replay.run()
+    t1 = time.perf_counter()
+    print(f'[replay] {t1 - t0:.3f} sec, {replay.stats()}, router {mainRouter.stats()}')
+    context.destroy(linger=0)
+    sys.exit()
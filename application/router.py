@@ -3,15 +3,30 @@ import sys
 import threading
 from enum import Enum
 import queue
+import asyncio
+import itertools
+import time
+import math
+from concurrent.futures import Future
 from collections import deque
 # custom imports
 from ctrl import *
+from metrics import FlowMetrics
+from netmodel import AnalyticNet
+from replay import TraceRecorder
+from endpoint import RECONNECT_IVL
+from scheduler import Wakeup
 
 FLOWOP_SEND="SEND"
 FLOWOP_RECV="RECV"
 FLOWOP_STOP="STOP"
 
+# Binary wire protocol, see WIRE_* in ctrl.py
+# endpoint id is assigned by Router.register() in order (GCS first, then uavsName)
+WIRE_OP2FLOWOP = {WIRE_OP_SEND: FLOWOP_SEND, WIRE_OP_RECV: FLOWOP_RECV, WIRE_OP_STOP: FLOWOP_STOP}
+
 IOTIMEO = 1000
+MAX_SOCKETS = 8192 # zmq default is 1023
 NUM_IO_THREADS = 5
 VERBOSE=False
 
@@ -28,7 +43,20 @@ class Flow():
         with f:
             # access attribute here
             pass
+        # completion without polling
+        f.add_done_callback(lambda f: print(f'{f.id} delivered'))
+        f.result(timeout=1.0)
+        concurrent.futures.wait([f.future for f in flows])
+        await f # in a coroutine
+    Only Router thread updates progress, "with f" takes one of Flow.locks (shared by many flows)
+    msg is dropped (set to None) once it is handed to the receiver by Rx
     '''
+    __slots__ = ('id', 'src', 'dst', 'msg', 'bytesSent', 'bytesRecv', 'size', 'state', '_future', 'waiters',
+        'tTx', 'tFirstSend', 'tLastRecv', 'tRx')
+    PENDING = 0
+    DELIVERED = 1
+    CANCELLED = 2
+    locks = [threading.Lock() for i in range(64)]
     def __init__(self, src, dst, msg):
         self.id = -1
         self.src = src
@@ -37,9 +65,65 @@ class Flow():
         self.bytesSent = 0
         self.bytesRecv = 0
         self.size = len(msg)
-        self.lock = threading.Lock()
+        self.state = Flow.PENDING
+        self._future = None
+        self.waiters = None # Wakeup of threads in Router.select(), released by settle()
+        # (sim time, wall time) stamped by Router, None until reached, see metrics.py
+        self.tTx = None
+        self.tFirstSend = None
+        self.tLastRecv = None
+        self.tRx = None
     def start(self):
         return mainRouter.startFlow(self)
+    @property
+    def future(self):
+        '''
+        concurrent.futures.Future, created on first access
+        resolved with the flow itself once all bytes are received and msg is delivered
+        (the sender is acked at the same time), cancelled if the simulation ends first
+        '''
+        with self:
+            if self._future is None:
+                self._future = Future()
+                if self.state == Flow.DELIVERED:
+                    self._future.set_result(self)
+                elif self.state == Flow.CANCELLED:
+                    self._future.cancel()
+            return self._future
+    def settle(self, state):
+        '''
+        Internal use only, called by Router exactly once
+        '''
+        with self:
+            self.state = state
+            fut = self._future
+            waiters = self.waiters
+            self.waiters = None
+        if waiters is not None:
+            for waiter in waiters:
+                Ctrl.lockstep.resume(waiter)
+                waiter.release()
+        if fut is not None:
+            if state == Flow.DELIVERED:
+                fut.set_result(self)
+            else:
+                fut.cancel()
+    def add_done_callback(self, fn):
+        '''
+        fn(flow) is called by Router thread (or immediately if already done)
+        keep it short, it delays all other flows
+        '''
+        self.future.add_done_callback(lambda future: fn(self))
+    def result(self, timeout=None):
+        '''
+        Block (in wall-clock) until the flow is delivered and return itself
+        raise concurrent.futures.TimeoutError or CancelledError
+        '''
+        return self.future.result(timeout)
+    def done(self):
+        return self.state != Flow.PENDING
+    def __await__(self):
+        return asyncio.wrap_future(self.future).__await__()
     # def stop(self):
     #     return mainRouter.stopFlow(self)
     def isStarted(self):
@@ -60,19 +144,42 @@ class Flow():
         '''
         return f'Flow: {self.id} size:{self.size}, sent:{self.bytesSent}, recv:{self.bytesRecv}'
     def __enter__(self):
-        self.lock.acquire()
+        Flow.locks[(id(self) >> 4) & 63].acquire()
         return self
     def __exit__(self, exc_type, exc_value, tb):
-        self.lock.release()
+        Flow.locks[(id(self) >> 4) & 63].release()
+def stamp(t=None):
+    '''
+    return (sim time, wall time) for Flow timestamps
+    @param t: sim time of the event if known (NS report time), otherwise the current sim time
+    '''
+    return (Ctrl.GetSimTime() if t is None else t, time.perf_counter())
 class EndPoint():
     '''
     Store zmq socket to talk to NS3 application
     * to trigger request ( usually after Flow.start() )
     * to store receiver side queue for py app
     '''
-    def __init__(self, zmqSendSocket, *args, **kwargs):
+    def __init__(self, zmqSendSocket, id=-1, *args, **kwargs):
         self.zmqSendSocket = zmqSendSocket
+        self.id = id
         self.queue = queue.Queue()
+        # asyncio futures of coroutines (Router.recvAsync()) and scheduler.Wakeup of threads (Router.select()) waiting on queue
+        self.waiters = []
+        self.waitLock = threading.Lock()
+        # zmq socket is not thread-safe, also keeps request order == Channel order
+        self.lock = threading.Lock()
+        # (Tx sim time, request, Flow) not sent until NS reaches Tx, guarded by self.lock, see Router.release()
+        self.held = deque()
+class Channel():
+    '''
+    Flows from src to dst that are not fully received yet
+    left (oldest) ... right (latest)
+    Only touched by Router.startFlow() (append) and Router.run() (pop)
+    '''
+    def __init__(self):
+        self.flows = deque()
+        self.lock = threading.Lock()
 class Router(threading.Thread):
     '''
     Control of application data Flow
@@ -83,23 +190,53 @@ class Router(threading.Thread):
     router.register(name, port)
     # after register all (name, port) pairs
     router.compile() # to build an connected channel for sender side and recver side
+
+    NS reports are either text lines or binary frames (useBinaryWire in settings.json),
+    both are accepted by Router.dispatch()
+    With useAnalyticNet, flows go to self.netModel instead and Ctrl's thread reports onSend()/onRecv() directly
+
+    Locking:
+    self.mutex only guards register() and compile()
+    EndPoint.lock serializes requests of one sender, Channel.lock guards one (src, dst) pair
+    lock order is EndPoint.lock -> Channel.lock, EndPoint.lock -> Flow.locks
+    flow progress is only written by the thread calling dispatch() (Ctrl's with useAnalyticNet)
+
+    Flow lifecycle:
+    a flow is retired from self.flows once it is fully sent and received,
+    its msg is dropped once Rx hands it out, see stats()
+    timestamps of Tx, first SEND, last RECV and Rx go to self.metrics (metrics.FlowMetrics)
+    started flows and SEND/RECV reports go to Ctrl.recorder if tracePath is set (see replay.py)
     '''
     def __init__(self, context, *args, **kwargs):
         super().__init__()
-        self.flowIDCount = 0
+        # next() on itertools.count is atomic under GIL
+        self.flowIDCount = itertools.count()
         self.context = context
-        self.sub = context.socket(zmq.PULL)
-        self.sub.bind(f'tcp://*:{NS2ROUTER_PORT}')
+        self.sub = context.socket(zmq.PULL) # bound by compile() once the endpoints are configured
         self.sub.setsockopt(zmq.RCVTIMEO, IOTIMEO)
         
         # [name] -> endPoint
         self.endPoints = {}
+        # [endpoint id] -> name
+        self.idToName = []
+        self.useBinaryWire = True
+        self.netModel = None # netmodel.AnalyticNet if useAnalyticNet, requests and reports then skip NS
         
-        # [src][dst] -> deque
-        # left (oldest) ... right (latest)
+        # [src][dst] -> Channel
         self.recverSrc2Dst = {} # flow record on recver side
-        self.flows = {} # fid->flow
+        self.flows = {} # fid->flow (live only), single item get/set is atomic
         self.mutex = threading.Lock()
+        self.statsLock = threading.Lock()
+        self.numStarted = 0
+        self.numRetired = 0
+        self.numCutoff = 0 # flows still in flight at the end, cancelled by finish()
+        self.retainedBytes = 0 # payload of flows not yet handed out by Rx
+        self.metrics = FlowMetrics() # per (src, dst) latency and goodput
+        self.metricsPath = ''
+        self.metricsPeriod = 0
+        self.nextDump = math.inf
+        self.netTime = None # start of the step NS simulates, apps may already be at its end (or further with pipelineSkew), None without NS
+        self.heldSrcs = set() # EndPoints with held requests
     def startFlow(self, f):
         '''
         request deliver to NS
@@ -107,21 +244,110 @@ class Router(threading.Thread):
         
         NS3 should start its flow and keep transmitting to zmqRecvSocket
         <src(this)> <dst> "SEND" <size>
+        (or a WIRE_RECORD if useBinaryWire)
+        A flow started once the simulation is over is cancelled at once and counted in cutoffFlows
         
         return f (itself)
         '''
-        with f:
-            if f.id >= 0:
-                raise RuntimeError(f'flowid {f.id} is already started')
-            with self.mutex:
-                f.id = self.flowIDCount
-                self.flowIDCount += 1
-                self.recverSrc2Dst[f.src][f.dst].append(f)
+        src = self.endPoints[f.src]
+        channel = self.recverSrc2Dst[f.src][f.dst]
+        with src.lock:
+            with f:
+                if f.id >= 0:
+                    raise RuntimeError(f'flowid {f.id} is already started')
+                f.id = next(self.flowIDCount)
+                if f.tTx is None: # already stamped by asyncAppBase.TxHandoff
+                    f.tTx = stamp()
+            isOver = not Ctrl.ShouldContinue()
+            if isOver:
+                # finish() may have run already, nobody else would settle it
+                with self.statsLock:
+                    self.numStarted += 1
+                    self.numCutoff += 1
+            else:
+                if Ctrl.recorder is not None:
+                    Ctrl.recorder.tx(f.tTx[0], f.id, src.id, self.endPoints[f.dst].id, f.size)
                 self.flows[f.id] = f
-                self.endPoints[f.src].zmqSendSocket.send_string(f'{f.id} {FLOWOP_SEND} {f.size} {f.dst}', 0)
+                with self.statsLock:
+                    self.numStarted += 1
+                    self.retainedBytes += f.size
+                with channel.lock:
+                    channel.flows.append(f)
+                if self.netModel is not None:
+                    self.netModel.request(src.id, self.endPoints[f.dst].id, f.size, f.id)
+                    isSent = True
+                else:
+                    if self.useBinaryWire:
+                        req = WIRE_HEADER.pack(WIRE_VERSION, 0, 1) + WIRE_RECORD.pack(src.id, self.endPoints[f.dst].id, WIRE_OP_SEND, f.size, f.id)
+                    else:
+                        req = f'{f.id} {FLOWOP_SEND} {f.size} {f.dst}'.encode()
+                    netTime = self.netTime
+                    if netTime is not None and (len(src.held) > 0 or f.tTx[0] > netTime):
+                        # NS is still busy with an earlier step, see release()
+                        src.held.append((f.tTx[0], req, f))
+                        self.heldSrcs.add(src)
+                        isSent = True
+                    else:
+                        isSent = self.sendReq(src, req)
                 if VERBOSE:
                     print(f'Router req: {f.id} {f.src} {FLOWOP_SEND} {f.size} {f.dst}')
+        if isOver:
+            f.msg = None
+            f.settle(Flow.CANCELLED)
+        elif not isSent:
+            self.drop(f, channel)
         return f
+    def drop(self, f, channel):
+        '''
+        Internal use only
+        forget a flow whose request never reached NS because the simulation ended, it counts in cutoffFlows
+        '''
+        with channel.lock:
+            if f in channel.flows:
+                channel.flows.remove(f)
+        if self.flows.pop(f.id, None) is not None:
+            with self.statsLock:
+                self.numCutoff += 1
+                self.retainedBytes -= f.size
+        f.msg = None
+        if not f.done():
+            f.settle(Flow.CANCELLED)
+    def sendReq(self, src, req):
+        '''
+        Internal use only, src.lock must be held
+        NS closes its sockets once the simulation is over, a send would then block forever
+        return False if the simulation ended before req could be sent
+        '''
+        while True:
+            try:
+                src.zmqSendSocket.send(req, 0) # blocks at most IOTIMEO
+                return True
+            except zmq.Again:
+                if not Ctrl.ShouldContinue():
+                    return False
+    def release(self, t):
+        '''
+        Internal use only, called by Ctrl right before NS simulates the step starting at t
+        send the held requests of flows started at or before t, later flows are held until NS reaches them,
+        so NS starts every flow at the sim time of its Tx instead of the earlier step it is busy with
+        (apps see the end of that step while NS simulates it, pipelineSkew adds more steps)
+        return number of requests sent
+        '''
+        self.netTime = t
+        numSent = 0
+        failed = []
+        for src in list(self.heldSrcs):
+            with src.lock:
+                while len(src.held) > 0 and src.held[0][0] <= t:
+                    tTx, req, f = src.held.popleft()
+                    numSent += 1
+                    if not self.sendReq(src, req):
+                        failed.append(f)
+                if len(src.held) == 0:
+                    self.heldSrcs.discard(src)
+        for f in failed:
+            self.drop(f, self.recverSrc2Dst[f.src][f.dst])
+        return numSent
     # def stopFlow(self, f):
     #     '''
     #     Just send stop request,
@@ -146,87 +372,325 @@ class Router(threading.Thread):
     def register(self, name, zmqSendPort, *args, **kwargs):
         '''
         To register an entry for an application (in py and NS)
+        Endpoint ids follow the order of registration,
+        which must be GCS first then uavsName to match NS
         '''
         zmqSendSocket = self.context.socket(zmq.PUSH)
-        zmqSendSocket.bind(f'tcp://*:{zmqSendPort}')
+        zmqSendSocket.bind(mainEndpoints.bind(zmqSendPort))
         zmqSendSocket.setsockopt(zmq.RCVTIMEO, IOTIMEO)
+        zmqSendSocket.setsockopt(zmq.SNDTIMEO, IOTIMEO)
         with self.mutex:
-            self.endPoints[name] = EndPoint(zmqSendSocket)
+            self.endPoints[name] = EndPoint(zmqSendSocket, len(self.idToName))
+            self.idToName.append(name)
             return self.endPoints[name]
     def recv(self, dst, block, timeout):
         '''
         To Allow an application to retrieve object
         An object is visible if that corresponding flow is fully received
+        queue.Queue is thread-safe, no Router lock is held while blocking
         '''
         try:
-            with self.mutex:
-                f = self.endPoints[dst].queue.get(block=block, timeout=timeout)
-                return (f.src, f.msg)
+            f = self.endPoints[dst].queue.get(block=block, timeout=timeout)
+            return (f.src, self.handOut(f))
         except queue.Empty:
             return None
+    def handOut(self, f):
+        '''
+        Internal use only
+        return f.msg and drop the reference kept by the flow
+        '''
+        msg = f.msg
+        f.msg = None
+        f.tRx = stamp()
+        with self.statsLock:
+            self.retainedBytes -= f.size
+        self.metrics.onRx(f)
+        return msg
+    def retire(self, f):
+        '''
+        Internal use only
+        remove a flow that is fully sent and received from the flow table
+        '''
+        if self.flows.pop(f.id, None) is not None:
+            with self.statsLock:
+                self.numRetired += 1
+    def stats(self):
+        '''
+        return dict of
+        liveFlows: flows not yet fully sent or received
+        queuedMsgs: delivered msgs waiting for Rx
+        retainedBytes: payload referenced by Router (live flows and queued msgs)
+        startedFlows, retiredFlows: totals since start
+        cutoffFlows: flows started after, or still in flight when, the simulation ended, all cancelled
+        '''
+        with self.statsLock:
+            return {
+                'liveFlows': len(self.flows),
+                'queuedMsgs': sum(endPoint.queue.qsize() for endPoint in self.endPoints.values()),
+                'retainedBytes': self.retainedBytes,
+                'startedFlows': self.numStarted,
+                'retiredFlows': self.numRetired,
+                'cutoffFlows': self.numCutoff,
+            }
+    def depths(self):
+        '''
+        return (live flows, delivered msgs not yet taken by Rx)
+        both 0 means the network is idle and no app is about to react to a msg (see Ctrl.nextSimStepSize())
+        '''
+        with self.statsLock:
+            numFlows = len(self.flows)
+        return numFlows, sum(endPoint.queue.qsize() for endPoint in self.endPoints.values())
+    async def recvAsync(self, dst):
+        '''
+        Coroutine version of recv()
+        Suspend the calling task until a msg is delivered to dst
+        return (src, msg), or None if the simulation is over
+        '''
+        endPoint = self.endPoints[dst]
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                f = endPoint.queue.get_nowait()
+                return (f.src, self.handOut(f))
+            except queue.Empty:
+                pass
+            if not Ctrl.ShouldContinue():
+                return None
+            fut = loop.create_future()
+            def register():
+                with endPoint.waitLock:
+                    endPoint.waiters.append(fut)
+            Ctrl.lockstep.park(fut, register)
+            try:
+                # delivered before the waiter is visible to wakeWaiters()
+                if not endPoint.queue.empty():
+                    # a stale future would pile up until the next wakeWaiters()
+                    with endPoint.waitLock:
+                        if fut in endPoint.waiters:
+                            endPoint.waiters.remove(fut)
+                    continue
+                await fut
+            finally:
+                Ctrl.lockstep.resume(fut)
+    def select(self, sources, deadline=math.inf):
+        '''
+        Block the calling thread until any of sources is ready, the clock reaches deadline (sim time)
+        or the simulation is over, whichever comes first
+        @param sources: endpoint names (ready once a msg is queued for it) and Flows (ready once settled)
+        return [ready sources], empty at deadline or once the simulation is over
+        Woken directly by the delivery, the flow or Ctrl.notifyWait(), nothing polls
+        '''
+        endPoints = [self.endPoints[s] for s in sources if isinstance(s, str)]
+        flows = [s for s in sources if not isinstance(s, str)]
+        def ready():
+            return [s for s in sources if (not self.endPoints[s].queue.empty() if isinstance(s, str) else s.done())]
+        ret = ready()
+        if len(ret) > 0 or not Ctrl.ShouldContinue() or deadline <= Ctrl.GetSimTime():
+            return ret
+        wakeup = Wakeup()
+        def register():
+            for endPoint in endPoints:
+                with endPoint.waitLock:
+                    endPoint.waiters.append(wakeup)
+            for f in flows:
+                with f:
+                    if f.state == Flow.PENDING:
+                        if f.waiters is None:
+                            f.waiters = []
+                        f.waiters.append(wakeup)
+            return Ctrl.scheduler.schedule(deadline, wakeup) if deadline < math.inf else None
+        timer = Ctrl.lockstep.park(wakeup, register)
+        try:
+            # ready, or the simulation ended, before the wakeup was visible to them
+            if len(ready()) == 0 and Ctrl.ShouldContinue():
+                wakeup.wait()
+        finally:
+            # a flow or endpoint selected again and again must not pile up stale wakeups
+            if timer is not None:
+                Ctrl.scheduler.cancel(timer)
+            for endPoint in endPoints:
+                with endPoint.waitLock:
+                    if wakeup in endPoint.waiters:
+                        endPoint.waiters.remove(wakeup)
+            for f in flows:
+                with f:
+                    if f.waiters is not None and wakeup in f.waiters:
+                        f.waiters.remove(wakeup)
+            Ctrl.lockstep.resume(wakeup)
+        return ready()
+    @staticmethod
+    def wakeWaiters(endPoint):
+        '''
+        Internal use only
+        resume coroutines in recvAsync() and threads in select() of this endPoint
+        '''
+        with endPoint.waitLock:
+            waiters = endPoint.waiters
+            endPoint.waiters = []
+        futures = []
+        for waiter in waiters:
+            Ctrl.lockstep.resume(waiter)
+            if isinstance(waiter, asyncio.Future):
+                futures.append(waiter)
+            else:
+                waiter.release()
+        if len(futures) > 0:
+            futures[0].get_loop().call_soon_threadsafe(Ctrl.resolveAll, futures)
     def compile(self):
         '''
         To build a connected graph and do house-keeping
         '''
+        Ctrl.trafficProbe = self.depths
+        Ctrl.releaseRequests = self.release
         with self.mutex:
+            self.sub.bind(mainEndpoints.bind(NS2ROUTER_PORT))
+            netConfig = Ctrl.GetNetConfig()
+            self.useBinaryWire = bool(netConfig.get('useBinaryWire', 1))
+            self.metricsPath = netConfig.get('metricsPath', '')
+            self.metricsPeriod = netConfig.get('metricsPeriod', 0)
+            if self.metricsPath and self.metricsPeriod > 0:
+                self.nextDump = self.metricsPeriod
+            if netConfig.get('useAnalyticNet', 0):
+                self.netModel = AnalyticNet(self, netConfig)
+            Ctrl.netModel = self.netModel
+            if netConfig.get('tracePath', ''):
+                Ctrl.recorder = TraceRecorder(netConfig['tracePath'], netConfig, bool(netConfig.get('traceFleet', 0)))
             for src in self.endPoints:
                 dd = {}
                 for dst in self.endPoints:
-                    dd[dst] = deque()
+                    dd[dst] = Channel()
                 self.recverSrc2Dst[src] = dd
+    def onSend(self, src, dst, size, fid, t=None):
+        '''
+        <src> <dst> "SEND" <size> <fid> [<t>]
+        sendCallback fired from NS3 will be aggregated
+        <size> may be the sum of several packets
+        @param t: sim time NS sent it, the current sim time if the report carries none
+        '''
+        if VERBOSE:
+            print(f'fid: {fid}, {src}-S>{dst} send {size}')
+        if Ctrl.recorder is not None:
+            Ctrl.recorder.report(Ctrl.GetSimTime() if t is None else t, self.endPoints[src].id, self.endPoints[dst].id, WIRE_OP_SEND, size, fid)
+        f = self.flows.get(fid)
+        if f is not None:
+            if f.tFirstSend is None:
+                f.tFirstSend = stamp(t)
+            f.bytesSent += size
+            if f.bytesSent >= f.size and f.bytesRecv == f.size:
+                self.retire(f)
+    def onRecv(self, src, dst, size, t=None):
+        '''
+        <src> <dst(this)> "RECV" <size> [<t>]
+        @param t: sim time NS received it, the current sim time if the report carries none
+        '''
+        if VERBOSE:
+            print(f'{src}-R>{dst} recv {size}')
+        if Ctrl.recorder is not None:
+            Ctrl.recorder.report(Ctrl.GetSimTime() if t is None else t, self.endPoints[src].id, self.endPoints[dst].id, WIRE_OP_RECV, size)
+        channel = self.recverSrc2Dst[src][dst]
+        done = []
+        with channel.lock:
+            while size > 0:
+                f = channel.flows.popleft()
+                if f.id in self.flows: # hasn't been removed yet
+                    put = min(size, f.size - f.bytesRecv)
+                    f.bytesRecv += put
+                    size -= put
+                    if f.bytesRecv == f.size:
+                        f.tLastRecv = stamp(t)
+                        self.endPoints[f.dst].queue.put_nowait(f)
+                        done.append(f)
+                    elif f.bytesRecv < f.size:
+                        channel.flows.appendleft(f)
+                    else:
+                        raise RuntimeError(f'{f} calculation Error on recver side')
+                else: # flow f is canceled
+                    pass
+        # outside of locks so that callbacks may start new flows
+        for f in done:
+            self.metrics.onDelivered(f)
+            if f.bytesSent >= f.size:
+                self.retire(f)
+            f.settle(Flow.DELIVERED)
+            self.wakeWaiters(self.endPoints[f.dst])
+    def dispatch(self, buf):
+        '''
+        Decode one frame from NS and update flows
+        @param buf: bytes-like (memoryview from recv(copy=False))
+        a binary frame starts with WIRE_VERSION, otherwise it is a text line
+        metrics are stamped with the NS time of each record if the frame carries it (WIRE_FLAG_TIMED or a trailing <t>),
+        otherwise with the sim time the frame is dispatched, which is quantized to the step
+        '''
+        if len(buf) >= WIRE_HEADER.size and buf[0] == WIRE_VERSION:
+            version, flags, count = WIRE_HEADER.unpack_from(buf, 0)
+            record = WIRE_TIMED_RECORD if flags & WIRE_FLAG_TIMED else WIRE_RECORD
+            if len(buf) != WIRE_HEADER.size + count * record.size:
+                raise RuntimeError(f'In Router, malformed frame of {len(buf)} bytes with {count} records')
+            idToName = self.idToName
+            for src, dst, op, size, fid, *t in record.iter_unpack(buf[WIRE_HEADER.size:]):
+                t = t[0] if t else None
+                if op == WIRE_OP_SEND:
+                    self.onSend(idToName[src], idToName[dst], size, fid, t)
+                elif op == WIRE_OP_RECV:
+                    self.onRecv(idToName[src], idToName[dst], size, t)
+                else:
+                    raise RuntimeError(f'In Router, OP "{WIRE_OP2FLOWOP.get(op, op)}" not handled')
+            return
+        src, dst, op, *args = bytes(buf).decode().split()
+        if op == FLOWOP_SEND:
+            self.onSend(src, dst, int(args[0]), int(args[1]), float(args[2]) if len(args) > 2 else None)
+        elif op == FLOWOP_RECV:
+            self.onRecv(src, dst, int(args[0]), float(args[1]) if len(args) > 1 else None)
+        # elif op == FLOWOP_STOP:
+        #     # <src> <dst> "STOP" <succ=0/1> <fid> <left>
+        #     succ = int(args[0])
+        #     fid = int(args[1])
+        #     left = int(args[2])
+        #     if VERBOSE:
+        #         print(f'{src}-x-{dst} stopped, succ {succ}, fid {fid}, left {left}')
+        #     if succ == 1:
+        #         self.flows.pop(fid)
+        else:
+            raise RuntimeError(f'In Router, OP "{op}" not handled')
     def run(self):
         # Keep listening to reponse from NS3 then update those flows
         while Ctrl.ShouldContinue():
             try:
-                msg = self.sub.recv_string()
-                src, dst, op, *args = msg.split()
-                if op == FLOWOP_SEND:
-                    # <src> <dst> "SEND" <size> <fid>
-                    size = int(args[0])
-                    fid = int(args[1])
-                    if VERBOSE:
-                        print(f'fid: {fid}, {src}-S>{dst} send {size}')
-                    with self.mutex:
-                        if fid in self.flows:
-                            with self.flows[fid] as f:
-                                f.bytesSent += size
-                # sendCallback fired from NS3 will be aggregated
-                # <size> may be the sum of several packets
-                elif op == FLOWOP_RECV:
-                    # <src> <dst(this)> "RECV" <size>
-                    with self.mutex:
-                        size = int(args[0])
-                        if VERBOSE:
-                            print(f'{src}-R>{dst} recv {size}')
-                        while size > 0:
-                            f = self.recverSrc2Dst[src][dst].popleft()
-                            with f:
-                                if f.id in self.flows: # hasn't been removed yet
-                                    put = min(size, f.size - f.bytesRecv)
-                                    f.bytesRecv += put
-                                    size -= put
-                                    if f.bytesRecv == f.size:
-                                        self.endPoints[f.dst].queue.put_nowait(f)
-                                    elif f.bytesRecv < f.size:
-                                        self.recverSrc2Dst[src][dst].appendleft(f)
-                                    else:
-                                        raise RuntimeError(f'{f} calculation Error on recver side')
-                                else: # flow f is canceled
-                                    pass
-                # elif op == FLOWOP_STOP:
-                #     # <src> <dst> "STOP" <succ=0/1> <fid> <left>
-                #     succ = int(args[0])
-                #     fid = int(args[1])
-                #     left = int(args[2])
-                #     if VERBOSE:
-                #         print(f'{src}-x-{dst} stopped, succ {succ}, fid {fid}, left {left}')
-                #     if succ == 1:
-                #         self.flows.pop(fid)
-                else:
-                    raise RuntimeError(f'In Router, OP "{op}" not handled')
+                frame = self.sub.recv(copy=False)
+                self.dispatch(frame.buffer)
             except zmq.ZMQError:
                 pass
+            if Ctrl.GetSimTime() >= self.nextDump:
+                self.metrics.dump(self.metricsPath, Ctrl.GetSimTime())
+                self.nextDump += self.metricsPeriod
+        self.finish()
+    def finish(self):
+        '''
+        Internal use only, called once the simulation is over (by run() or replay.TraceReplay)
+        Flows in flight at endTime are not drained, ns-3 stops its apps at endTime, they are cancelled and counted in cutoffFlows
+        '''
+        # startFlow() calls that saw the simulation running add their flow before leaving src.lock, later ones cancel it themselves
+        for endPoint in self.endPoints.values():
+            with endPoint.lock:
+                pass
+        # release whoever is still waiting on an unfinished flow
+        cutoff = [f for f in list(self.flows.values()) if not f.done()]
+        with self.statsLock:
+            self.numCutoff += len(cutoff)
+        for f in cutoff:
+            f.settle(Flow.CANCELLED)
+        for endPoint in self.endPoints.values():
+            self.wakeWaiters(endPoint)
+        if self.metricsPath:
+            self.metrics.dump(self.metricsPath, Ctrl.GetSimTime())
+        # only now, the last NS reports are dispatched (and recorded) until run() leaves its loop
+        if Ctrl.recorder is not None:
+            Ctrl.recorder.close()
+            print(f'[Router] recorded {Ctrl.recorder.numRecords} records to {Ctrl.GetNetConfig()["tracePath"]}')
 
 # instantiate a common router for the whole simulation
 context = zmq.Context(NUM_IO_THREADS)
+# Router takes one socket per UAV plus four, nsemu as many again with inproc
+context.set(zmq.MAX_SOCKETS, MAX_SOCKETS)
+context.setsockopt(zmq.RECONNECT_IVL, RECONNECT_IVL) # default of every socket created after this
 mainRouter = Router(context)
\ No newline at end of file
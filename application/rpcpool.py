@@ -0,0 +1,259 @@
+import copy
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+import setup_path
+import airsim
+from metrics import percentiles
+
+'''
+AirSim clients shared by the whole process (Ctrl, CaptureService and every app)
+A MultirotorClient is not thread safe, so each call borrows one connection and gives it back
+At most size connections are opened, a call waits in the queue of its call type (CALL_TYPES)
+and every type may hold at most its limit of them; the types other than step share size - 1 of them,
+so one connection is always left for Ctrl's step however many image grabs and reads are running
+Reads (simGet*, get*) issued at the same sim time with the same arguments share one RPC,
+a step drops the shared reads since it may change what they return, so does a write for the reads of its vehicle
+Usage:
+mainClientPool.adopt(client) # optional, an already connected client becomes the first connection
+client = mainClientPool.proxy() # drop-in for airsim.MultirotorClient in any thread
+client.simSetVehiclePose(pose, True, vehicle_name=name)
+mainClientPool.call('simGetVehiclePose', vehicle_name=name) # the same
+print(Ctrl.RpcStats()) # per method latency, see stats()
+'''
+
+DEFAULT_SIZE = 4
+# call type -> (at most this many connections, methods), any other method is 'write'
+# every type but step is also capped by the size - 1 connections they share (see ClientPool.canTake())
+CALL_TYPES = {
+    'step': (1, ('simContinueForTime', 'simPause', 'reset', 'simRunConsoleCommand', 'confirmConnection')),
+    'image': (2, ('simGetImage', 'simGetImages')),
+    'read': (2, ()), # simGet* and get* not listed above
+    'write': (2, ()),
+}
+MAX_SAMPLES = 4096
+
+def callType(method):
+    for name, (limit, methods) in CALL_TYPES.items():
+        if method in methods:
+            return name
+    if method.startswith('simGet') or method.startswith('get'):
+        return 'read'
+    return 'write'
+
+class RpcCounter():
+    '''
+    Internal use only
+    '''
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.latency = deque(maxlen=MAX_SAMPLES) # wall sec on the connection
+        self.wait = deque(maxlen=MAX_SAMPLES) # wall sec queued for a connection
+    def summary(self):
+        return {
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'errors': self.errors,
+            'latency': percentiles(self.latency),
+            'wait': percentiles(self.wait),
+        }
+
+class ClientProxy():
+    '''
+    Looks like airsim.MultirotorClient, every method goes through the pool
+    '''
+    def __init__(self, pool):
+        self.pool = pool
+    def __getattr__(self, method):
+        def call(*args, **kwargs):
+            return self.pool.call(method, *args, **kwargs)
+        call.__name__ = method
+        return call
+    def readAt(self, t, method, *args, **kwargs):
+        return self.pool.readAt(t, method, *args, **kwargs)
+
+class ClientPool():
+    def __init__(self, size=DEFAULT_SIZE, clock=None):
+        '''
+        @param clock: return the sim time reads are shared within, None to never share (set to Ctrl.GetSimTime by ctrl.py)
+        '''
+        self.size = size
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        self.idle = [] # connected clients not in use
+        self.numClients = 0 # including the ones being connected and in use
+        self.queues = {name: deque() for name in CALL_TYPES} # type -> waiting tickets, head is served first
+        self.busy = {name: 0 for name in CALL_TYPES} # type -> connections held
+        self.reads = {} # (vehicle_name, method, args, kwargs) -> Future of readTime
+        self.readTime = None
+        self.counters = {} # method -> RpcCounter
+    def configure(self, size=DEFAULT_SIZE):
+        '''
+        Call before the first call, connections already open are kept
+        '''
+        with self.lock:
+            self.size = max(1, int(size))
+    def adopt(self, client):
+        '''
+        Use a connected client as one of the connections
+        '''
+        with self.lock:
+            self.idle.append(client)
+            self.numClients += 1
+            self.cond.notify_all()
+    def proxy(self):
+        return ClientProxy(self)
+    def counter(self, method):
+        '''
+        Internal use only, self.lock must be held
+        '''
+        ret = self.counters.get(method)
+        if ret is None:
+            ret = RpcCounter()
+            self.counters[method] = ret
+        return ret
+    def canTake(self, kind):
+        '''
+        Internal use only, self.lock must be held
+        return whether kind may take one more connection
+        '''
+        if self.busy[kind] >= CALL_TYPES[kind][0]:
+            return False
+        if kind == 'step' or self.size <= 1:
+            return True
+        # one connection stays reserved for step
+        return sum(busy for name, busy in self.busy.items() if name != 'step') < self.size - 1
+    def acquire(self, kind):
+        '''
+        Internal use only
+        return (client, False) or (None, True) if a new connection has to be opened by the caller
+        '''
+        ticket = object()
+        with self.lock:
+            queue = self.queues[kind]
+            queue.append(ticket)
+            while True:
+                if queue[0] is ticket and self.canTake(kind):
+                    if len(self.idle) > 0:
+                        client, isNew = self.idle.pop(), False
+                        break
+                    if self.numClients < self.size:
+                        self.numClients += 1
+                        client, isNew = None, True
+                        break
+                self.cond.wait()
+            queue.popleft()
+            self.busy[kind] += 1
+            # the next of this type may go on a free connection too
+            self.cond.notify_all()
+        return client, isNew
+    def release(self, kind, client):
+        '''
+        Internal use only, client is None if it failed to connect
+        '''
+        with self.lock:
+            self.busy[kind] -= 1
+            if client is None:
+                self.numClients -= 1
+            else:
+                self.idle.append(client)
+            self.cond.notify_all()
+    def connect(self):
+        '''
+        Internal use only
+        '''
+        client = airsim.MultirotorClient()
+        client.confirmConnection()
+        return client
+    def invoke(self, method, args, kwargs):
+        '''
+        Internal use only
+        Run one call on a borrowed connection
+        '''
+        kind = callType(method)
+        t0 = time.perf_counter()
+        client, isNew = self.acquire(kind)
+        t1 = time.perf_counter()
+        try:
+            if isNew:
+                client = self.connect()
+            t1 = time.perf_counter()
+            ret = getattr(client, method)(*args, **kwargs)
+        except:
+            with self.lock:
+                self.counter(method).errors += 1
+            self.release(kind, client)
+            raise
+        t2 = time.perf_counter()
+        self.release(kind, client)
+        with self.lock:
+            counter = self.counter(method)
+            counter.calls += 1
+            counter.wait.append(t1 - t0)
+            counter.latency.append(t2 - t1)
+        return ret
+    def dropReads(self, vehicleName=None):
+        '''
+        Internal use only
+        forget the shared reads of vehicleName, or every one if None
+        '''
+        with self.lock:
+            if vehicleName is None:
+                self.reads = {}
+            else:
+                self.reads = {key: fut for key, fut in self.reads.items() if key[0] != vehicleName}
+    def call(self, method, *args, **kwargs):
+        '''
+        client.method(*args, **kwargs) on a free connection
+        '''
+        kind = callType(method)
+        if kind != 'read' or self.clock is None:
+            if kind in ('step', 'write'):
+                self.dropReads(kwargs.get('vehicle_name') if kind == 'write' else None)
+            return self.invoke(method, args, kwargs)
+        return self.readAt(self.clock(), method, *args, **kwargs)
+    def readAt(self, t, method, *args, **kwargs):
+        '''
+        client.method(*args, **kwargs) shared with the other reads of sim time t
+        Ctrl reads the fleet right after a step as reads of the time the step ends at, before its clock shows it
+        '''
+        key = (kwargs.get('vehicle_name'), method, repr(args), repr(sorted(kwargs.items())))
+        with self.lock:
+            if t != self.readTime:
+                self.reads = {}
+                self.readTime = t
+            fut = self.reads.get(key)
+            isOwner = fut is None
+            if isOwner:
+                fut = Future()
+                self.reads[key] = fut
+            else:
+                self.counter(method).coalesced += 1
+        if isOwner:
+            try:
+                fut.set_result(self.invoke(method, args, kwargs))
+            except Exception as e:
+                # not shared, the next reader tries again
+                with self.lock:
+                    if self.reads.get(key) is fut:
+                        del self.reads[key]
+                fut.set_exception(e)
+        # every reader gets its own copy to modify, as if it made the call
+        return copy.deepcopy(fut.result())
+    def stats(self):
+        '''
+        return {'connections': n, 'methods': {method: {'calls', 'coalesced', 'errors', 'latency', 'wait'}, ...}}
+        latency and wait are wall seconds (p50, p90, p99, max) of the latest MAX_SAMPLES calls
+        '''
+        with self.lock:
+            return {
+                'connections': self.numClients,
+                'methods': {method: counter.summary() for method, counter in self.counters.items()},
+            }
+
+# clients of the whole simulation
+mainClientPool = ClientPool()
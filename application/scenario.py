@@ -0,0 +1,7 @@
+'''
+Names of the module globals of appBase.py that select an experiment
+main.py --scenario NAME=VALUE overrides them, sweep.py grids over them
+Kept free of imports so that sweep.py does not load Ctrl, Router, zmq or airsim in its own process
+'''
+
+SCENARIO = ('TARGET', 'RUNTIME', 'SINK', 'DIST', 'PERIOD')
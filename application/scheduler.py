@@ -0,0 +1,205 @@
+import threading
+import heapq
+import math
+
+class Timer():
+    '''
+    A pending wait in Scheduler
+    waiter is whatever the caller needs to resume it (a held threading.Lock or an asyncio.Future)
+    '''
+    __slots__ = ('t', 'waiter', 'state')
+    PENDING = 0
+    FIRED = 1
+    CANCELLED = 2
+    def __init__(self, t, waiter):
+        self.t = t
+        self.waiter = waiter
+        self.state = Timer.PENDING
+
+class Wakeup():
+    '''
+    One-shot waiter for a wait on several sources (see Router.select())
+    release() may come from any of them and more than once, only the first resumes wait()
+    '''
+    __slots__ = ('lock', 'guard', 'isFired')
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lock.acquire()
+        self.guard = threading.Lock()
+        self.isFired = False
+    def release(self):
+        with self.guard:
+            if self.isFired:
+                return
+            self.isFired = True
+        self.lock.release()
+    def wait(self):
+        self.lock.acquire()
+
+class Bucket():
+    '''
+    Timers whose deadline falls in the same tick
+    tmin is a lower bound of their deadlines, cancelled timers stay until they outnumber the pending ones
+    '''
+    __slots__ = ('timers', 'tmin', 'numCancelled')
+    def __init__(self):
+        self.timers = []
+        self.tmin = math.inf
+        self.numCancelled = 0
+    def compact(self):
+        '''
+        drop cancelled timers, return number of pending timers left
+        '''
+        self.timers = [timer for timer in self.timers if timer.state == Timer.PENDING]
+        self.tmin = min((timer.t for timer in self.timers), default=math.inf)
+        self.numCancelled = 0
+        return len(self.timers)
+
+class Scheduler():
+    '''
+    Simulated-time timer wheel behind Ctrl.WaitUntil() and Ctrl.sleep_until()
+    Usage:
+    scheduler = Scheduler(updateGranularity)
+    timer = scheduler.schedule(t, waiter)
+    scheduler.cancel(timer) # True if it was still pending
+    for timer in scheduler.popDue(simTime):
+        # resume timer.waiter
+    Timers are hashed into one bucket per tick (updateGranularity),
+    so waiting one tick is an append to an existing bucket,
+    and a step pops whole buckets at once instead of one heap entry per waiter
+    '''
+    def __init__(self, granularity=0.01):
+        self.lock = threading.Lock()
+        self.granularity = granularity
+        self.buckets = {} # tick -> Bucket
+        self.ticks = [] # heap of ticks that own a bucket
+        self.numPending = 0
+    def __len__(self):
+        '''
+        number of pending timers
+        '''
+        with self.lock:
+            return self.numPending
+    def setGranularity(self, granularity):
+        '''
+        rehash pending timers if tick size changes
+        '''
+        with self.lock:
+            timers = [timer for bucket in self.buckets.values() for timer in bucket.timers if timer.state == Timer.PENDING]
+            self.granularity = granularity
+            self.buckets = {}
+            self.ticks = []
+            for timer in timers:
+                self.insert(timer)
+    def insert(self, timer):
+        '''
+        Internal use only, self.lock must be held
+        '''
+        tick = int(timer.t // self.granularity)
+        bucket = self.buckets.get(tick)
+        if bucket is None:
+            bucket = Bucket()
+            self.buckets[tick] = bucket
+            heapq.heappush(self.ticks, tick)
+        bucket.timers.append(timer)
+        if timer.t < bucket.tmin:
+            bucket.tmin = timer.t
+    def schedule(self, t, waiter):
+        '''
+        return Timer that fires once the clock reaches t (within half a tick)
+        '''
+        timer = Timer(t, waiter)
+        with self.lock:
+            self.insert(timer)
+            self.numPending += 1
+        return timer
+    def cancel(self, timer):
+        '''
+        return True if timer was pending and will never be popped
+        The bucket is compacted once most of it is cancelled, so a schedule/cancel loop (RxUntil(), Select()) holds no garbage
+        '''
+        with self.lock:
+            if timer.state != Timer.PENDING:
+                return False
+            timer.state = Timer.CANCELLED
+            self.numPending -= 1
+            tick = int(timer.t // self.granularity)
+            bucket = self.buckets[tick]
+            bucket.numCancelled += 1
+            if 2 * bucket.numCancelled > len(bucket.timers) and bucket.compact() == 0:
+                self.removeBucket(tick)
+            return True
+    def removeBucket(self, tick):
+        '''
+        Internal use only, self.lock must be held
+        '''
+        del self.buckets[tick]
+        if self.ticks[0] == tick:
+            heapq.heappop(self.ticks)
+        else:
+            self.ticks.remove(tick)
+            heapq.heapify(self.ticks)
+    def nextDue(self):
+        '''
+        return the earliest deadline (lower bound within its tick) or math.inf if nothing is pending
+        '''
+        with self.lock:
+            while len(self.ticks) > 0:
+                tick = self.ticks[0]
+                bucket = self.buckets[tick]
+                if len(bucket.timers) > bucket.numCancelled:
+                    return bucket.tmin
+                self.removeBucket(tick)
+            return math.inf
+    def popDue(self, now):
+        '''
+        return every pending Timer with t <= now + granularity/2, which are marked fired
+        '''
+        threshold = now + self.granularity/2
+        due = []
+        with self.lock:
+            last = int(threshold // self.granularity)
+            while len(self.ticks) > 0 and self.ticks[0] <= last:
+                tick = self.ticks[0]
+                bucket = self.buckets[tick]
+                if tick < last: # whole bucket is due
+                    heapq.heappop(self.ticks)
+                    del self.buckets[tick]
+                    timers = bucket.timers
+                else: # partially due
+                    timers = []
+                    left = []
+                    bucket.tmin = math.inf
+                    bucket.numCancelled = 0
+                    for timer in bucket.timers:
+                        if timer.state != Timer.PENDING:
+                            continue
+                        if timer.t <= threshold:
+                            timers.append(timer)
+                        else:
+                            left.append(timer)
+                            bucket.tmin = min(bucket.tmin, timer.t)
+                    bucket.timers = left
+                    if len(left) == 0:
+                        heapq.heappop(self.ticks)
+                        del self.buckets[tick]
+                for timer in timers:
+                    if timer.state == Timer.PENDING:
+                        timer.state = Timer.FIRED
+                        due.append(timer)
+                if tick == last:
+                    break
+            self.numPending -= len(due)
+        return due
+    def popAll(self):
+        '''
+        return every pending Timer regardless of its deadline
+        '''
+        with self.lock:
+            due = [timer for tick in sorted(self.ticks) for timer in self.buckets[tick].timers if timer.state == Timer.PENDING]
+            for timer in due:
+                timer.state = Timer.FIRED
+            self.buckets = {}
+            self.ticks = []
+            self.numPending = 0
+        return due
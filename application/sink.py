@@ -0,0 +1,271 @@
+import os
+import mmap
+import queue
+import struct
+import tempfile
+import threading
+import multiprocessing
+import numpy as np
+
+'''
+Where decoded GCS frames go (see DecodePipeline(sink=...))
+FrameSink.put() never blocks, every sink does its heavy work on its own thread or process
+Usage:
+sink = makeSink('null') # 'null' | 'ring' | 'video' | 'file' | 'display'
+sink.put(frame) # pipeline.Frame
+sink.close()
+'''
+
+class FrameSink():
+    '''
+    Any frame sink must inherit this
+    put() is called by several DecodePipeline workers at once, counters go through statsLock
+    '''
+    def __init__(self):
+        self.statsLock = threading.Lock()
+        self.numPut = 0
+        self.numDropped = 0
+    def put(self, frame):
+        '''
+        Take a pipeline.Frame, must return immediately
+        '''
+        with self.statsLock:
+            self.numPut += 1
+    def drop(self):
+        with self.statsLock:
+            self.numDropped += 1
+    def close(self):
+        pass
+    def stats(self):
+        with self.statsLock:
+            return {'put': self.numPut, 'dropped': self.numDropped}
+
+class NullSink(FrameSink):
+    '''
+    Headless runs, frames are only counted
+    '''
+    pass
+
+RING_HEADER = struct.Struct('<4sIIQ') # magic, number of slots, slot size, write seq
+RING_MAGIC = b'AFRB'
+SLOT_HEADER = struct.Struct('<Qd16sIIIQ') # seq, timestamp, src, height, width, channels, nbytes
+
+class RingBufferSink(FrameSink):
+    '''
+    Latest numSlots raw frames in a memory-mapped file, readable by other processes with RingBufferReader
+    Frames are copied in on a background thread, dropped if it falls maxQueue frames behind
+    A frame larger than slotSize is dropped
+    Slots are guarded by their seq, a reader gets None if the slot is overwritten while it copies
+    '''
+    def __init__(self, path=None, numSlots=8, slotSize=1920*1080*3, maxQueue=8):
+        super().__init__()
+        if path is None:
+            folder = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            path = os.path.join(folder, f'airsimn-frames-{os.getpid()}')
+        self.path = path
+        self.numSlots = numSlots
+        self.slotSize = slotSize
+        self.stride = SLOT_HEADER.size + slotSize
+        self.seq = 0 # frames written, guarded by statsLock
+        with open(path, 'w+b') as f:
+            f.truncate(RING_HEADER.size + numSlots * self.stride)
+            self.map = mmap.mmap(f.fileno(), 0)
+        RING_HEADER.pack_into(self.map, 0, RING_MAGIC, numSlots, slotSize, 0)
+        self.queue = queue.Queue(maxQueue)
+        self.thread = threading.Thread(target=self.run, name='frame-ring', daemon=True)
+        self.thread.start()
+    def put(self, frame):
+        super().put(frame)
+        if frame.image.nbytes > self.slotSize:
+            self.drop()
+            return
+        try:
+            self.queue.put_nowait(frame)
+        except queue.Full:
+            self.drop()
+    def run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            image = np.ascontiguousarray(frame.image)
+            h, w = image.shape[:2]
+            c = image.shape[2] if image.ndim > 2 else 1
+            seq = self.seq + 1
+            offset = RING_HEADER.size + ((seq - 1) % self.numSlots) * self.stride
+            # invalidate the slot, fill it, then publish
+            SLOT_HEADER.pack_into(self.map, offset, 0, 0.0, b'', 0, 0, 0, 0)
+            self.map[offset+SLOT_HEADER.size:offset+SLOT_HEADER.size+image.nbytes] = image.reshape(-1).view(np.uint8)
+            SLOT_HEADER.pack_into(self.map, offset, seq, frame.timestamp, str(frame.src).encode()[:16], h, w, c, image.nbytes)
+            RING_HEADER.pack_into(self.map, 0, RING_MAGIC, self.numSlots, self.slotSize, seq)
+            with self.statsLock:
+                self.seq = seq
+    def close(self):
+        # queued frames are still copied
+        self.queue.put(None)
+        self.thread.join()
+        self.map.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+    def stats(self):
+        ret = super().stats()
+        with self.statsLock:
+            ret['written'] = self.seq
+        return ret
+
+class RingBufferReader():
+    '''
+    Read frames written by RingBufferSink, possibly in another process
+    '''
+    def __init__(self, path):
+        with open(path, 'r+b') as f:
+            self.map = mmap.mmap(f.fileno(), 0)
+        magic, self.numSlots, self.slotSize, seq = RING_HEADER.unpack_from(self.map, 0)
+        if magic != RING_MAGIC:
+            raise ValueError(f'{path} is not a frame ring buffer')
+        self.stride = SLOT_HEADER.size + self.slotSize
+    def lastSeq(self):
+        return RING_HEADER.unpack_from(self.map, 0)[3]
+    def read(self, seq=None):
+        '''
+        return (seq, src, timestamp, image) of frame seq (the latest by default), None if it is gone
+        '''
+        if seq is None:
+            seq = self.lastSeq()
+        if seq <= 0:
+            return None
+        offset = RING_HEADER.size + ((seq - 1) % self.numSlots) * self.stride
+        got, timestamp, src, h, w, c, nbytes = SLOT_HEADER.unpack_from(self.map, offset)
+        if got != seq:
+            return None
+        image = np.frombuffer(self.map, dtype=np.uint8, count=nbytes, offset=offset+SLOT_HEADER.size).copy()
+        if SLOT_HEADER.unpack_from(self.map, offset)[0] != seq: # overwritten while copying
+            return None
+        image = image.reshape((h, w, c) if c > 1 else (h, w))
+        return seq, src.rstrip(b'\0').decode(), timestamp, image
+    def close(self):
+        self.map.close()
+
+def viewRing(path, fps):
+    '''
+    Render the latest frame of the ring buffer at fps, run as a separate process by DisplaySink
+    '''
+    import matplotlib.pyplot as plt
+    try:
+        reader = RingBufferReader(path)
+    except FileNotFoundError: # closed before this process was up
+        return
+    fig = None
+    shown = 0
+    while os.path.exists(path):
+        seq = reader.lastSeq()
+        if seq != shown:
+            got = reader.read(seq)
+            if got is not None:
+                shown, src, timestamp, image = got
+                if fig is None:
+                    fig = plt.imshow(image)
+                else:
+                    fig.set_data(image)
+                plt.title(f'{src} at {timestamp:.2f}')
+        plt.pause(1 / fps)
+    reader.close()
+
+class DisplaySink(RingBufferSink):
+    '''
+    RingBufferSink rendered by matplotlib in another process at its own rate
+    '''
+    def __init__(self, fps=10, **kwargs):
+        super().__init__(**kwargs)
+        self.viewer = multiprocessing.get_context('spawn').Process(target=viewRing, args=(self.path, fps), daemon=True)
+        self.viewer.start()
+    def close(self):
+        super().close() # the viewer exits once the file is removed
+        self.viewer.join(timeout=1.0)
+        if self.viewer.is_alive():
+            self.viewer.terminate()
+
+class WriterSink(FrameSink):
+    '''
+    Write frames on a background thread, one file per source in folder
+    fourcc is a cv2.VideoWriter code, or None to append raw frames (SLOT_HEADER + data) to {src}.raw
+    Frames are dropped if the writer falls maxQueue frames behind
+    '''
+    def __init__(self, folder, fps=10, fourcc='mp4v', maxQueue=64):
+        super().__init__()
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.fps = fps
+        self.fourcc = fourcc
+        self.queue = queue.Queue(maxQueue)
+        self.files = {} # src -> cv2.VideoWriter or file
+        self.numWritten = 0
+        self.thread = threading.Thread(target=self.run, name='frame-writer', daemon=True)
+        self.thread.start()
+    def put(self, frame):
+        super().put(frame)
+        try:
+            self.queue.put_nowait(frame)
+        except queue.Full:
+            self.drop()
+    def open(self, frame):
+        '''
+        Internal use only
+        '''
+        if self.fourcc is None:
+            return open(os.path.join(self.folder, f'{frame.src}.raw'), 'wb')
+        import cv2
+        h, w = frame.image.shape[:2]
+        return cv2.VideoWriter(os.path.join(self.folder, f'{frame.src}.mp4'), cv2.VideoWriter_fourcc(*self.fourcc), self.fps, (w, h))
+    def run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            out = self.files.get(frame.src)
+            if out is None:
+                out = self.open(frame)
+                self.files[frame.src] = out
+            image = np.ascontiguousarray(frame.image)
+            numFrames = self.numWritten # only this thread writes it
+            if self.fourcc is None:
+                h, w = image.shape[:2]
+                c = image.shape[2] if image.ndim > 2 else 1
+                out.write(SLOT_HEADER.pack(numFrames + 1, frame.timestamp, str(frame.src).encode()[:16], h, w, c, image.nbytes))
+                out.write(image.data)
+            else:
+                out.write(image)
+            with self.statsLock:
+                self.numWritten += 1
+        for out in self.files.values():
+            if self.fourcc is None:
+                out.close()
+            else:
+                out.release()
+    def close(self):
+        # queued frames are still written
+        self.queue.put(None)
+        self.thread.join()
+    def stats(self):
+        ret = super().stats()
+        with self.statsLock:
+            ret['written'] = self.numWritten
+        return ret
+
+def makeSink(kind, **kwargs):
+    '''
+    @param kind: 'null' | 'ring' | 'video' | 'file' | 'display'
+    '''
+    if kind == 'null':
+        return NullSink()
+    elif kind == 'ring':
+        return RingBufferSink(**kwargs)
+    elif kind == 'video':
+        return WriterSink(kwargs.pop('folder', 'frames'), **kwargs)
+    elif kind == 'file':
+        return WriterSink(kwargs.pop('folder', 'frames'), fourcc=None, **kwargs)
+    elif kind == 'display':
+        return DisplaySink(**kwargs)
+    raise ValueError(f'unknown sink {kind}')
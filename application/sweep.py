@@ -0,0 +1,204 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import itertools
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from scenario import SCENARIO
+
+'''
+Run main.py over a grid of settings.json keys and scenario globals of appBase.py, several cells at once
+Every cell is its own process with its own settings.json, ipc endpoints (zmqRunDir) and metricsPath under the work dir,
+so cells never share a port; results are read back from the metrics of Router (see metrics.py)
+Every cell runs --repeat times, a cell whose runs disagree is flagged in the table and the sweep exits with 1
+Usage:
+python3 sweep.py --settings ../settings/static.json --emulate --workers 4 \
+    --grid nRbs=6,15,25 --grid TcpSndBufSize=71680,1024000 --grid DIST=0,100 --grid PERIOD=0.01,0.1 \
+    --set TARGET=throughput --set SINK=null --set endTime=5 --out results.csv
+Names in scenario.SCENARIO are scenario globals (of appBase.py), every other name is a settings.json key
+Without --emulate every cell also needs its own NS (--ns) and all cells share the one AirSim server,
+so keep --workers 1 unless the vehicles of the cells do not interfere
+'''
+
+NS_COMMAND = 'cd ../ns-allinone-3.32/ns-3.32 && ./waf --run "scratch/network/network {args}"'
+
+def parseValue(s):
+    '''
+    "6" -> 6, "0.1" -> 0.1, "[0, 0, 10]" -> [0, 0, 10], otherwise the string itself
+    '''
+    try:
+        return json.loads(s)
+    except ValueError:
+        return s
+
+def parseGrid(items):
+    '''
+    ["nRbs=6,15", "DIST=0,100"] -> {"nRbs": [6, 15], "DIST": [0, 100]}
+    a list value is given as JSON: congArea=[0,0,10];[0,0,50]
+    '''
+    grid = {}
+    for item in items:
+        name, values = item.split('=', 1)
+        sep = ';' if values.lstrip().startswith('[') else ','
+        grid[name] = [parseValue(value) for value in values.split(sep)]
+    return grid
+
+def cells(grid):
+    '''
+    return [{name: value, ...}, ...], the cartesian product of grid
+    '''
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+RESULTS = ['returncode', 'flows', 'bytes', 'goodputMbps', 'latencyP50ms', 'latencyP99ms'] # must agree across repeats
+
+def summarize(metricsPath):
+    '''
+    return totals over the pairs of the last dump in metricsPath
+    goodput: sum over pairs in Mbps, latency: the worst pair p50/p99 in ms
+    '''
+    ret = {'flows': 0, 'bytes': 0, 'goodputMbps': 0.0, 'latencyP50ms': 0.0, 'latencyP99ms': 0.0}
+    if not os.path.exists(metricsPath):
+        return ret
+    with open(metricsPath) as f:
+        lines = f.read().splitlines()
+    if len(lines) == 0:
+        return ret
+    for pair in json.loads(lines[-1])['pairs']:
+        ret['flows'] += pair['flows']
+        ret['bytes'] += pair['bytes']
+        ret['goodputMbps'] += pair['goodput'] / 1e6
+        ret['latencyP50ms'] = max(ret['latencyP50ms'], pair['latency'].get('p50', 0) * 1e3)
+        ret['latencyP99ms'] = max(ret['latencyP99ms'], pair['latency'].get('p99', 0) * 1e3)
+    return ret
+
+class Sweep():
+    '''
+    sweep = Sweep(baseSettings, grid, fixed, workDir)
+    rows = sweep.run(workers)
+    '''
+    def __init__(self, baseSettings, grid, fixed=None, workDir=None, emulate=True, nsCommand=NS_COMMAND, timeout=None, repeat=2):
+        with open(baseSettings) as f:
+            self.base = json.load(f)
+        self.grid = grid
+        self.fixed = dict(fixed) if fixed is not None else {}
+        self.workDir = workDir if workDir is not None else tempfile.mkdtemp(prefix='airsimn-sweep-')
+        self.emulate = emulate
+        self.nsCommand = nsCommand
+        self.timeout = timeout
+        self.repeat = max(repeat, 1)
+        self.cells = cells(grid)
+    def prepare(self, i, cell, k=0):
+        '''
+        Internal use only
+        return (dir of run k of the cell, settings path, main.py arguments)
+        '''
+        folder = os.path.join(self.workDir, f'cell{i:04d}-{k}')
+        os.makedirs(folder, exist_ok=True)
+        settings = dict(self.base)
+        scenario = []
+        for name, value in {**self.fixed, **cell}.items():
+            if name in SCENARIO:
+                scenario += ['--scenario', f'{name}={value}']
+            else:
+                settings[name] = value
+        settings.update({
+            'zmqTransport': 'ipc',
+            'zmqRunDir': folder,
+            'metricsPath': os.path.join(folder, 'metrics.jsonl'),
+        })
+        path = os.path.join(folder, 'settings.json')
+        with open(path, 'w') as f:
+            json.dump(settings, f, indent=1)
+        args = ['--settings', path] + scenario + (['--emulate'] if self.emulate else [])
+        return folder, path, args
+    def runCell(self, i, cell, k=0):
+        '''
+        Internal use only
+        run one cell to the end (its run k), return its row
+        '''
+        folder, path, args = self.prepare(i, cell, k)
+        here = os.path.dirname(os.path.abspath(__file__))
+        t0 = time.perf_counter()
+        with open(os.path.join(folder, 'log.txt'), 'w') as log:
+            ns = None
+            if not self.emulate:
+                nsArgs = subprocess.run([sys.executable, os.path.join(here, 'endpoint.py'), path], capture_output=True, text=True, check=True).stdout.strip()
+                ns = subprocess.Popen(self.nsCommand.format(args=nsArgs), shell=True, cwd=here, stdout=log, stderr=subprocess.STDOUT)
+            try:
+                app = subprocess.run([sys.executable, os.path.join(here, 'main.py')] + args, cwd=here,
+                    stdout=log, stderr=subprocess.STDOUT, timeout=self.timeout)
+                code = app.returncode
+            except subprocess.TimeoutExpired:
+                code = 'timeout'
+            if ns is not None:
+                try:
+                    ns.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    ns.kill()
+        row = {'cell': i, **cell, 'returncode': code, 'wallSec': round(time.perf_counter() - t0, 3)}
+        row.update(summarize(os.path.join(folder, 'metrics.jsonl')))
+        return row
+    def run(self, workers=os.cpu_count()):
+        '''
+        return one row per cell in grid order, the row of its first run
+        agree: whether every run of the cell gave the same RESULTS
+        '''
+        runs = [(i, cell, k) for i, cell in enumerate(self.cells) for k in range(self.repeat)]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(self.runCell, *zip(*runs)))
+        rows = []
+        for i in range(len(self.cells)):
+            repeats = results[i * self.repeat:(i + 1) * self.repeat]
+            row = dict(repeats[0])
+            row['agree'] = all(all(other[name] == row[name] for name in RESULTS) for other in repeats[1:])
+            if not row['agree']:
+                print(f'[sweep] cell {i} {self.cells[i]} differs across {self.repeat} runs: ' +
+                    ', '.join(f'{name} {[other[name] for other in repeats]}' for name in RESULTS if any(other[name] != row[name] for other in repeats)))
+            rows.append(row)
+        return rows
+
+def printTable(rows):
+    if len(rows) == 0:
+        return
+    columns = list(rows[0])
+    text = [[f'{row[c]:.3f}' if isinstance(row[c], float) else str(row[c]) for c in columns] for row in rows]
+    widths = [max(len(c), *(len(line[k]) for line in text)) for k, c in enumerate(columns)]
+    print('  '.join(c.rjust(w) for c, w in zip(columns, widths)))
+    for line in text:
+        print('  '.join(v.rjust(w) for v, w in zip(line, widths)))
+
+def writeCsv(rows, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='run main.py over a grid of settings.json keys and appBase.py scenario globals')
+    parser.add_argument('--settings', required=True, help='base settings.json of every cell')
+    parser.add_argument('--grid', action='append', default=[], metavar='NAME=V1,V2,...')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE', help='the same in every cell')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--emulate', action='store_true', help='run every cell against nsemu.py and the stub AirSim client')
+    parser.add_argument('--ns', default=NS_COMMAND, help='shell command starting NS for a cell, {args} are its endpoint arguments')
+    parser.add_argument('--timeout', type=float, default=None, help='wall seconds of a cell')
+    parser.add_argument('--repeat', type=int, default=2, help='runs of every cell, they must agree')
+    parser.add_argument('--work-dir', default=None, help='settings, logs and metrics of every cell, a temp dir by default')
+    parser.add_argument('--out', default='', help='also write the table to this .csv')
+    args = parser.parse_args()
+    fixed = {name: parseValue(value) for name, value in (item.split('=', 1) for item in args.set)}
+    sweep = Sweep(args.settings, parseGrid(args.grid), fixed, args.work_dir, args.emulate, args.ns, args.timeout, args.repeat)
+    print(f'[sweep] {len(sweep.cells)} cells x {sweep.repeat} runs, {args.workers} workers, in {sweep.workDir}')
+    t0 = time.perf_counter()
+    rows = sweep.run(args.workers)
+    print(f'[sweep] done in {time.perf_counter() - t0:.1f} sec')
+    printTable(rows)
+    if args.out:
+        writeCsv(rows, args.out)
+    sys.exit(0 if all(row['agree'] for row in rows) else 1)
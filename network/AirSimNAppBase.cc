@@ -2,6 +2,7 @@
 #include <map>
 #include <string>
 #include <cstring>
+#include <iomanip>
 // ns3 includes
 #include "ns3/core-module.h"
 #include "ns3/network-module.h"
@@ -18,6 +19,8 @@
 using namespace std;
 using namespace ns3;
 
+extern NetConfig config;
+
 NS_LOG_COMPONENT_DEFINE("AirSimNAppBase");
 
 AirSimNAppBase::AirSimNAppBase()
@@ -81,14 +84,7 @@ void AirSimNAppBase::recvCallback(Ptr<Socket> socket)
         // NS_LOG_INFO("[" << m_name << "], recv traffic from " << m_address2Name[from] << ", size " << packet->GetSize());
     }
     else{ // don't read, we have known who it is, forward to py application 
-        std::stringstream ss;
-        std::string s;
-
-        ss << m_address2Name[from] << " " << m_name << " " << FLOWOP_RECV << " " << packet->GetSize();
-        s = ss.str();
-        zmq::message_t message(s.size());
-        memcpy((uint8_t*)(message.data()), s.data(), s.size());
-        m_zmqSocketSend.send(message, zmq::send_flags::dontwait);
+        report(WIRE_OP_RECV, m_address2Name[from], m_name, packet->GetSize(), -1);
         NS_LOG_INFO("[NS Time: " << Simulator::Now().GetSeconds() << "], [" << m_name  << " recv] from-\"" << m_address2Name[from] << "\", " << packet->GetSize() << " bytes");
     }
 }
@@ -161,14 +157,7 @@ void AirSimNAppBase::triggerFlow(Ptr<Socket> socket, uint32_t txSpace)
         }
 
         // report to py app
-        std::stringstream ss;
-        std::string s;
-        ss << m_name << " " << m_socket2Name[socket] << " " << FLOWOP_SEND << " " << packet->GetSize() << " " << m_flows2Dst[socket].front();
-        s = ss.str();
-        zmq::message_t message(s.size());
-
-        memcpy((uint8_t*)(message.data()), s.data(), s.size());
-        m_zmqSocketSend.send(message, zmq::send_flags::dontwait);
+        report(WIRE_OP_SEND, m_name, m_socket2Name[socket], packet->GetSize(), fid);
         NS_LOG_INFO("[NS Time: " << Simulator::Now().GetSeconds() << "], [" << m_name  << " send] to " << m_socket2Name[socket] << ", " << size << " bytes");
     }
 }
@@ -190,10 +179,96 @@ void AirSimNAppBase::flowTransfer(std::string dst)
     }
     triggerFlow(socket, socket->GetTxAvailable());
 }
+/* start a flow requested by py app, or queue it if dst has not authed yet */
+void AirSimNAppBase::enqueueFlow(int fid, uint32_t size, std::string dst)
+{
+    flow::Flow f(fid, size, dst);
+    Ptr<Socket> socket;
+
+    // dst is known, safe
+    if(m_name2Socket.find(dst) != m_name2Socket.end()){
+        socket = m_name2Socket[dst];
+        m_flows[fid] = f;
+        if(m_flows2Dst.find(socket) == m_flows2Dst.end()){
+            m_flows2Dst[socket] = std::queue<int>();
+        }
+        m_flows2Dst[socket].push(fid);
+        triggerFlow(socket, socket->GetTxAvailable());
+    }
+    else{ // keep queuing to pending flow
+        if(m_pendingFlow.find(dst) == m_pendingFlow.end()){
+            m_pendingFlow[dst] = queue<int>();
+        }
+        m_pendingFlow[dst].push(fid);
+        NS_LOG_INFO("[" << m_name << "], queue flow " << fid);
+    }
+}
+/*
+Report to py app
+text: <src> <dst> "SEND" <size> <fid> <t> | <src> <dst> "RECV" <size> <t>
+binary: one WireRecord and its time appended to the batch, sent by flushReport()
+t is the sim time of the event so that py metrics are not quantized to the step
+*/
+void AirSimNAppBase::report(uint8_t op, const std::string &src, const std::string &dst, uint32_t size, int fid)
+{
+    double t = Simulator::Now().GetSeconds();
+
+    if(config.useBinaryWire){
+        flow::WireRecord rec = {};
+        std::size_t offset = m_reportBuf.size();
+
+        rec.src = endpointId(src);
+        rec.dst = endpointId(dst);
+        rec.op = op;
+        rec.size = size;
+        rec.fid = fid;
+        m_reportBuf.resize(offset + sizeof(rec) + sizeof(t));
+        memcpy(m_reportBuf.data() + offset, &rec, sizeof(rec));
+        memcpy(m_reportBuf.data() + offset + sizeof(rec), &t, sizeof(t));
+        m_reportCount++;
+        if(m_reportCount >= WIRE_MAX_RECORDS){
+            flushReport();
+        }
+    }
+    else{
+        std::stringstream ss;
+        std::string s;
+
+        ss << src << " " << dst << " " << (op == WIRE_OP_SEND ? FLOWOP_SEND : FLOWOP_RECV) << " " << size;
+        if(op == WIRE_OP_SEND){
+            ss << " " << fid;
+        }
+        ss << " " << std::setprecision(17) << t;
+        s = ss.str();
+        zmq::message_t message(s.size());
+        memcpy((uint8_t*)(message.data()), s.data(), s.size());
+        m_zmqSocketSend.send(message, zmq::send_flags::dontwait);
+    }
+}
+/* send all batched records in one frame */
+void AirSimNAppBase::flushReport(void)
+{
+    if(m_reportCount == 0){
+        return;
+    }
+    flow::WireHeader header = {};
+    header.version = WIRE_VERSION;
+    header.flags = WIRE_FLAG_TIMED;
+    header.count = m_reportCount;
+
+    zmq::message_t message(sizeof(header) + m_reportBuf.size());
+    memcpy((uint8_t*)(message.data()), &header, sizeof(header));
+    memcpy((uint8_t*)(message.data()) + sizeof(header), m_reportBuf.data(), m_reportBuf.size());
+    m_zmqSocketSend.send(message, zmq::send_flags::dontwait);
+
+    m_reportBuf.clear();
+    m_reportCount = 0;
+}
 /*
 Process request from py app
-<flowid> "SEND" <size> <dst>
-<flowid> "STOP" 
+text: <flowid> "SEND" <size> <dst>
+text: <flowid> "STOP" 
+binary: WireHeader + WireRecord(s) with src = this app
 */
 void AirSimNAppBase::processReq(void)
 {
@@ -206,6 +281,28 @@ void AirSimNAppBase::processReq(void)
 
     res = m_zmqSocketRecv.recv(message, zmq::recv_flags::dontwait);
     while(res.has_value() && res.value() != -1){ // not EAGAIN
+        const uint8_t *data = (const uint8_t*)(message.data());
+        if(message.size() >= sizeof(flow::WireHeader) && data[0] == WIRE_VERSION){
+            flow::WireHeader header;
+            memcpy(&header, data, sizeof(header));
+            if(message.size() != sizeof(header) + header.count * sizeof(flow::WireRecord)){
+                NS_FATAL_ERROR("[" << m_name << "], malformed req of " << message.size() << " bytes");
+            }
+            for(int i = 0; i < header.count; i++){
+                flow::WireRecord rec;
+                memcpy(&rec, data + sizeof(header) + i * sizeof(rec), sizeof(rec));
+                NS_LOG_INFO("[" << m_name << "], req: fid " << rec.fid << ", op " << (int)rec.op << ", size " << rec.size << ", dst " << rec.dst);
+                if(rec.op == WIRE_OP_SEND){
+                    enqueueFlow(rec.fid, rec.size, endpointName(rec.dst));
+                }
+                else{
+                    NS_FATAL_ERROR("op:\"" << (int)rec.op << "\" not handled");
+                }
+            }
+            message.rebuild();
+            res = m_zmqSocketRecv.recv(message, zmq::recv_flags::dontwait);
+            continue;
+        }
         int fid;
         std::stringstream ss(message.to_string());
         std::string op;
@@ -213,30 +310,11 @@ void AirSimNAppBase::processReq(void)
         ss >> fid >> op;
         NS_LOG_INFO("[" << m_name << "], req:\"" << message.to_string() << "\"");
         if(op == FLOWOP_SEND){
-            int size;
+            uint32_t size;
             std::string dst;
-            Ptr<Socket> socket;
 
             ss >> size >> dst;
-            flow::Flow f(fid, size, dst);
-
-            // dst is known, safe
-            if(m_name2Socket.find(dst) != m_name2Socket.end()){
-                socket = m_name2Socket[dst];
-                m_flows[fid] = f;
-                if(m_flows2Dst.find(socket) == m_flows2Dst.end()){
-                    m_flows2Dst[socket] = std::queue<int>();
-                }
-                m_flows2Dst[socket].push(fid);
-                triggerFlow(socket, socket->GetTxAvailable());
-            }
-            else{ // keep queuing to pending flow
-                if(m_pendingFlow.find(dst) == m_pendingFlow.end()){
-                    m_pendingFlow[dst] = queue<int>();
-                }
-                m_pendingFlow[dst].push(fid);
-                NS_LOG_INFO("[" << m_name << "], queue flow " << fid);
-            }
+            enqueueFlow(fid, size, dst);
         }
         // else if(op == FLOWOP_STOP){ // a flow can be stopped if it was not started yet
         //     int succ = 0;
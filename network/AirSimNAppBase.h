@@ -35,6 +35,8 @@ public:
 
     // Setup() is not defined here
     virtual void processReq(void);
+    // send batched reports (binary wire) to py Router, called at each step boundary
+    virtual void flushReport(void);
 protected:
     // socket callbacks
     virtual void acceptCallback(Ptr<Socket> socket, const Address& from);
@@ -49,6 +51,9 @@ protected:
     // flow related
     virtual void triggerFlow(Ptr<Socket> socket, uint32_t txSpace);
     virtual void flowTransfer(std::string dst);
+    virtual void enqueueFlow(int fid, uint32_t size, std::string dst);
+    // report SEND/RECV progress to py Router
+    virtual void report(uint8_t op, const std::string &src, const std::string &dst, uint32_t size, int fid);
 
     // ns stuff
     bool m_running = false;
@@ -62,6 +67,8 @@ protected:
     std::string m_name; // name of this application
     zmq::socket_t m_zmqSocketSend; // send message to py app
     zmq::socket_t m_zmqSocketRecv; // recv message from py app
+    std::vector<uint8_t> m_reportBuf; // pending binary records (header excluded)
+    uint16_t m_reportCount = 0;
     
     // Flow related
     std::set<Address> m_addressKnown; // in set, don't read packet, else read and record to m_connectedSockets
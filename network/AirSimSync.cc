@@ -32,6 +32,21 @@ NS_LOG_COMPONENT_DEFINE("AirSimNSync");
 
 static msr::airlib::MultirotorRpcLibClient client;
 
+std::string ZmqEndpoints::bind(int port) const
+{
+    if(transport == "tcp"){
+        return "tcp://*:" + to_string(port + portBase);
+    }
+    return connect(port);
+}
+std::string ZmqEndpoints::connect(int port) const
+{
+    if(transport == "tcp"){
+        return "tcp://localhost:" + to_string(port + portBase);
+    }
+    return "ipc://" + runDir + "/" + to_string(port);
+}
+
 std::istream& operator>>(istream & is, NetConfig &config)
 {
     int numOfUav, numOfEnb;
@@ -54,7 +69,7 @@ std::istream& operator>>(istream & is, NetConfig &config)
     // net config group
     is >> config.nRbs >> config.TcpSndBufSize >> config.TcpRcvBufSize >> config.CqiTimerThreshold;
     is >> config.LteTxPower >> config.p2pDataRate >> config.p2pMtu >> config.p2pDelay;
-    is >> config.useWifi;
+    is >> config.useWifi >> config.useBinaryWire;
     
     is >> config.isMainLogEnabled >> config.isGcsLogEnabled >> config.isUavLogEnabled >> config.isCongLogEnabled >> config.isSyncLogEnabled;
 
@@ -81,16 +96,39 @@ std::ostream& operator<<(ostream & os, const NetConfig &config)
     os << "nRbs: " << config.nRbs << ", TcpSndBufSize:" << config.TcpSndBufSize << ", TcpRcvBufSize:" << config.TcpRcvBufSize << endl;
     os << "CqiTimerThreshold: " << config.CqiTimerThreshold << ", LteTxPower: " << config.LteTxPower << ", p2pDataRate:" << config.p2pDataRate << ", p2pMtu: " << config.p2pMtu << ", p2pDelay: " << config.p2pDelay << endl;
     
-    os << "useWifi: " << config.useWifi;
+    os << "useWifi: " << config.useWifi << ", useBinaryWire: " << config.useBinaryWire;
     return os;
 }
+int endpointId(const std::string &name)
+{
+    if(name == "GCS"){
+        return 0;
+    }
+    for(int i = 0; i < config.uavsName.size(); i++){
+        if(config.uavsName[i] == name){
+            return i + 1;
+        }
+    }
+    NS_FATAL_ERROR("endpoint \"" << name << "\" is not registered");
+    return -1;
+}
+std::string endpointName(int id)
+{
+    if(id == 0){
+        return "GCS";
+    }
+    if(id < 1 || id > config.uavsName.size()){
+        NS_FATAL_ERROR("endpoint id " << id << " is not registered");
+    }
+    return config.uavsName[id - 1];
+}
 
 AirSimSync::AirSimSync(zmq::context_t &context): event()
 {
     zmqRecvSocket = zmq::socket_t(context, ZMQ_PULL);
-    zmqRecvSocket.connect("tcp://localhost:" + to_string(AIRSIM2NS_CTRL_PORT));
+    zmqRecvSocket.connect(zmqEndpoints.connect(AIRSIM2NS_CTRL_PORT));
     zmqSendSocket = zmq::socket_t(context, ZMQ_PUSH);
-    zmqSendSocket.bind("tcp://*:" + to_string(NS2AIRSIM_CTRL_PORT));
+    zmqSendSocket.bind(zmqEndpoints.bind(NS2AIRSIM_CTRL_PORT));
 
     try{
         client.confirmConnection();
@@ -131,6 +169,11 @@ void AirSimSync::takeTurn(Ptr<GcsApp> &gcsApp, std::vector< Ptr<UavApp> > &uavsA
     zmq::message_t ntf(1);
     float step; // next simulation step
     
+    // deliver reports batched during the last step before AirSim's turn
+    gcsApp->flushReport();
+    for(auto &it:uavsApp){
+        it->flushReport();
+    }
     // notify AirSim
     zmqSendSocket.send(ntf, zmq::send_flags::dontwait);
     
@@ -172,7 +215,16 @@ void AirSimSync::takeTurn(Ptr<GcsApp> &gcsApp, std::vector< Ptr<UavApp> > &uavsA
         // ns' turn at time t, AirSim at time t + 1
         // packet send
         step = std::stof(s);
-        mobilityUpdateDirect();
+        // Ctrl appends the fleet state, query AirSim only if it is absent
+        bool isUpdated = false;
+        if(message.more()){
+            zmq::message_t fleet;
+            res = zmqRecvSocket.recv(fleet, zmq::recv_flags::none);
+            isUpdated = res.has_value() && mobilityUpdateFleet(fleet);
+        }
+        if(!isUpdated){
+            mobilityUpdateDirect();
+        }
         gcsApp->processReq();
         for(int i = 0; i < uavsApp.size(); i++){
             uavsApp[i]->processReq();
@@ -192,7 +244,21 @@ void AirSimSync::mobilityUpdateDirect()
         float x, y, z;
         x = state.pose.position.x();
         y = state.pose.position.y();
-        y = state.pose.position.z();
+        z = state.pose.position.z();
         ns3::Simulator::ScheduleNow(&ConstantPositionMobilityModel::SetPosition, it.second, Vector(x, y, z));
     }
+}
+bool AirSimSync::mobilityUpdateFleet(const zmq::message_t &fleet)
+{
+    std::size_t numUav = config.uavsName.size();
+    if(fleet.size() != numUav * FLEET_WIDTH * sizeof(double)){
+        NS_LOG_INFO("fleet state of " << fleet.size() << " bytes does not match " << numUav << " UAVs");
+        return false;
+    }
+    const double *rows = static_cast<const double*>(fleet.data());
+    for(auto it:m_uavsMobility){
+        const double *row = rows + (endpointId(it.first) - 1) * FLEET_WIDTH;
+        ns3::Simulator::ScheduleNow(&ConstantPositionMobilityModel::SetPosition, it.second, Vector(row[0], row[1], row[2]));
+    }
+    return true;
 }
\ No newline at end of file
@@ -27,6 +27,18 @@
 // UAV,GCS -> (Pub-Sub) -> Router
 #define NS2ROUTER_PORT (9000)
 
+// the ports above name the sockets, the address depends on the transport
+// same as application/endpoint.py, set from the command line (python3 endpoint.py settings.json)
+struct ZmqEndpoints
+{
+    std::string transport = "tcp"; // tcp | ipc, inproc needs the Python stand-in
+    int portBase = 0; // added to every tcp port
+    std::string runDir = "/tmp/airsimn"; // ipc sockets go here
+    std::string bind(int port) const;
+    std::string connect(int port) const;
+};
+extern ZmqEndpoints zmqEndpoints;
+
 
 /* NS ports */
 // Starting port sequence used by each application to connect to others
@@ -37,6 +49,10 @@
 
 #define CONG_APP_TOKEN "__anony"
 
+// fleet state sent by Ctrl after each step: double[numUav][FLEET_WIDTH] in uavsName order
+// row = x, y, z, orientation (x, y, z, w), linear velocity (x, y, z), angular velocity (x, y, z)
+#define FLEET_WIDTH (13)
+
 // Start time
 #define GCS_APP_START_TIME (0.1)
 #define UAV_APP_START_TIME (0.2)
@@ -63,6 +79,7 @@ struct NetConfig
     uint p2pMtu;
     double p2pDelay;
     int useWifi;
+    int useBinaryWire;
     
     int isMainLogEnabled;
     int isGcsLogEnabled;
@@ -75,6 +92,10 @@ struct NetConfig
 std::istream& operator>>(istream & is, NetConfig &config);
 std::ostream& operator<<(ostream & os, const NetConfig &config);
 
+// endpoint id used by binary wire protocol: GCS is 0, uavsName[i] is i+1
+int endpointId(const std::string &name);
+std::string endpointName(int id);
+
 class AirSimSync
 {
 public:
@@ -94,6 +115,8 @@ private:
     bool waitOnAirSim = true;
 
     void mobilityUpdateDirect();
+    // update mobility from the fleet state carried by the step message, return false if it is malformed
+    bool mobilityUpdateFleet(const zmq::message_t &fleet);
     // use their names to refer to AirSim vehicle key and update mobility directly
     std::map< std::string, Ptr<ConstantPositionMobilityModel> > m_uavsMobility;
 };
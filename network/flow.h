@@ -1,11 +1,27 @@
 #ifndef INCLUDE_FLOW_H
 #define INCLUDE_FLOW_H
 #include <string>
+#include <cstdint>
 
 #define FLOWOP_SEND "SEND"
 #define FLOWOP_RECV "RECV"
 #define FLOWOP_STOP "STOP"
 
+/*
+Binary wire protocol (useBinaryWire=1), see application/router.py
+A frame is one WireHeader followed by WireHeader.count WireRecord
+With WIRE_FLAG_TIMED (reports to py Router), each WireRecord is followed by a double, the sim time in sec of the event
+All fields are little-endian, endpoint id 0 is GCS, id i+1 is uavsName[i]
+The first byte of a text message is always printable, so a version byte < 0x20 tells them apart
+*/
+#define WIRE_VERSION (1)
+#define WIRE_OP_SEND (1)
+#define WIRE_OP_RECV (2)
+#define WIRE_OP_STOP (3)
+#define WIRE_FLAG_TIMED (0x1)
+// max records batched in one frame before it is flushed
+#define WIRE_MAX_RECORDS (4096)
+
 namespace flow{
 
 struct Flow
@@ -20,5 +36,25 @@ struct Flow
     std::string dst;
 };
 
+#pragma pack(push, 1)
+struct WireHeader
+{
+    uint8_t version;
+    uint8_t flags; // WIRE_FLAG_*
+    uint16_t count;
+};
+struct WireRecord
+{
+    uint16_t src;
+    uint16_t dst;
+    uint8_t op;
+    uint8_t pad[3];
+    uint32_t size;
+    int32_t fid; // -1 if not applicable (RECV)
+};
+#pragma pack(pop)
+static_assert(sizeof(WireHeader) == 4, "WireHeader must be 4 bytes");
+static_assert(sizeof(WireRecord) == 16, "WireRecord must be 16 bytes");
+
 }
-#endif
\ No newline at end of file
+#endif
@@ -60,10 +60,10 @@ void GcsApp::Setup(zmq::context_t &context,
     m_address = address;
 
     m_zmqSocketSend = zmq::socket_t(context, ZMQ_PUSH);
-    m_zmqSocketSend.connect("tcp://localhost:" + to_string(NS2ROUTER_PORT));
+    m_zmqSocketSend.connect(zmqEndpoints.connect(NS2ROUTER_PORT));
     
     m_zmqSocketRecv = zmq::socket_t(context, ZMQ_PULL);
-    m_zmqSocketRecv.connect("tcp://localhost:" + to_string(zmqRecvPort));
+    m_zmqSocketRecv.connect(zmqEndpoints.connect(zmqRecvPort));
 
     m_name = name;
 }
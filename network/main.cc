@@ -51,6 +51,7 @@ using namespace ns3;
 NS_LOG_COMPONENT_DEFINE ("AirSimN");
 
 NetConfig config;
+ZmqEndpoints zmqEndpoints;
 
 int main(int argc, char *argv[])
 {
@@ -59,7 +60,13 @@ int main(int argc, char *argv[])
   srand (static_cast <unsigned> (time(0)));
 
   CommandLine cmd (__FILE__);
+  cmd.AddValue ("zmqTransport", "tcp or ipc, same as zmqTransport in settings.json", zmqEndpoints.transport);
+  cmd.AddValue ("zmqPortBase", "added to every ZMQ tcp port", zmqEndpoints.portBase);
+  cmd.AddValue ("zmqRunDir", "directory of the ZMQ ipc sockets", zmqEndpoints.runDir);
   cmd.Parse (argc, argv);
+  if(zmqEndpoints.transport != "tcp" && zmqEndpoints.transport != "ipc"){
+    NS_FATAL_ERROR("zmqTransport \"" << zmqEndpoints.transport << "\" is not supported by NS, use tcp or ipc");
+  }
 
   AirSimSync sync(context);
   sync.readNetConfigFromAirSim(config);
@@ -63,9 +63,9 @@ void UavApp::Setup(zmq::context_t &context,
 
     m_zmqSocketSend = zmq::socket_t(context, ZMQ_PUSH);
     // this port is bind by sub side
-    m_zmqSocketSend.connect("tcp://localhost:" + to_string(NS2ROUTER_PORT));
+    m_zmqSocketSend.connect(zmqEndpoints.connect(NS2ROUTER_PORT));
     m_zmqSocketRecv = zmq::socket_t(context, ZMQ_PULL);
-    m_zmqSocketRecv.connect("tcp://localhost:" + to_string(zmqRecvPort));
+    m_zmqSocketRecv.connect(zmqEndpoints.connect(zmqRecvPort));
 }
 /* Bind ns sockets and logging*/
 void UavApp::StartApplication(void)
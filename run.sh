@@ -11,6 +11,8 @@ UE4_PROJECT_ROOT="$UNREAL_ENV/LinuxNoEditor/"
 echo "Using Unreal Env as $UNREAL_ENV"
 
 cp $1 $HOME/Documents/AirSim/settings.json
+# ZMQ transport, port base and ipc directory of settings.json for ns-3 (see application/endpoint.py)
+NS_ARGS=$(python3 application/endpoint.py $1)
 
 cd $NS3
 ./waf > "$PROJECT_DIR/log/network.log"
@@ -27,7 +29,7 @@ app_pid=$!
 cd -
 
 cd $NS3
-./waf --run scratch/network/network >> "$PROJECT_DIR/log/network.log" 2>&1
+./waf --run "scratch/network/network $NS_ARGS" >> "$PROJECT_DIR/log/network.log" 2>&1
 ns_pid=$!
 cd -
 